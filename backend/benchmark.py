@@ -0,0 +1,419 @@
+"""Latency benchmark for the API
+
+Drives the ASGI app in-process with httpx against a seeded store and
+reports p50/p95/p99 latency, throughput and storage commands per endpoint.
+
+    python benchmark.py                          # in-memory store
+    python benchmark.py --backend mongo          # MONGO_URL, database BENCH_DB_NAME (dropped!)
+    python benchmark.py --save baseline.json     # record a baseline
+    python benchmark.py --baseline baseline.json # exit 1 on regression
+    python benchmark.py --history 100,1000,10000,100000
+    python benchmark.py --households 1,100,10000
+
+With the in-memory store every repository call counts as one command, so
+the counts stay comparable with the Mongo commands seen on a real database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from typing import List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--tasks-per-day", type=int, default=3)
+    parser.add_argument("--weekly-tasks", type=int, default=2)
+    parser.add_argument("--completions", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with this JSON file and fail on regression")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed p95 slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore p95 slowdowns smaller than this")
+    parser.add_argument("--history", help="comma separated completion counts for the history-growth run")
+    parser.add_argument("--history-max-ratio", type=float, default=2.0,
+                        help="allowed p50 ratio between the largest and smallest history")
+    parser.add_argument("--households", help="comma separated household counts for the tenant-growth run")
+    parser.add_argument("--households-max-ratio", type=float, default=2.0,
+                        help="allowed p50 ratio between the most and fewest households")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["STORAGE_BACKEND"] = args.backend
+os.environ.setdefault("HEALTH_DECAY_SCHEDULER", "0")
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+from storage import CountingStore  # noqa: E402
+
+
+def count_command(name: str):
+    """Each repository call counts as one command of the current request"""
+    stats = server.current_request_stats.get()
+    if stats is not None:
+        stats.add(0.0)
+
+
+async def make_store():
+    """A fresh, empty store of the selected backend"""
+    if args.backend == "memory":
+        return CountingStore(server.MemoryStore(), count_command)
+    database = server.client[os.environ.get('BENCH_DB_NAME', 'benchmark')]
+    await server.client.drop_database(database.name)
+    store = server.MongoStore(database)
+    await store.ensure_indexes()
+    return store
+
+
+def user_doc(n: int, last_check_date, household_id: str = server.DEFAULT_HOUSEHOLD) -> dict:
+    return {
+        "id": f"user_bench_{n:05d}",
+        "household_id": household_id,
+        "name": f"Bench {n}",
+        "health": 15,
+        "level": 1,
+        "points": 0,
+        "strength": 10,
+        "agility": 10,
+        "charisma": 10,
+        "endurance": 10,
+        "is_admin": n == 0,
+        "game_over": False,
+        "last_check_date": last_check_date
+    }
+
+
+def task_doc(task_id: str, year: int, week_number: int, day_of_week, created_at: str,
+             household_id: str = server.DEFAULT_HOUSEHOLD) -> dict:
+    return {
+        "id": task_id,
+        "household_id": household_id,
+        "title": task_id,
+        "points": 10,
+        "strength": 1,
+        "agility": 1,
+        "charisma": 1,
+        "endurance": 1,
+        "is_weekly": day_of_week is None,
+        "day_of_week": day_of_week,
+        "assigned_to": None,
+        "week_number": week_number,
+        "year": year,
+        "is_active": True,
+        "created_at": created_at
+    }
+
+
+async def seed(store, rng: random.Random, today) -> dict:
+    """Seed users, `weeks` weeks of tasks up to this one, and random past completions"""
+    yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    users = [user_doc(n, yesterday if n % 2 else None) for n in range(args.users)]
+    await store.users.insert_many(users)
+    await store.rewards.insert_many(server.DEFAULT_HOUSEHOLD, [
+        {"level": n, "title": "Ödül", "description": f"Seviye {n}", "is_big": n % 5 == 0}
+        for n in range(1, 51)
+    ])
+    
+    tasks = []
+    past_days = []  # (date string, task id) pairs that can be completed
+    today_tasks = []
+    for w in range(args.weeks - 1, -1, -1):
+        week_day = today - timedelta(weeks=w)
+        year, week_number, _ = week_day.isocalendar()
+        monday = week_day - timedelta(days=week_day.weekday())
+        created_at = monday.isoformat()
+        for weekday in range(7):
+            day = monday + timedelta(days=weekday)
+            for n in range(args.tasks_per_day):
+                task_id = f"task_{year}w{week_number:02d}d{weekday}n{n}"
+                tasks.append(task_doc(task_id, year, week_number, server.get_turkish_day_name(weekday), created_at))
+                if day.date() < today.date():
+                    past_days.append((day.strftime("%Y-%m-%d"), task_id))
+                elif day.date() == today.date():
+                    today_tasks.append(task_id)
+        for n in range(args.weekly_tasks):
+            task_id = f"task_{year}w{week_number:02d}weekly{n}"
+            tasks.append(task_doc(task_id, year, week_number, None, created_at))
+            if w == 0:
+                today_tasks.append(task_id)
+    await store.tasks.insert_many(tasks)
+    
+    completions = []
+    if past_days:
+        for _ in range(args.completions):
+            user = rng.choice(users)
+            day, task_id = rng.choice(past_days)
+            completions.append({
+                "id": f"{user['id']}_{task_id}_{day}",
+                "household_id": server.DEFAULT_HOUSEHOLD,
+                "user_id": user["id"],
+                "task_id": task_id,
+                "completed_date": day
+            })
+    await store.completions.insert_many(completions)
+    return {"users": [u["id"] for u in users], "admin": users[0]["id"], "today_tasks": today_tasks}
+
+
+def request_mix(seeded: dict, rng: random.Random):
+    """Pick the next request: (endpoint label, method, url, json body)"""
+    user_id = rng.choice(seeded["users"])
+    admin = seeded["admin"]
+    roll = rng.random()
+    if roll < 0.45:
+        return "GET /api/dashboard", "GET", f"/api/dashboard?user_id={user_id}", None
+    if roll < 0.55:
+        return "GET /api/tasks/weekly", "GET", f"/api/tasks/weekly?user_id={user_id}", None
+    if roll < 0.75:
+        task_id = rng.choice(seeded["today_tasks"])
+        return "POST /api/tasks/complete", "POST", "/api/tasks/complete", {"user_id": user_id, "task_id": task_id}
+    if roll < 0.85:
+        return "POST /api/daily-check", "POST", f"/api/daily-check?user_id={user_id}", None
+    if roll < 0.93:
+        return "GET /api/users/all/list", "GET", f"/api/users/all/list?user_id={admin}&limit=100", None
+    return "GET /api/tasks/week", "GET", f"/api/tasks/week?user_id={admin}&limit=100", None
+
+
+def command_count(response: httpx.Response) -> int:
+    """Commands the request issued, from the Server-Timing header"""
+    timing = response.headers.get("server-timing", "")
+    _, _, desc = timing.partition('desc="')
+    try:
+        return int(desc.split(" ", 1)[0])
+    except ValueError:
+        return 0
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    result = {}
+    for label, entries in sorted(samples.items()):
+        latencies = [ms for ms, _, _ in entries]
+        result[label] = {
+            "count": len(entries),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "rps": round(len(entries) / elapsed, 1),
+            "commands_per_request": round(sum(c for _, c, _ in entries) / len(entries), 2),
+            "errors": sum(1 for _, _, status in entries if status >= 500)
+        }
+    return result
+
+
+async def run_mix(client: httpx.AsyncClient, seeded: dict, rng: random.Random) -> dict:
+    """Replay the request mix with `concurrency` workers"""
+    plan = [request_mix(seeded, rng) for _ in range(args.requests)]
+    samples = {}
+    
+    async def worker(offset: int):
+        for label, method, url, body in plan[offset::args.concurrency]:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            elapsed = (time.perf_counter() - start) * 1000
+            samples.setdefault(label, []).append((elapsed, command_count(response), response.status_code))
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": args.requests,
+        "seconds": round(elapsed, 3),
+        "rps": round(args.requests / elapsed, 1),
+        "endpoints": summarize(samples, elapsed)
+    }
+
+
+async def run_history(client: httpx.AsyncClient, sizes: List[int], today) -> dict:
+    """Weekly tasks and dashboard latency for one user as their history grows"""
+    result = {}
+    year, week_number, _ = today.isocalendar()
+    for size in sizes:
+        store = await make_store()
+        server.set_store(store)
+        await store.users.insert_many([user_doc(0, today.strftime("%Y-%m-%d"))])
+        await store.tasks.insert_many([
+            task_doc(f"task_now_{n}", year, week_number, None, today.isoformat()) for n in range(5)
+        ])
+        # Old completions of tasks from earlier weeks, one per day going back
+        await store.completions.insert_many([
+            {
+                "id": f"old_{n}",
+                "household_id": server.DEFAULT_HOUSEHOLD,
+                "user_id": "user_bench_00000",
+                "task_id": f"task_old_{n}",
+                "completed_date": (today - timedelta(days=n // 10 + 1)).strftime("%Y-%m-%d")
+            }
+            for n in range(size)
+        ])
+        
+        samples = {}
+        for n in range(200):
+            for label, url in (
+                ("GET /api/tasks/weekly", "/api/tasks/weekly"),
+                ("GET /api/dashboard", "/api/dashboard")
+            ):
+                # A distinct query string makes every request miss the response cache
+                start = time.perf_counter()
+                response = await client.get(f"{url}?user_id=user_bench_00000&_={n}")
+                elapsed = (time.perf_counter() - start) * 1000
+                samples.setdefault(label, []).append((elapsed, command_count(response), response.status_code))
+        result[str(size)] = summarize(samples, 1.0)
+        print(f"history {size:>7}: " + ", ".join(
+            f"{label} p50 {stats['p50_ms']:.2f} ms" for label, stats in result[str(size)].items()
+        ))
+    return result
+
+
+async def run_tenants(client: httpx.AsyncClient, counts: List[int], today, rng: random.Random) -> dict:
+    """Per-request latency as the number of households grows, each holding the same small data"""
+    result = {}
+    year, week_number, _ = today.isocalendar()
+    today_str = today.strftime("%Y-%m-%d")
+    day_name = server.get_turkish_day_name(today.weekday())
+    for count in counts:
+        store = await make_store()
+        server.set_store(store)
+        users, tasks = [], []
+        for h in range(count):
+            household_id = f"household_{h:05d}"
+            members = [user_doc(2 * h + n, today_str, household_id) for n in range(2)]
+            members[0]["is_admin"] = True
+            users.extend(members)
+            for n in range(args.tasks_per_day + args.weekly_tasks):
+                tasks.append(task_doc(
+                    f"task_{household_id}_{n}", year, week_number,
+                    day_name if n < args.tasks_per_day else None, today.isoformat(), household_id
+                ))
+        await store.users.insert_many(users)
+        await store.tasks.insert_many(tasks)
+        
+        samples = {}
+        for n in range(300):
+            h = rng.randrange(count)
+            user_id = f"user_bench_{2 * h + 1:05d}"
+            admin_id = f"user_bench_{2 * h:05d}"
+            task_id = f"task_household_{h:05d}_{rng.randrange(args.tasks_per_day + args.weekly_tasks)}"
+            for label, method, url, body in (
+                ("GET /api/dashboard", "GET", f"/api/dashboard?user_id={user_id}&_={n}", None),
+                ("GET /api/tasks/today", "GET", f"/api/tasks/today?user_id={user_id}&_={n}", None),
+                ("POST /api/tasks/complete", "POST", "/api/tasks/complete", {"user_id": user_id, "task_id": task_id}),
+                ("GET /api/users/all/list", "GET", f"/api/users/all/list?user_id={admin_id}", None)
+            ):
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                elapsed = (time.perf_counter() - start) * 1000
+                samples.setdefault(label, []).append((elapsed, command_count(response), response.status_code))
+        result[str(count)] = summarize(samples, 1.0)
+        print(f"households {count:>6}: " + ", ".join(
+            f"{label} p50 {stats['p50_ms']:.2f} ms" for label, stats in result[str(count)].items()
+        ))
+    return result
+
+
+def print_report(mix: dict):
+    print(f"{mix['requests']} requests in {mix['seconds']} s ({mix['rps']} req/s)")
+    print(f"{'endpoint':<28}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'cmds':>7}{'5xx':>5}")
+    for label, stats in mix["endpoints"].items():
+        print(f"{label:<28}{stats['count']:>7}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+              f"{stats['p99_ms']:>9.2f}{stats['rps']:>9.1f}{stats['commands_per_request']:>7.2f}{stats['errors']:>5}")
+
+
+def regressions(results: dict, baseline: dict) -> List[str]:
+    """Compare with a baseline: p95 beyond the threshold, more commands, or 5xx responses"""
+    problems = []
+    for label, stats in results["mix"]["endpoints"].items():
+        if stats["errors"]:
+            problems.append(f"{label}: {stats['errors']} server errors")
+        before = baseline.get("mix", {}).get("endpoints", {}).get(label)
+        if before is None:
+            continue
+        limit = max(before["p95_ms"] * (1 + args.threshold), before["p95_ms"] + args.min_delta_ms)
+        if stats["p95_ms"] > limit:
+            problems.append(f"{label}: p95 {stats['p95_ms']:.2f} ms > {limit:.2f} ms (baseline {before['p95_ms']:.2f})")
+        if stats["commands_per_request"] > before["commands_per_request"] + 0.05:
+            problems.append(
+                f"{label}: {stats['commands_per_request']} commands/request "
+                f"(baseline {before['commands_per_request']})"
+            )
+    
+    for run, unit, max_ratio in (
+        ("history", "completions", args.history_max_ratio),
+        ("tenants", "households", args.households_max_ratio)
+    ):
+        growth = results.get(run)
+        if not growth:
+            continue
+        sizes = sorted(growth, key=int)
+        for label in growth[sizes[0]]:
+            if growth[sizes[-1]][label]["errors"]:
+                problems.append(f"{label}: {growth[sizes[-1]][label]['errors']} server errors ({sizes[-1]} {unit})")
+            smallest = growth[sizes[0]][label]["p50_ms"]
+            largest = growth[sizes[-1]][label]["p50_ms"]
+            if largest > max(smallest * max_ratio, smallest + args.min_delta_ms):
+                problems.append(
+                    f"{label}: p50 grows from {smallest:.2f} ms ({sizes[0]} {unit}) "
+                    f"to {largest:.2f} ms ({sizes[-1]} {unit})"
+                )
+    return problems
+
+
+async def main() -> int:
+    rng = random.Random(args.seed)
+    today = server.get_turkey_now()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        store = await make_store()
+        server.set_store(store)
+        seeded = await seed(store, rng, today)
+        
+        mix = await run_mix(client, seeded, rng)
+        print_report(mix)
+        results = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+            "mix": mix
+        }
+        if args.history:
+            results["history"] = await run_history(client, [int(n) for n in args.history.split(",")], today)
+        if args.households:
+            results["tenants"] = await run_tenants(
+                client, [int(n) for n in args.households.split(",")], today, rng
+            )
+    
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Saved results to {args.save}")
+    
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        workload = ("backend", "users", "weeks", "tasks_per_day", "weekly_tasks",
+                    "completions", "requests", "concurrency", "seed")
+        changed = [k for k in workload if baseline.get("config", {}).get(k) != results["config"][k]]
+        if changed:
+            print(f"warning: baseline was recorded with a different workload ({', '.join(changed)})")
+    problems = regressions(results, baseline)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
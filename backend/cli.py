@@ -0,0 +1,227 @@
+"""Bulk import and export of users, tasks, completions and level rewards
+
+    python -m backend.cli export tasks --output tasks.jsonl
+    python -m backend.cli export users --format csv --household default > users.csv
+    python -m backend.cli import tasks season.csv --household default
+    python -m backend.cli import completions backup/completions.jsonl --chunk-size 5000
+
+Files are JSON Lines (one document per line) or CSV, picked from the file
+extension unless --format is given. Imports validate every row against the
+API models and upsert it by its unique key in unordered bulk writes of
+--chunk-size rows, so memory stays bounded and a file can be imported
+again. Exports stream one cursor in key order.
+
+Documents are written as they are: importing completions does not award
+points or fill the daily rollups, so restore users with their completions.
+"""
+import asyncio
+import contextlib
+import csv
+import json
+import os
+import sys
+from enum import Enum
+from typing import Iterator, Optional
+
+import typer
+from pydantic import ValidationError
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# server.py imports its sibling modules by name, as when uvicorn runs it from backend/
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import server  # noqa: E402
+
+
+class DataKind(str, Enum):
+    users = "users"
+    tasks = "tasks"
+    completions = "completions"
+    rewards = "rewards"
+
+
+class FileFormat(str, Enum):
+    jsonl = "jsonl"
+    csv = "csv"
+
+
+def task_defaults(row: dict):
+    # A season can be seeded from rows without ids or timestamps
+    row.setdefault("id", server.new_id("task"))
+    row.setdefault("created_at", server.get_turkey_now().isoformat())
+
+
+def completion_defaults(row: dict):
+    if {"user_id", "task_id", "completed_date"} <= row.keys():
+        row.setdefault("id", f"{row['user_id']}_{row['task_id']}_{row['completed_date']}")
+
+
+# kind -> (collection, model, unique key, defaults for missing fields)
+KINDS = {
+    DataKind.users: ("users", server.User, ("id",), None),
+    DataKind.tasks: ("tasks", server.Task, ("id",), task_defaults),
+    DataKind.completions: (
+        "completed_tasks",
+        server.CompletedTask,
+        ("household_id", "user_id", "task_id", "completed_date"),
+        completion_defaults
+    ),
+    DataKind.rewards: ("level_rewards", server.LevelReward, ("household_id", "level"), None),
+}
+
+app = typer.Typer(help=__doc__.splitlines()[0], add_completion=False)
+
+
+def database():
+    if not isinstance(server.store, server.MongoStore):
+        typer.echo("Import and export need the MongoDB backend (STORAGE_BACKEND=mongo)", err=True)
+        raise typer.Exit(2)
+    return server.store.db
+
+
+def file_format(path: str, given: Optional[FileFormat]) -> FileFormat:
+    if given is not None:
+        return given
+    return FileFormat.csv if path.lower().endswith(".csv") else FileFormat.jsonl
+
+
+def csv_columns(kind: DataKind) -> list:
+    model = KINDS[kind][1]
+    return ["household_id"] + [name for name in model.model_fields if name != "household_id"]
+
+
+def read_rows(stream, fmt: FileFormat) -> Iterator[tuple]:
+    """(line number, row) pairs; empty CSV cells count as missing"""
+    if fmt == FileFormat.csv:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in ("", None)}
+        return
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+
+
+def version_keys(kind: DataKind, doc: dict) -> list:
+    """The version keys an imported document invalidates"""
+    if kind == DataKind.tasks:
+        return [server.week_version_key(doc["household_id"], doc["year"], doc["week_number"])]
+    if kind == DataKind.rewards:
+        return [f"{server.RewardTable.kind}:{doc['household_id']}"]
+    return [server.user_version_key(doc["id"] if kind == DataKind.users else doc["user_id"])]
+
+
+async def import_rows(kind: DataKind, rows: Iterator[tuple], household: str, chunk_size: int) -> dict:
+    collection_name, model, key, defaults = KINDS[kind]
+    collection = database()[collection_name]
+    counts = {"read": 0, "upserted": 0, "modified": 0, "failed": 0}
+    touched = set()
+    chunk = []  # (line number, operation)
+    
+    async def flush():
+        if not chunk:
+            return
+        try:
+            result = await collection.bulk_write([op for _, op in chunk], ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details.get("writeErrors", []):
+                typer.echo(f"line {chunk[error['index']][0]}: {error.get('errmsg', '')}", err=True)
+            counts["failed"] += len(details.get("writeErrors", []))
+        counts["upserted"] += details.get("nUpserted", 0)
+        counts["modified"] += details.get("nModified", 0)
+        chunk.clear()
+        typer.echo(f"{kind.value}: {counts['read']} read, {counts['upserted']} new, "
+                   f"{counts['modified']} updated, {counts['failed']} failed", err=True)
+    
+    for line_number, row in rows:
+        counts["read"] += 1
+        if isinstance(row, Exception) or not isinstance(row, dict):
+            typer.echo(f"line {line_number}: not a JSON object", err=True)
+            counts["failed"] += 1
+            continue
+        row.setdefault("household_id", household)
+        if defaults is not None:
+            defaults(row)
+        try:
+            # Unknown fields are kept; the model's fields are validated and typed
+            doc = dict(row, **model.model_validate(row).model_dump())
+        except ValidationError as e:
+            typer.echo(f"line {line_number}: {e.errors()[0]['loc']} {e.errors()[0]['msg']}", err=True)
+            counts["failed"] += 1
+            continue
+        
+        touched.update(version_keys(kind, doc))
+        chunk.append((line_number, UpdateOne({k: doc[k] for k in key}, {"$set": doc}, upsert=True)))
+        if len(chunk) >= chunk_size:
+            await flush()
+    await flush()
+    
+    # Running servers pick the new data up through their ETags and snapshots
+    await server.bump_versions(sorted(touched))
+    return counts
+
+
+async def export_rows(kind: DataKind, out, fmt: FileFormat, household: Optional[str], batch_size: int) -> int:
+    collection_name, _, key, _ = KINDS[kind]
+    query = {"household_id": household} if household else {}
+    cursor = database()[collection_name].find(query, {"_id": 0}).sort(
+        [(k, ASCENDING) for k in key]
+    ).batch_size(batch_size)
+    
+    writer = None
+    if fmt == FileFormat.csv:
+        writer = csv.DictWriter(out, fieldnames=csv_columns(kind), extrasaction="ignore")
+        writer.writeheader()
+    
+    count = 0
+    async for doc in cursor:
+        if writer is not None:
+            writer.writerow(doc)
+        else:
+            out.write(json.dumps(doc, ensure_ascii=False, default=str) + "\n")
+        count += 1
+        if count % batch_size == 0:
+            typer.echo(f"{kind.value}: {count} exported", err=True)
+    return count
+
+
+@app.command("import")
+def import_command(
+    kind: DataKind,
+    path: str = typer.Argument(..., help="JSONL or CSV file, - for stdin"),
+    fmt: Optional[FileFormat] = typer.Option(None, "--format", help="default: from the file extension"),
+    household: str = typer.Option(server.DEFAULT_HOUSEHOLD, help="household of rows that name none"),
+    chunk_size: int = typer.Option(1000, min=1, help="rows per bulk write")
+):
+    """Upsert documents from a file"""
+    fmt = file_format(path, fmt)
+    source = contextlib.nullcontext(sys.stdin) if path == "-" else open(path, newline="", encoding="utf-8")
+    with source as stream:
+        counts = asyncio.run(import_rows(kind, read_rows(stream, fmt), household, chunk_size))
+    typer.echo(json.dumps(counts))
+    raise typer.Exit(1 if counts["failed"] else 0)
+
+
+@app.command("export")
+def export_command(
+    kind: DataKind,
+    output: str = typer.Option("-", help="file to write, - for stdout"),
+    fmt: Optional[FileFormat] = typer.Option(None, "--format", help="default: from the output extension"),
+    household: Optional[str] = typer.Option(None, help="only this household (default: all)"),
+    batch_size: int = typer.Option(1000, min=1, help="documents per cursor batch")
+):
+    """Stream documents to a file"""
+    fmt = file_format(output, fmt)
+    target = contextlib.nullcontext(sys.stdout) if output == "-" else open(output, "w", newline="", encoding="utf-8")
+    with target as out:
+        count = asyncio.run(export_rows(kind, out, fmt, household, batch_size))
+    typer.echo(f"{kind.value}: {count} exported", err=True)
+
+
+if __name__ == "__main__":
+    app()
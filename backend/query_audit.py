@@ -0,0 +1,529 @@
+"""Query-plan audit for the MongoDB backend
+
+Seeds a scratch database with the declared indexes, calls every method of
+the Mongo repositories (repository_calls below), records the commands they
+send and runs explain("executionStats") for each. Fails when a plan scans a
+whole collection, sorts in memory or examines many more documents than it
+returns.
+
+    python query_audit.py                     # MONGO_URL, database AUDIT_DB_NAME (dropped!)
+    python query_audit.py --households 50 --max-ratio 5
+    python query_audit.py --save plans.json   # keep the full explain output
+
+Exit status is 1 when a shape breaks its budget. A new repository method
+gets a call here; a call that is allowed a COLLSCAN, SORT or high ratio
+says why next to its `allow`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from datetime import timedelta
+from typing import Iterator, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+# The audit opens its own client to record commands; server only lends its helpers
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("HEALTH_DECAY_SCHEDULER", "0")
+
+import server  # noqa: E402
+import storage  # noqa: E402
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--households", type=int, default=20)
+    parser.add_argument("--users", type=int, default=4, help="users per household")
+    parser.add_argument("--weeks", type=int, default=8, help="weeks of tasks and completions")
+    parser.add_argument("--tasks-per-day", type=int, default=3)
+    parser.add_argument("--weekly-tasks", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-ratio", type=float, default=10.0,
+                        help="allowed documents examined per document returned")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    parser.add_argument("--save", help="write every shape's verdict and explain output to this JSON file")
+    return parser.parse_args(argv)
+
+
+async def seed(database, args, rng: random.Random, today) -> dict:
+    """Households of users, tasks, completions, rewards, rules, rollups and
+    archived weeks; return sample values for the query shapes
+    """
+    year, week_number, _ = today.isocalendar()
+    monday = today - timedelta(days=today.weekday())
+    today_str = today.strftime("%Y-%m-%d")
+    docs = {name: [] for name in (
+        "users", "tasks", "completed_tasks", "level_rewards", "task_rules", "daily_rollups",
+        "weekly_summaries", "tasks_archive", "completions_archive", "idempotency_keys", "versions"
+    )}
+    
+    for h in range(args.households):
+        household_id = f"household_{h:04d}"
+        user_ids = [f"user_audit_{h:04d}_{n}" for n in range(args.users)]
+        for n, user_id in enumerate(user_ids):
+            docs["users"].append({
+                "id": user_id, "household_id": household_id, "name": f"Audit {n}",
+                "health": 15, "level": 1, "points": 0, "strength": 10, "agility": 10,
+                "charisma": 10, "endurance": 10, "is_admin": n == 0, "game_over": False,
+                "last_check_date": None
+            })
+        for level in range(1, 11):
+            docs["level_rewards"].append({
+                "household_id": household_id, "level": level, "title": f"Level {level}",
+                "description": "", "is_big": level % 5 == 0
+            })
+        for n in range(2):
+            docs["task_rules"].append({
+                "id": server.new_id("rule"), "household_id": household_id, "title": f"Rule {n}",
+                "points": 5, "strength": 0, "agility": 0, "charisma": 0, "endurance": 0,
+                "is_weekly": n == 1, "days_of_week": [] if n == 1 else ["Pazartesi", "Perşembe"],
+                "assigned_to": None, "start_date": (monday - timedelta(weeks=args.weeks)).date().isoformat(),
+                "end_date": None, "is_active": n == 0, "created_at": today.isoformat()
+            })
+        
+        for w in range(args.weeks):
+            week_start = monday - timedelta(weeks=w)
+            week_year, week, _ = week_start.isocalendar()
+            tasks = []
+            for day in range(7):
+                day_name = server.get_turkish_day_name(day)
+                tasks += [(day, day_name) for _ in range(args.tasks_per_day)]
+            tasks += [(None, None)] * args.weekly_tasks
+            
+            week_tasks = []
+            for n, (day, day_name) in enumerate(tasks):
+                task = {
+                    "id": server.new_id("task"), "household_id": household_id, "title": f"Task {n}",
+                    "points": 10, "strength": 1, "agility": 1, "charisma": 1, "endurance": 1,
+                    "is_weekly": day is None, "day_of_week": day_name,
+                    "assigned_to": rng.choice([None, None] + user_ids),
+                    "week_number": week, "year": week_year, "is_active": n % 10 != 9,
+                    "created_at": (week_start + timedelta(minutes=n)).isoformat()
+                }
+                week_tasks.append((day, task))
+                docs["tasks"].append(task)
+            docs["versions"].append({"_id": server.week_version_key(household_id, week_year, week), "version": 1})
+            
+            for user_id in user_ids:
+                for day, task in week_tasks:
+                    done = week_start + timedelta(days=day if day is not None else rng.randrange(7))
+                    if done.date() > today.date() or rng.random() < 0.4:
+                        continue
+                    completed_date = done.strftime("%Y-%m-%d")
+                    docs["completed_tasks"].append({
+                        "id": f"{user_id}_{task['id']}_{completed_date}", "household_id": household_id,
+                        "user_id": user_id, "task_id": task["id"], "completed_date": completed_date
+                    })
+        
+        for user_id in user_ids:
+            for d in range(7 * args.weeks):
+                docs["daily_rollups"].append({
+                    "household_id": household_id, "user_id": user_id,
+                    "date": (today - timedelta(days=d)).strftime("%Y-%m-%d"), "points": 10, "completed": 1
+                })
+            for w in range(args.weeks, 2 * args.weeks):
+                week_year, week, _ = (monday - timedelta(weeks=w)).isocalendar()
+                docs["weekly_summaries"].append({
+                    "user_id": user_id, "household_id": household_id, "year": week_year,
+                    "week_number": week, "points": 50, "completed": 5
+                })
+            docs["idempotency_keys"].append({
+                "household_id": household_id, "user_id": user_id, "key": server.new_id("key"),
+                "claim": server.new_id("claim"), "result": {"success": True}, "created_at": today
+            })
+            docs["versions"].append({"_id": server.user_version_key(user_id), "version": 1})
+    
+    # Archived weeks: the tasks and completions of the weeks before the seeded ones
+    for task in docs["tasks"][:len(docs["tasks"]) // 4]:
+        docs["tasks_archive"].append(dict(task, id=server.new_id("task"), year=task["year"] - 1))
+    for completion in docs["completed_tasks"][:len(docs["completed_tasks"]) // 4]:
+        archived_date = f"{int(completion['completed_date'][:4]) - 1}{completion['completed_date'][4:]}"
+        docs["completions_archive"].append(dict(
+            completion, id=f"{completion['user_id']}_{completion['task_id']}_{archived_date}",
+            completed_date=archived_date
+        ))
+    
+    for name, batch in docs.items():
+        if batch:
+            await database[name].insert_many(batch)
+    
+    user = docs["users"][1]
+    household_id = user["household_id"]
+    this_week = [t for t in docs["tasks"] if t["household_id"] == household_id
+                 and (t["year"], t["week_number"]) == (year, week_number)]
+    weekly = [t["id"] for t in this_week if t["is_weekly"]]
+    completed = next(c for c in docs["completed_tasks"] if c["user_id"] == user["id"])
+    rule = next(r for r in docs["task_rules"] if r["household_id"] == household_id)
+    return {
+        "today": today,
+        "today_str": today_str,
+        "year": year,
+        "week_number": week_number,
+        "previous_week": tuple((monday - timedelta(weeks=1)).isocalendar()[:2]),
+        "day_name": server.get_turkish_day_name(today.weekday()),
+        "household_id": household_id,
+        "household_ids": sorted({u["household_id"] for u in docs["users"]}),
+        "user": user,
+        "user_ids": [u["id"] for u in docs["users"]],
+        "task": this_week[0],
+        "weekly_task_ids": weekly,
+        # insert_many gave the seeded documents an _id, which the repositories never pass
+        "completion": {k: v for k, v in completed.items() if k != "_id"},
+        "rule": rule,
+        "rule_task_ids": [f"{rule['id']}@{year}-W{week_number:02d}-{today.weekday()}"],
+        "archived_task_ids": [t["id"] for t in docs["tasks_archive"][:20]],
+        "idempotency_key": next(k["key"] for k in docs["idempotency_keys"] if k["user_id"] == user["id"]),
+        "week_from": (monday - timedelta(weeks=1)).strftime("%Y-%m-%d"),
+        "week_to": monday.strftime("%Y-%m-%d"),
+        "year_ago": (today - timedelta(days=365)).strftime("%Y-%m-%d"),
+        "reward": next(
+            {k: v for k, v in r.items() if k not in ("_id", "household_id")} for r in docs["level_rewards"]
+            if r["household_id"] == household_id
+        ),
+        "summary": {
+            "user_id": user["id"], "household_id": household_id, "year": year,
+            "week_number": week_number, "points": 0, "completed": 0
+        },
+    }
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Keep the query commands the audit's client sends while a repository method runs"""
+    
+    QUERIES = {"find", "aggregate", "distinct", "count", "update", "delete", "findAndModify"}
+    
+    def __init__(self):
+        self.commands = []
+    
+    def started(self, event):
+        if event.command_name in self.QUERIES:
+            self.commands.append(explainable(event.command))
+    
+    def succeeded(self, event):
+        pass
+    
+    def failed(self, event):
+        pass
+
+
+def explainable(command: dict) -> dict:
+    """The command as explain accepts it
+    
+    Session, transaction and write concern fields are the driver's, explain
+    takes one update or delete statement, and a $merge/$out stage is left
+    out so only the read side of the pipeline is planned.
+    """
+    command = {
+        key: value for key, value in command.items()
+        if not key.startswith("$") and key not in ("lsid", "txnNumber", "writeConcern", "readConcern")
+    }
+    for statements in ("updates", "deletes"):
+        if statements in command:
+            command[statements] = command[statements][:1]
+    pipeline = command.get("pipeline")
+    if pipeline and ("$merge" in pipeline[-1] or "$out" in pipeline[-1]):
+        command["pipeline"] = pipeline[:-1]
+    return command
+
+
+def repository_calls(store: storage.MongoStore, s: dict) -> List[dict]:
+    """A call of every Mongo repository method, with sample values from `seed`
+    
+    The audited shapes are the commands these calls send, so they change
+    with the repositories. Methods that only insert are left out; writes
+    that would remove sample data use values matching nothing, which keeps
+    the shape.
+    """
+    hid, user, task, completion = s["household_id"], s["user"], s["task"], s["completion"]
+    uid, year, week_number, today_str = user["id"], s["year"], s["week_number"], s["today_str"]
+    today_filters = {
+        "year": year, "week_number": week_number, "is_weekly": False, "day_of_week": s["day_name"], "user_id": uid
+    }
+    user_cursor = storage.encode_cursor(user, storage.USER_SORT)
+    task_cursor = storage.encode_cursor(task, storage.TASK_SORT)
+    check = {"id": uid, "last_check_date": user["last_check_date"], "health_loss": 1, "weekly_loss": 0}
+    missed = dict(completion, completed_date="0000-01-01")
+    migration = "a migration, runs once"
+    return [
+        # users
+        {"name": "users.get", "call": lambda: store.users.get(uid)},
+        {"name": "users.get_by_name (login)", "call": lambda: store.users.get_by_name(hid, user["name"])},
+        {"name": "users.count", "call": lambda: store.users.count(), "allow": {"COLLSCAN"}, "why": migration},
+        {"name": "users.backfill_stats", "call": lambda: store.users.backfill_stats(),
+         "allow": {"COLLSCAN"}, "why": migration},
+        {"name": "users.page", "call": lambda: store.users.page(hid, 100, None)},
+        {"name": "users.page after", "call": lambda: store.users.page(hid, 100, user_cursor)},
+        {"name": "users.stream", "call": lambda: store.users.stream(hid, None)},
+        {"name": "users.increment", "call": lambda: store.users.increment(uid, {"points": 0})},
+        {"name": "users.set_health", "call": lambda: store.users.set_health(uid, user["health"], False)},
+        {"name": "users.claim_health_report", "call": lambda: store.users.claim_health_report(uid, today_str)},
+        {"name": "users.pending_health_checks user", "call": lambda: store.users.pending_health_checks(
+            today_str, uid
+        )},
+        {"name": "users.pending_health_checks", "call": lambda: store.users.pending_health_checks(today_str),
+         "allow": {"COLLSCAN"}, "why": "nightly sweep; reads nearly every user once a day"},
+        {"name": "users.apply_health_checks", "call": lambda: store.users.apply_health_checks(today_str, [check])},
+        
+        # tasks
+        {"name": "tasks.get", "call": lambda: store.tasks.get(task["id"])},
+        {"name": "tasks.find_many", "call": lambda: store.tasks.find_many([task["id"], "task_missing"])},
+        {"name": "tasks.today", "call": lambda: store.tasks.page(hid, 100, None, **today_filters)},
+        {"name": "tasks.weekly", "call": lambda: store.tasks.page(
+            hid, 100, None, year=year, week_number=week_number, is_weekly=True, user_id=uid
+        )},
+        {"name": "tasks.week (admin)", "call": lambda: store.tasks.page(
+            hid, 100, None, year=year, week_number=week_number
+        )},
+        {"name": "tasks.week (admin) stream", "call": lambda: store.tasks.stream(
+            hid, None, year=year, week_number=week_number
+        )},
+        {"name": "tasks.all_weeks (admin)", "call": lambda: store.tasks.page(hid, 100, None)},
+        {"name": "tasks.all_weeks (admin) after", "call": lambda: store.tasks.page(hid, 100, task_cursor)},
+        {"name": "tasks.in_weeks (decay)", "call": lambda: store.tasks.in_weeks(
+            s["household_ids"], [(year, week_number), s["previous_week"]]
+        )},
+        {"name": "tasks.clone_week", "call": lambda: store.tasks.clone_week(
+            hid, s["previous_week"], (year + 5, week_number), today_str
+        )},
+        {"name": "tasks.legacy_ids", "call": lambda: store.tasks.legacy_ids(),
+         "allow": {"ratio"}, "why": migration + "; every id shares the regex's task_ prefix"},
+        {"name": "tasks.rename", "call": lambda: store.tasks.rename(task["id"], task["id"])},
+        {"name": "tasks.archivable", "call": lambda: store.tasks.archivable(s["previous_week"], (year, week_number)),
+         "allow": {"COLLSCAN", "ratio"}, "why": "nightly archival; matches weeks of every household"},
+        {"name": "tasks.delete_many", "call": lambda: store.tasks.delete_many(["task_missing"])},
+        {"name": "tasks.deactivate", "call": lambda: store.tasks.deactivate(hid, task["id"])},
+        
+        # completions
+        {"name": "completions.task_ids today", "call": lambda: store.completions.task_ids(
+            hid, uid, completed_date=today_str
+        )},
+        {"name": "completions.task_ids weekly", "call": lambda: store.completions.task_ids(
+            hid, uid, task_ids=s["weekly_task_ids"]
+        )},
+        {"name": "completions.insert_once", "call": lambda: store.completions.insert_once(completion)},
+        {"name": "completions.record_many", "call": lambda: store.completions.record_many([completion], [True])},
+        {"name": "completions.delete", "call": lambda: store.completions.delete(missed)},
+        {"name": "completions.for_users (decay)", "call": lambda: store.completions.for_users(
+            s["household_ids"], s["user_ids"], s["week_from"], today_str, s["weekly_task_ids"]
+        )},
+        {"name": "completions.oldest_date", "call": lambda: store.completions.oldest_date()},
+        {"name": "completions.between (archival)", "call": lambda: store.completions.between(
+            s["week_from"], s["week_to"]
+        )},
+        {"name": "completions.delete_between", "call": lambda: store.completions.delete_between(
+            "0000-01-01", "0000-01-08"
+        )},
+        {"name": "completions.rename_tasks", "call": lambda: store.completions.rename_tasks(
+            {completion["task_id"]: completion["task_id"]}
+        ), "allow": {"COLLSCAN"}, "why": migration + "; task_id leads no index"},
+        {"name": "dashboard", "call": lambda: store.dashboard(
+            hid, uid, year, week_number, s["day_name"], today_str, s["rule_task_ids"]
+        )},
+        
+        # rewards and rules
+        {"name": "rewards.all", "call": lambda: store.rewards.all(hid)},
+        {"name": "rewards.count", "call": lambda: store.rewards.count(), "allow": {"COLLSCAN"}, "why": migration},
+        {"name": "rewards.upsert", "call": lambda: store.rewards.upsert(hid, s["reward"])},
+        {"name": "rewards.delete", "call": lambda: store.rewards.delete(hid, 0)},
+        {"name": "rules.active", "call": lambda: store.rules.active(s["household_ids"])},
+        {"name": "rules.deactivate", "call": lambda: store.rules.deactivate(hid, "rule_missing")},
+        
+        # bookkeeping
+        {"name": "versions.get", "call": lambda: store.versions.get([
+            server.user_version_key(uid), server.week_version_key(hid, year, week_number)
+        ])},
+        {"name": "versions.bump", "call": lambda: store.versions.bump([server.user_version_key(uid)])},
+        {"name": "leases.acquire", "call": lambda: store.leases.acquire("query_audit", "audit", 1)},
+        {"name": "leases.release", "call": lambda: store.leases.release("query_audit", "audit")},
+        {"name": "migrations.version", "call": lambda: store.migrations.version()},
+        {"name": "migrations.record", "call": lambda: store.migrations.record(0, "query_audit")},
+        {"name": "idempotency.claim_many", "call": lambda: store.idempotency.claim_many(
+            hid, uid, [s["idempotency_key"]], "claim_missing", server.IDEMPOTENCY_CLAIM_SECONDS
+        )},
+        {"name": "idempotency.get_many", "call": lambda: store.idempotency.get_many(
+            hid, uid, [s["idempotency_key"]]
+        )},
+        {"name": "idempotency.complete_many", "call": lambda: store.idempotency.complete_many(
+            hid, uid, "claim_missing", {s["idempotency_key"]: {"success": True}}
+        )},
+        {"name": "idempotency.release_many", "call": lambda: store.idempotency.release_many(
+            hid, uid, "claim_missing", [s["idempotency_key"]]
+        )},
+        {"name": "rollups.add_many", "call": lambda: store.rollups.add_many([
+            (hid, uid, today_str, {"points": 0})
+        ])},
+        {"name": "rollups.set_many", "call": lambda: store.rollups.set_many([
+            (hid, uid, today_str, {"health_lost": 0})
+        ])},
+        {"name": "rollups.between", "call": lambda: store.rollups.between(hid, uid, s["year_ago"], today_str)},
+        {"name": "archive.find_tasks", "call": lambda: store.archive.find_tasks(s["archived_task_ids"])},
+        {"name": "archive.completions_between", "call": lambda: store.archive.completions_between(
+            s["week_from"], s["week_to"]
+        )},
+        {"name": "archive.save_summaries", "call": lambda: store.archive.save_summaries([s["summary"]])},
+        {"name": "archive.user_summaries", "call": lambda: store.archive.user_summaries(hid, uid)},
+        {"name": "backfill_household", "call": lambda: store.backfill_household(storage.DEFAULT_HOUSEHOLD),
+         "allow": {"COLLSCAN"}, "why": migration},
+        {"name": "backfill_user_household", "call": lambda: store.backfill_user_household(),
+         "allow": {"COLLSCAN"}, "why": migration},
+    ]
+
+
+async def record_shapes(recorder: CommandRecorder, calls: List[dict]) -> List[dict]:
+    """Run each call and turn the distinct commands it sent into query shapes"""
+    shapes = []
+    for call in calls:
+        recorder.commands = []
+        result = call["call"]()
+        if hasattr(result, "__aiter__"):
+            async for _ in result:
+                pass
+        else:
+            await result
+        
+        commands = []
+        for command in recorder.commands:
+            if command not in commands:
+                commands.append(command)
+        if not commands:
+            raise RuntimeError(f"{call['name']} sent no query - its sample values match nothing to read")
+        for n, command in enumerate(commands, 1):
+            name = call["name"] if len(commands) == 1 else f"{call['name']} #{n} {next(iter(command))}"
+            shapes.append({
+                "name": name, "command": command, "allow": call.get("allow", set()), "why": call.get("why", "")
+            })
+    return shapes
+
+
+def walk(node) -> Iterator[tuple]:
+    """(key, value) pairs of a nested explain document, skipping rejected plans"""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            yield key, value
+            yield from walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from walk(item)
+
+
+def plan_summary(explain: dict) -> dict:
+    """Winning-plan stages, indexes used, collection scans and documents
+    examined/returned of one explain("executionStats") result
+    
+    Stages of $lookup sub-pipelines only report totals, so those count
+    towards the scans but not the ratio, which is the outer cursor's.
+    """
+    stages, indexes, collection_scans = set(), set(), 0
+    stats = None
+    for key, value in walk(explain):
+        if key == "winningPlan":
+            for plan_key, plan_value in walk(value):
+                if plan_key == "stage" and isinstance(plan_value, str):
+                    stages.add(plan_value)
+                elif plan_key == "indexName":
+                    indexes.add(plan_value)
+                elif plan_key == "strategy" and plan_value == "NestedLoopJoin":
+                    # A pushed-down $lookup without a usable index on the foreign side
+                    collection_scans += 1
+        elif key == "collectionScans":
+            collection_scans += value
+        elif key == "indexesUsed":
+            indexes.update(value)
+        elif key == "executionStats" and stats is None:
+            stats = value
+    if "COLLSCAN" in stages:
+        collection_scans += 1
+    
+    examined = (stats or {}).get("totalDocsExamined", 0)
+    returned = (stats or {}).get("nReturned", 0)
+    return {
+        "stages": sorted(stages),
+        "indexes": sorted(indexes),
+        "collection_scans": collection_scans,
+        "examined": examined,
+        "returned": returned,
+        "ratio": examined / max(returned, 1)
+    }
+
+
+def problems(summary: dict, max_ratio: float) -> List[str]:
+    found = []
+    if summary["collection_scans"]:
+        found.append("COLLSCAN")
+    if "SORT" in summary["stages"]:
+        found.append("SORT")
+    if summary["ratio"] > max_ratio:
+        found.append("ratio")
+    return found
+
+
+async def audit(database, shapes: List[dict], max_ratio: float) -> List[dict]:
+    results = []
+    for shape in shapes:
+        explain = await database.command({"explain": shape["command"], "verbosity": "executionStats"})
+        summary = plan_summary(explain)
+        found = problems(summary, max_ratio)
+        allowed = shape.get("allow", set())
+        results.append(dict(
+            summary,
+            name=shape["name"],
+            failures=[p for p in found if p not in allowed],
+            allowed=[p for p in found if p in allowed],
+            why=shape.get("why", ""),
+            explain=explain
+        ))
+    return results
+
+
+def print_report(results: List[dict]):
+    print(f"{'':4}  {'query':36} {'examined':>8} {'returned':>8} {'ratio':>6}  indexes")
+    for r in results:
+        status = "FAIL" if r["failures"] else "ok"
+        notes = " ".join(r["failures"])
+        if r["allowed"]:
+            notes += f" (allowed {'/'.join(r['allowed'])}: {r['why']})"
+        print(f"{status:4}  {r['name']:36} {r['examined']:8} {r['returned']:8} {r['ratio']:6.1f}  "
+              f"{','.join(r['indexes']) or '-'} {notes}".rstrip())
+
+
+async def run(mongo_url: str, database_name: str, args) -> List[dict]:
+    """Audit every repository call against a freshly seeded database"""
+    recorder = CommandRecorder()
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[recorder])
+    database = client[database_name]
+    await client.drop_database(database_name)
+    store = storage.MongoStore(database)
+    try:
+        await store.ensure_indexes()
+        samples = await seed(database, args, random.Random(args.seed), server.get_turkey_now())
+        shapes = await record_shapes(recorder, repository_calls(store, samples))
+        return await audit(database, shapes, args.max_ratio)
+    finally:
+        if not args.keep:
+            await client.drop_database(database_name)
+        client.close()
+
+
+async def main() -> int:
+    args = parse_args()
+    results = await run(os.environ['MONGO_URL'], os.environ.get('AUDIT_DB_NAME', 'query_audit'), args)
+    
+    print_report(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Saved plans to {args.save}")
+    failed = [r["name"] for r in results if r["failures"]]
+    if failed:
+        print(f"{len(failed)} of {len(results)} query shapes break their budget: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
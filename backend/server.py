@@ -1,16 +1,40 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import sys
+import json
+import cProfile
+import pstats
+import random
+import hashlib
+import re
+import asyncio
 import logging
+import time
+import uuid
+import threading
+import contextvars
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from types import MappingProxyType
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
 import pytz
 
+from storage import (
+    DEFAULT_HOUSEHOLD, RETIRED_INDEXES, TASK_SORT, InvalidCursor, MemoryStore, MongoStore,
+    is_assigned
+)
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -21,10 +45,321 @@ def get_turkey_now():
     """Get current time in Turkey timezone"""
     return datetime.now(TURKEY_TZ)
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+
+def new_id(prefix: str) -> str:
+    """Generate a collision-free document id with a readable prefix"""
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+# Metrics - per-route latency and Mongo commands, attributed to the request
+# that issued them through a contextvar (Motor copies the context into its
+# executor threads, so the command listener sees it)
+class RequestStats:
+    def __init__(self):
+        self.commands = 0
+        self.mongo_seconds = 0.0
+        self.log = None  # a list of every command while the request is profiled
+    
+    def add(self, seconds: float, command: str = "", collection: str = ""):
+        self.commands += 1
+        self.mongo_seconds += seconds
+        if self.log is not None:
+            self.log.append({"command": command, "collection": collection, "ms": round(seconds * 1000, 3)})
+
+
+current_request_stats = contextvars.ContextVar("current_request_stats", default=None)
+
+
+class Metrics:
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # (method, route, status) -> count
+        self.latency = {}  # (method, route) -> [bucket counts..., +Inf count, sum]
+        self.route_mongo = {}  # (method, route) -> [commands, seconds]
+        self.commands = {}  # (command, collection) -> [count, seconds]
+    
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            key = (method, route)
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            histogram = self.latency.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for n, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[n] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            mongo = self.route_mongo.setdefault(key, [0, 0.0])
+            mongo[0] += stats.commands
+            mongo[1] += stats.mongo_seconds
+    
+    def observe_command(self, command: str, collection: str, seconds: float):
+        with self._lock:
+            entry = self.commands.setdefault((command, collection), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+    
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        def labels(**values):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in values.items()) + "}"
+        
+        lines = []
+        with self._lock:
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{labels(method=method, route=route, status=status)} {count}")
+            
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for (method, route), histogram in sorted(self.latency.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"http_request_duration_seconds_bucket{labels(method=method, route=route, le=bound)} {count}")
+                lines.append(f"http_request_duration_seconds_bucket{labels(method=method, route=route, le='+Inf')} {histogram[-2]}")
+                lines.append(f"http_request_duration_seconds_count{labels(method=method, route=route)} {histogram[-2]}")
+                lines.append(f"http_request_duration_seconds_sum{labels(method=method, route=route)} {histogram[-1]:.6f}")
+            
+            lines.append("# TYPE http_request_mongo_commands_total counter")
+            for (method, route), (commands, _) in sorted(self.route_mongo.items()):
+                lines.append(f"http_request_mongo_commands_total{labels(method=method, route=route)} {commands}")
+            lines.append("# TYPE http_request_mongo_seconds_total counter")
+            for (method, route), (_, seconds) in sorted(self.route_mongo.items()):
+                lines.append(f"http_request_mongo_seconds_total{labels(method=method, route=route)} {seconds:.6f}")
+            
+            lines.append("# TYPE mongo_commands_total counter")
+            for (command, collection), (count, _) in sorted(self.commands.items()):
+                lines.append(f"mongo_commands_total{labels(command=command, collection=collection)} {count}")
+            lines.append("# TYPE mongo_command_seconds_total counter")
+            for (command, collection), (_, seconds) in sorted(self.commands.items()):
+                lines.append(f"mongo_command_seconds_total{labels(command=command, collection=collection)} {seconds:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+    
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+    
+    def succeeded(self, event):
+        self._finish(event)
+    
+    def failed(self, event):
+        self._finish(event)
+    
+    def _finish(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        metrics.observe_command(event.command_name, collection, seconds)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.add(seconds, event.command_name, collection)
+
+
+class MetricsMiddleware:
+    """Record latency, status and Mongo usage per route; add a Server-Timing header"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = (time.perf_counter() - start) * 1000
+                MutableHeaders(scope=message).append(
+                    "Server-Timing",
+                    f'app;dur={elapsed:.1f}, mongo;dur={stats.mongo_seconds * 1000:.1f};desc="{stats.commands} commands"'
+                )
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request_stats.reset(token)
+            route = scope.get("route")
+            metrics.observe_request(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status,
+                time.perf_counter() - start,
+                stats
+            )
+
+
+# Profiling - opt-in (PROFILING=1, otherwise the middleware is not installed).
+# A request is profiled when an admin sends its user id in X-Profile, or at
+# random with PROFILE_SAMPLE_RATE. Each dump is a cProfile file (for snakeviz,
+# flameprof or pstats) plus a JSON summary with the request's Mongo commands,
+# kept in PROFILE_DIR as a ring of the newest PROFILE_KEEP dumps. Streaming
+# requests (SSE, NDJSON) are never profiled
+PROFILING = os.environ.get('PROFILING', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+PROFILE_SKIP_PATHS = {"/api/events"}
+PROFILE_ID = re.compile(r"^\d{8}T\d{12}_[0-9a-f]{8}$")
+
+
+def write_profile(profile_id: str, profiler: cProfile.Profile, summary: dict):
+    """Store one dump and drop the oldest ones beyond PROFILE_KEEP"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(PROFILE_DIR / f"{profile_id}.prof"))
+    
+    functions = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+    summary["functions"] = [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3)
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in functions[:40]
+    ]
+    (PROFILE_DIR / f"{profile_id}.json").write_text(json.dumps(summary, ensure_ascii=False))
+    
+    dumps = sorted(PROFILE_DIR.glob("*.json"))
+    for old in dumps[:max(0, len(dumps) - PROFILE_KEEP)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def read_profiles() -> List[dict]:
+    """Summaries of the stored dumps, newest first, without their details"""
+    if not PROFILE_DIR.is_dir():
+        return []
+    summaries = []
+    for path in sorted(PROFILE_DIR.glob("*.json"), reverse=True):
+        try:
+            summary = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        summary.pop("functions", None)
+        summary["mongo_commands"] = len(summary.pop("mongo", []))
+        summaries.append(summary)
+    return summaries
+
+
+def is_streaming(scope) -> bool:
+    """True for responses that stay open - a profile would run for the whole connection"""
+    if scope["path"] in PROFILE_SKIP_PATHS:
+        return True
+    accept = dict(scope["headers"]).get(b"accept", b"").decode("latin-1")
+    return "text/event-stream" in accept or NDJSON in accept
+
+
+class ProfilingMiddleware:
+    """Profile single requests on demand; everything else passes straight through
+    
+    cProfile sees the whole thread, so a dump also contains whatever other
+    requests ran on this worker meanwhile - only one request is profiled at a
+    time, and the Mongo commands listed are this request's alone.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.busy = False
+    
+    async def _wanted(self, scope) -> Optional[str]:
+        """Why this request should be profiled ("admin" or "sample"), or None"""
+        if is_streaming(scope):
+            return None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                user = await user_cache.get(value.decode("latin-1"))
+                if user and user.get("is_admin", False):
+                    return "admin"
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sample"
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.busy:
+            await self.app(scope, receive, send)
+            return
+        trigger = await self._wanted(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        
+        profile_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}_{uuid.uuid4().hex[:8]}"
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.log = []
+        status = 500
+        
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            await send(message)
+        
+        self.busy = True
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            self.busy = False
+            summary = {
+                "id": profile_id,
+                "trigger": trigger,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "status": status,
+                "duration_ms": round(elapsed * 1000, 3),
+                "mongo": stats.log if stats is not None else []
+            }
+            try:
+                await asyncio.to_thread(write_profile, profile_id, profiler, summary)
+            except OSError:
+                logger.exception(f"Could not store profile {profile_id}")
+
+
+def create_store():
+    """Build the storage backend selected by STORAGE_BACKEND (mongo or memory)"""
+    if os.environ.get('STORAGE_BACKEND', 'mongo') == 'memory':
+        return None, MemoryStore()
+    mongo_client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[MongoCommandListener()])
+    return mongo_client, MongoStore(mongo_client[os.environ['DB_NAME']])
+
+
+client, store = create_store()
+
+
+def set_store(new_store):
+    """Swap the storage backend (e.g. a fresh MemoryStore per test or benchmark run)
+    
+    Everything cached from the previous backend is dropped with it.
+    """
+    global store
+    store = new_store
+    user_cache._entries.clear()
+    response_cache._entries.clear()
+    reward_tables.clear()
+    rule_sets.clear()
+
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -47,6 +382,7 @@ class DayOfWeek(str, Enum):
 # Models
 class User(BaseModel):
     id: str
+    household_id: str
     name: str
     health: int
     level: int
@@ -62,6 +398,7 @@ class User(BaseModel):
 
 class Task(BaseModel):
     id: str
+    household_id: str
     title: str
     points: int
     strength: int = 0
@@ -75,6 +412,7 @@ class Task(BaseModel):
     year: int
     is_active: bool = True
     created_at: str
+    cloned_from: Optional[str] = None  # id of the task this was copied from
 
 
 class TaskCreate(BaseModel):
@@ -89,8 +427,30 @@ class TaskCreate(BaseModel):
     assigned_to: Optional[str] = None  # user_id or None for both
 
 
+class TaskBulkCreate(BaseModel):
+    tasks: List[TaskCreate] = []
+    # "Repeat on these days": the template is expanded once per day
+    template: Optional[TaskCreate] = None
+    days: List[DayOfWeek] = []
+
+
+class TaskRuleCreate(BaseModel):
+    title: str
+    points: int
+    strength: int = 0
+    agility: int = 0
+    charisma: int = 0
+    endurance: int = 0
+    is_weekly: bool = False
+    days_of_week: List[DayOfWeek] = []  # ignored for weekly rules
+    assigned_to: Optional[str] = None  # user_id or None for both
+    start_date: Optional[str] = None  # YYYY-MM-DD, defaults to today
+    end_date: Optional[str] = None  # YYYY-MM-DD, open-ended if None
+
+
 class CompletedTask(BaseModel):
     id: str
+    household_id: str
     user_id: str
     task_id: str
     completed_date: str
@@ -105,6 +465,7 @@ class LevelReward(BaseModel):
 
 class LoginRequest(BaseModel):
     name: str
+    household_id: str = DEFAULT_HOUSEHOLD
 
 
 class CompleteTaskRequest(BaseModel):
@@ -112,11 +473,492 @@ class CompleteTaskRequest(BaseModel):
     task_id: str
 
 
+class QueuedCompletion(BaseModel):
+    task_id: str
+    idempotency_key: str = Field(min_length=1, max_length=128)
+    completed_at: Optional[datetime] = None  # the client's local time of the tap
+
+
+class CompleteTaskBatchRequest(BaseModel):
+    user_id: str
+    completions: List[QueuedCompletion] = Field(default=[], max_length=100)
+
+
+# User cache - bounded LRU with a TTL so other workers' writes become visible
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    async def get(self, user_id: str) -> Optional[dict]:
+        """Return a copy of the user document, reading through to the store on a miss"""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry[1])
+        
+        self.misses += 1
+        user = await store.users.get(user_id)
+        if user is None:
+            self._entries.pop(user_id, None)
+            return None
+        
+        self._entries[user_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return dict(user)
+    
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+    
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+user_cache = UserCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('USER_CACHE_TTL', '30'))
+)
+
+
+# Small, rarely changed collections are held as immutable in-memory snapshots
+# per household, reloaded when their version document in `versions` changes
+# (so every worker picks up edits made by another one)
+class VersionedSnapshot(ABC):
+    kind = None
+    
+    def __init__(self, household_id: str, poll_interval: float):
+        self.household_id = household_id
+        self.name = f"{self.kind}:{household_id}"
+        self.poll_interval = poll_interval
+        self.version = None
+        self._checked_at = 0.0
+    
+    async def _read_version(self) -> int:
+        versions = await store.versions.get([self.name])
+        return versions.get(self.name, 0)
+    
+    @abstractmethod
+    async def _load(self):
+        """Read the collection and swap in the new snapshot"""
+    
+    async def reload(self):
+        """Load the collection and swap in a new snapshot"""
+        version = await self._read_version()
+        await self._load()
+        self.version = version
+        self._checked_at = time.monotonic()
+    
+    async def refresh(self):
+        """Poll the version at most every poll_interval and reload if it changed"""
+        if time.monotonic() - self._checked_at >= self.poll_interval:
+            self._checked_at = time.monotonic()
+            if await self._read_version() != self.version:
+                await self.reload()
+    
+    async def bump(self):
+        """Record a change to the collection and reload this worker's snapshot"""
+        await store.versions.bump([self.name])
+        await self.reload()
+
+
+class SnapshotRegistry:
+    """The snapshots of the most recently used households, built on first use"""
+    
+    def __init__(self, factory, maxsize: int):
+        self.factory = factory
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+    
+    def get(self, household_id: str) -> VersionedSnapshot:
+        snapshot = self._entries.get(household_id)
+        if snapshot is None:
+            snapshot = self._entries[household_id] = self.factory(household_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(household_id)
+        return snapshot
+    
+    def clear(self):
+        self._entries.clear()
+
+
+SNAPSHOT_CACHE_SIZE = int(os.environ.get('SNAPSHOT_CACHE_SIZE', '256'))
+
+
+class RewardTable(VersionedSnapshot):
+    kind = "level_rewards"
+    
+    def __init__(self, household_id: str, poll_interval: float):
+        super().__init__(household_id, poll_interval)
+        self.rewards = MappingProxyType({})
+    
+    async def _load(self):
+        docs = await store.rewards.all(self.household_id)
+        # A household starts with the default rewards; once an admin has edited
+        # them (version > 0) an empty table stays empty
+        if not docs and await self._read_version() == 0:
+            await store.rewards.seed(self.household_id, default_rewards())
+            docs = await store.rewards.all(self.household_id)
+        self.rewards = MappingProxyType({d["level"]: MappingProxyType(d) for d in docs})
+    
+    async def current(self) -> MappingProxyType:
+        await self.refresh()
+        return self.rewards
+
+
+REWARD_POLL_INTERVAL = float(os.environ.get('REWARD_POLL_INTERVAL', '5'))
+reward_tables = SnapshotRegistry(
+    lambda household_id: RewardTable(household_id, REWARD_POLL_INTERVAL),
+    maxsize=SNAPSHOT_CACHE_SIZE
+)
+
+
+def expand_rule(rule: dict, year: int, week_number: int) -> List[dict]:
+    """Materialize a recurring task rule into the task documents of one ISO week"""
+    try:
+        week_start = date.fromisocalendar(year, week_number, 1)
+    except ValueError:
+        return []
+    start = date.fromisoformat(rule["start_date"])
+    end = date.fromisoformat(rule["end_date"]) if rule.get("end_date") else None
+    
+    def in_range(day: date) -> bool:
+        return start <= day and (end is None or day <= end)
+    
+    base = {
+        key: rule.get(key, 0) for key in ("points", "strength", "agility", "charisma", "endurance")
+    }
+    base.update({
+        "household_id": rule["household_id"],
+        "title": rule["title"],
+        "assigned_to": rule.get("assigned_to"),
+        "week_number": week_number,
+        "year": year,
+        "is_active": True,
+        "created_at": rule["created_at"],
+        "rule_id": rule["id"]
+    })
+    week_id = f"{rule['id']}@{year}-W{week_number:02d}"
+    
+    if rule.get("is_weekly", False):
+        # A weekly rule applies if any day of the week is in range
+        week_end = week_start + timedelta(days=6)
+        if start > week_end or (end is not None and end < week_start):
+            return []
+        return [dict(base, id=week_id, is_weekly=True, day_of_week=None)]
+    
+    tasks = []
+    for weekday in range(7):
+        day_name = get_turkish_day_name(weekday)
+        if day_name in rule.get("days_of_week", []) and in_range(week_start + timedelta(days=weekday)):
+            tasks.append(dict(base, id=f"{week_id}-{weekday + 1}", is_weekly=False, day_of_week=day_name))
+    return tasks
+
+
+class TaskRuleSet(VersionedSnapshot):
+    kind = "task_rules"
+    max_cached_weeks = 64
+    
+    def __init__(self, household_id: str, poll_interval: float):
+        super().__init__(household_id, poll_interval)
+        self.rules = ()
+        self._weeks = OrderedDict()
+    
+    async def _load(self):
+        docs = await store.rules.active([self.household_id])
+        self.rules = tuple(MappingProxyType(d) for d in docs)
+        self._weeks = OrderedDict()
+    
+    async def week(self, year: int, week_number: int) -> List[dict]:
+        """Return copies of the tasks every active rule produces for an ISO week"""
+        await self.refresh()
+        key = (year, week_number)
+        if key not in self._weeks:
+            self._weeks[key] = tuple(
+                MappingProxyType(task)
+                for rule in self.rules
+                for task in expand_rule(rule, year, week_number)
+            )
+            while len(self._weeks) > self.max_cached_weeks:
+                self._weeks.popitem(last=False)
+        self._weeks.move_to_end(key)
+        return [dict(task) for task in self._weeks[key]]
+    
+    async def find(self, task_id: str) -> Optional[dict]:
+        """Resolve a rule-generated task id ("<rule_id>@<year>-W<week>[-<day>]")"""
+        rule_id, _, occurrence = task_id.partition("@")
+        try:
+            year, week_number = int(occurrence[0:4]), int(occurrence[6:8])
+            date.fromisocalendar(year, week_number, 1)
+        except ValueError:
+            return None
+        for task in await self.week(year, week_number):
+            if task["id"] == task_id:
+                return task
+        return None
+
+
+TASK_RULE_POLL_INTERVAL = float(os.environ.get('TASK_RULE_POLL_INTERVAL', '5'))
+rule_sets = SnapshotRegistry(
+    lambda household_id: TaskRuleSet(household_id, TASK_RULE_POLL_INTERVAL),
+    maxsize=SNAPSHOT_CACHE_SIZE
+)
+
+
+async def find_task(household_id: str, task_id: str) -> Optional[dict]:
+    """Look a household's task up by id, whether stored in `tasks` or generated by a rule"""
+    if "@" in task_id:
+        return await rule_sets.get(household_id).find(task_id)
+    task = await store.tasks.get(task_id)
+    if task is None or task.get("household_id", DEFAULT_HOUSEHOLD) != household_id:
+        return None
+    return task
+
+
+async def require_user(user_id: str) -> dict:
+    """The user, or a 404"""
+    user = await user_cache.get(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    return user
+
+
+async def require_admin(user_id: str) -> dict:
+    """Dependency for admin-only endpoints"""
+    user = await user_cache.get(user_id)
+    if not user or not user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+    return user
+
+
+# Streaming - list endpoints answer NDJSON when asked to (keyset cursors are in storage)
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def ndjson_response(docs, extra: List[dict] = ()) -> StreamingResponse:
+    """Stream documents from an async iterator (then any `extra` ones) as one JSON object per line"""
+    async def lines():
+        async for doc in docs:
+            yield json.dumps(doc, ensure_ascii=False, default=str) + "\n"
+        for doc in extra:
+            yield json.dumps(doc, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+
+# Conditional GET - write paths bump version counters in `versions`
+# ("user:<id>", "week:<household>:<year>-W<week>", plus the snapshot names), read paths
+# derive a strong ETag from them and answer If-None-Match with 304
+class ResponseCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+    
+    def get(self, etag: str) -> Optional[dict]:
+        body = self._entries.get(etag)
+        if body is not None:
+            self._entries.move_to_end(etag)
+        return body
+    
+    def put(self, etag: str, body: dict):
+        self._entries[etag] = body
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE', '512')))
+
+
+def user_version_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def week_version_key(household_id: str, year: int, week_number: int) -> str:
+    return f"week:{household_id}:{year}-W{week_number:02d}"
+
+
+async def bump_versions(keys: List[str]):
+    """Record a change to everything derived from the given version keys"""
+    await store.versions.bump(keys)
+
+
+async def conditional_get(request: Request, version_keys: List[str], build, snapshots=(), scope: str = ""):
+    """Serve a read endpoint through its ETag
+    
+    `build` is only awaited when neither the client (If-None-Match) nor the
+    response cache already has the representation for the current versions.
+    """
+    found = await store.versions.get(version_keys)
+    versions = [found.get(key, 0) for key in version_keys]
+    
+    # Make sure in-memory snapshots are not older than the versions the ETag names
+    for snapshot in snapshots:
+        if found.get(snapshot.name, 0) != snapshot.version:
+            await snapshot.reload()
+    
+    fingerprint = json.dumps([
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        scope,
+        version_keys,
+        versions
+    ])
+    etag = '"' + hashlib.sha1(fingerprint.encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(etag)
+    if body is None:
+        body = await build()
+        response_cache.put(etag, body)
+    return JSONResponse(body, headers=headers)
+
+
+# Event broker - in-process pub/sub feeding the SSE stream. When MongoDB
+# supports change streams, events go through the `events` collection so
+# subscribers on every worker see them; otherwise they stay in this process
+class EventBroker:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.fanout = False
+        self._subscribers = {}
+        self._members = {}  # household_id -> {user_id} with a subscription
+    
+    def subscribe(self, user_id: str, household_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        self._members.setdefault(household_id, set()).add(user_id)
+        return queue
+    
+    def unsubscribe(self, user_id: str, household_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+                members = self._members[household_id]
+                members.discard(user_id)
+                if not members:
+                    del self._members[household_id]
+    
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+    
+    def dispatch(self, event: dict):
+        """Deliver an event to local subscribers (user_id None means the whole household)"""
+        if event.get("user_id") is None:
+            targets = [
+                q for user_id in self._members.get(event.get("household_id"), ())
+                for q in self._subscribers[user_id]
+            ]
+        else:
+            targets = list(self._subscribers.get(event["user_id"], ()))
+        
+        for queue in targets:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer - drop its backlog and tell it to refetch everything
+                self.resync(queue, event.get("user_id"))
+    
+    def resync(self, queue: asyncio.Queue, user_id: Optional[str]):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({"type": "resync", "user_id": user_id})
+    
+    def resync_all(self):
+        """Tell every local subscriber to refetch, e.g. after events may have been missed"""
+        for user_id, queues in self._subscribers.items():
+            for queue in queues:
+                self.resync(queue, user_id)
+    
+    async def publish(self, event: dict):
+        await self.publish_many([event])
+    
+    async def publish_many(self, events: List[dict]):
+        """Publish events without ever failing the write that caused them"""
+        if not events:
+            return
+        if self.fanout:
+            try:
+                await store.events.insert_many(events)
+                return
+            except Exception:
+                logger.exception("Could not publish events, delivering locally")
+        for event in events:
+            self.dispatch(event)
+    
+    async def listen(self):
+        """Relay events inserted by any worker, reopening the change stream when it drops
+        
+        While the stream is down events stay in-process; once it is back every
+        local subscriber resyncs, since other workers' events were missed.
+        """
+        if not store.events.change_streams:
+            logger.info("Storage backend has no change streams, events stay in-process")
+            return
+        delay = EVENT_RETRY_MIN_SECONDS
+        reopened = False
+        while True:
+            try:
+                async for event in store.events.watch():
+                    if event is None:
+                        self.fanout = True
+                        delay = EVENT_RETRY_MIN_SECONDS
+                        logger.info("Event fan-out through change streams enabled")
+                        if reopened:
+                            self.resync_all()
+                        continue
+                    self.dispatch(event)
+                logger.warning(f"Change stream closed, reopening in {delay:g}s")
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info(f"Change streams unavailable, events stay in-process: {e}")
+                    return
+                logger.warning(f"Change stream failed, reopening in {delay:g}s: {e}")
+            except PyMongoError as e:
+                logger.warning(f"Change stream failed, reopening in {delay:g}s: {e}")
+            finally:
+                self.fanout = False
+            reopened = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, EVENT_RETRY_MAX_SECONDS)
+
+
+event_broker = EventBroker(queue_size=int(os.environ.get('EVENT_QUEUE_SIZE', '100')))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', '15'))
+# Backoff between attempts to reopen a dropped change stream
+EVENT_RETRY_MIN_SECONDS = float(os.environ.get('EVENT_RETRY_MIN_SECONDS', '1'))
+EVENT_RETRY_MAX_SECONDS = float(os.environ.get('EVENT_RETRY_MAX_SECONDS', '60'))
+# "The $changeStream stage is only supported on replica sets" - retrying will not help
+CHANGE_STREAMS_UNSUPPORTED = 40573
+event_listener_task = None
+
+
 # API Routes
 @api_router.post("/login")
 async def login(request: LoginRequest):
     """User login/selection"""
-    user = await db.users.find_one({"name": request.name}, {"_id": 0})
+    user = await store.users.get_by_name(request.household_id, request.name)
     if not user:
         raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
     
@@ -128,84 +970,269 @@ async def login(request: LoginRequest):
 
 
 @api_router.get("/users/{user_id}")
-async def get_user(user_id: str):
+async def get_user(request: Request, user_id: str):
     """Get user details"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
-    return user
+    async def build():
+        # Not the user cache: the body must be at least as new as the versions in its ETag
+        user = await store.users.get(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+        return user
+    
+    return await conditional_get(request, [user_version_key(user_id)], build)
+
+
+@api_router.get("/users/{user_id}/weeks")
+async def get_user_weeks(user_id: str):
+    """Get a user's archived per-week summaries, oldest first"""
+    user = await require_user(user_id)
+    return {"weeks": await store.archive.user_summaries(user["household_id"], user_id)}
+
+
+ROLLUP_FIELDS = (
+    "points", "strength", "agility", "charisma", "endurance", "level",
+    "completed", "health_lost", "health_adjustment"
+)
+MAX_HISTORY_DAYS = 366
+
+
+@api_router.get("/users/{user_id}/history")
+async def get_user_history(
+    request: Request,
+    user_id: str,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """Get a user's day-by-day progress (default: the last 30 days)"""
+    today = get_turkey_now()
+    return await conditional_get(
+        request,
+        [user_version_key(user_id)],
+        lambda: load_user_history(today, user_id, date_from, date_to),
+        scope=today.date().isoformat()
+    )
+
+
+async def load_user_history(today: datetime, user_id: str, date_from: Optional[str], date_to: Optional[str]) -> dict:
+    """Daily rollups between two dates, one entry per day (zeros where nothing happened)"""
+    end = parse_rule_date(date_to, today.date())
+    start = parse_rule_date(date_from, end - timedelta(days=29))
+    if start > end or (end - start).days >= MAX_HISTORY_DAYS:
+        raise HTTPException(status_code=400, detail="Geçersiz tarih")
+    household_id = (await require_user(user_id))["household_id"]
+    
+    rollups = await store.rollups.between(household_id, user_id, start.isoformat(), end.isoformat())
+    rollups = {r["date"]: r for r in rollups}
+    days = []
+    totals = {field: 0 for field in ROLLUP_FIELDS}
+    for n in range((end - start).days + 1):
+        day = (start + timedelta(days=n)).isoformat()
+        entry = {"date": day}
+        for field in ROLLUP_FIELDS:
+            entry[field] = rollups.get(day, {}).get(field, 0)
+            totals[field] += entry[field]
+        days.append(entry)
+    return {"from": start.isoformat(), "to": end.isoformat(), "days": days, "totals": totals}
+
+
+@api_router.get("/events")
+async def stream_events(request: Request, user_id: str):
+    """Server-Sent Events stream of changes relevant to a user"""
+    household_id = (await require_user(user_id))["household_id"]
+    queue = event_broker.subscribe(user_id, household_id)
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            event_broker.unsubscribe(user_id, household_id, queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+def schedule_version_keys(user: dict, today: datetime) -> List[str]:
+    """Version keys a user's task lists for today depend on"""
+    year, week_number, _ = today.isocalendar()
+    return [
+        user_version_key(user["id"]),
+        week_version_key(user["household_id"], year, week_number),
+        rule_sets.get(user["household_id"]).name
+    ]
 
 
 @api_router.get("/tasks/today")
-async def get_today_tasks(user_id: str):
+async def get_today_tasks(
+    request: Request,
+    user_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None
+):
     """Get today's daily tasks for a user"""
     today = get_turkey_now()
+    user = await require_user(user_id)
+    # The day is part of the ETag: the same versions mean different tasks tomorrow
+    return await conditional_get(
+        request,
+        schedule_version_keys(user, today),
+        lambda: load_today_tasks(today, user, limit, after),
+        snapshots=[rule_sets.get(user["household_id"])],
+        scope=today.date().isoformat()
+    )
+
+
+async def load_today_tasks(today: datetime, user: dict, limit: int, after: Optional[str]) -> dict:
+    """Today's daily tasks for a user, with completion flags"""
+    user_id, household_id = user["id"], user["household_id"]
     day_name = get_turkish_day_name(today.weekday())
-    week_number = today.isocalendar()[1]
-    year = today.year
+    year, week_number, _ = today.isocalendar()
+    
+    rule_tasks = [
+        t for t in await rule_sets.get(household_id).week(year, week_number)
+        if not t["is_weekly"] and t["day_of_week"] == day_name and is_assigned(t, user_id)
+    ]
     
     # Get all daily tasks for today (assigned to this user or to all)
-    tasks = await db.tasks.find({
-        "day_of_week": day_name,
-        "week_number": week_number,
-        "year": year,
-        "is_active": True,
-        "is_weekly": False,
-        "$or": [
-            {"assigned_to": user_id},
-            {"assigned_to": None},
-            {"assigned_to": {"$exists": False}}
-        ]
-    }, {"_id": 0}).to_list(100)
+    tasks, next_cursor = await store.tasks.page(
+        household_id, limit, after, extra=rule_tasks,
+        year=year, week_number=week_number, is_weekly=False, day_of_week=day_name, user_id=user_id
+    )
     
     # Get completed tasks for this user
     today_str = today.strftime("%Y-%m-%d")
-    completed = await db.completed_tasks.find({
-        "user_id": user_id,
-        "completed_date": today_str
-    }, {"_id": 0}).to_list(100)
-    
-    completed_task_ids = [ct["task_id"] for ct in completed]
+    completed_task_ids = await store.completions.task_ids(household_id, user_id, completed_date=today_str)
     
     # Mark tasks as completed
     for task in tasks:
         task["is_completed"] = task["id"] in completed_task_ids
     
-    return {"tasks": tasks, "day": day_name}
+    return {"tasks": tasks, "day": day_name, "next_cursor": next_cursor}
 
 
 @api_router.get("/tasks/weekly")
-async def get_weekly_tasks(user_id: str):
+async def get_weekly_tasks(
+    request: Request,
+    user_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None
+):
     """Get this week's weekly tasks"""
     today = get_turkey_now()
-    week_number = today.isocalendar()[1]
-    year = today.year
+    user = await require_user(user_id)
+    return await conditional_get(
+        request,
+        schedule_version_keys(user, today),
+        lambda: load_weekly_tasks(today, user, limit, after),
+        snapshots=[rule_sets.get(user["household_id"])]
+    )
+
+
+async def load_weekly_tasks(today: datetime, user: dict, limit: int, after: Optional[str]) -> dict:
+    """This week's weekly tasks for a user, with completion flags"""
+    user_id, household_id = user["id"], user["household_id"]
+    year, week_number, _ = today.isocalendar()
     
-    # Get all weekly tasks for this week (assigned to this user or to all)
-    tasks = await db.tasks.find({
-        "week_number": week_number,
-        "year": year,
-        "is_active": True,
-        "is_weekly": True,
-        "$or": [
-            {"assigned_to": user_id},
-            {"assigned_to": None},
-            {"assigned_to": {"$exists": False}}
-        ]
-    }, {"_id": 0}).to_list(100)
+    rule_tasks = [
+        t for t in await rule_sets.get(household_id).week(year, week_number)
+        if t["is_weekly"] and is_assigned(t, user_id)
+    ]
     
-    # Check completion status
-    completed = await db.completed_tasks.find({
-        "user_id": user_id
-    }, {"_id": 0}).to_list(1000)
+    # Get all weekly tasks for this week (assigned to this user or to all)
+    tasks, next_cursor = await store.tasks.page(
+        household_id, limit, after, extra=rule_tasks,
+        year=year, week_number=week_number, is_weekly=True, user_id=user_id
+    )
     
-    completed_task_ids = [ct["task_id"] for ct in completed]
+    # Check completion status - only for this week's tasks, not the whole history
+    task_ids = [task["id"] for task in tasks]
+    completed_task_ids = set()
+    if task_ids:
+        completed_task_ids = await store.completions.task_ids(household_id, user_id, task_ids=task_ids)
     
     # Mark tasks as completed
     for task in tasks:
         task["is_completed"] = task["id"] in completed_task_ids
     
-    return {"tasks": tasks}
+    return {"tasks": tasks, "next_cursor": next_cursor}
+
+
+@api_router.get("/dashboard")
+async def get_dashboard(request: Request, user_id: str):
+    """Get the user, today's tasks and this week's tasks in one aggregation"""
+    today = get_turkey_now()
+    user = await require_user(user_id)
+    return await conditional_get(
+        request,
+        schedule_version_keys(user, today),
+        lambda: load_dashboard(today, user["household_id"], user_id),
+        snapshots=[rule_sets.get(user["household_id"])],
+        scope=today.date().isoformat()
+    )
+
+
+async def load_dashboard(today: datetime, household_id: str, user_id: str) -> dict:
+    """The user plus today's and this week's tasks, in one aggregation"""
+    today_str = today.strftime("%Y-%m-%d")
+    day_name = get_turkish_day_name(today.weekday())
+    year, week_number, _ = today.isocalendar()
+    
+    rule_tasks = [
+        t for t in await rule_sets.get(household_id).week(year, week_number)
+        if (t["is_weekly"] or t["day_of_week"] == day_name) and is_assigned(t, user_id)
+    ]
+    
+    result = await store.dashboard(
+        household_id, user_id, year, week_number, day_name, today_str, [t["id"] for t in rule_tasks]
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    
+    user = result["user"]
+    schedule = {"daily": result["daily"], "weekly": result["weekly"]}
+    
+    rule_completions = result["rule_completions"]
+    done_today = {ct["task_id"] for ct in rule_completions if ct["completed_date"] == today_str}
+    done_ever = {ct["task_id"] for ct in rule_completions}
+    for task in rule_tasks:
+        if task["is_weekly"]:
+            task["is_completed"] = task["id"] in done_ever
+            schedule["weekly"].append(task)
+        else:
+            task["is_completed"] = task["id"] in done_today
+            schedule["daily"].append(task)
+    
+    def position(task):
+        return tuple(task.get(k) for k in TASK_SORT)
+    
+    return {
+        "user": user,
+        "day": day_name,
+        "daily_tasks": sorted(schedule["daily"], key=position),
+        "weekly_tasks": sorted(schedule["weekly"], key=position)
+    }
+
+
+def completion_increments(task: dict) -> dict:
+    """Points and stats a completion adds - plus a level for a Sunday daily task"""
+    increments = {
+        "points": task["points"],
+        "strength": task.get("strength", 0),
+        "agility": task.get("agility", 0),
+        "charisma": task.get("charisma", 0),
+        "endurance": task.get("endurance", 0)
+    }
+    if task.get("day_of_week") == "Pazar" and not task.get("is_weekly", False):
+        increments["level"] = 1
+    return increments
 
 
 @api_router.post("/tasks/complete")
@@ -214,125 +1241,257 @@ async def complete_task(request: CompleteTaskRequest):
     today = get_turkey_now()
     today_str = today.strftime("%Y-%m-%d")
     
-    # Check if already completed (for daily tasks)
-    task = await db.tasks.find_one({"id": request.task_id}, {"_id": 0})
+    household_id = (await require_user(request.user_id))["household_id"]
+    task = await find_task(household_id, request.task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Görev bulunamadı")
     
-    # For daily tasks, check if already completed today
-    # For weekly tasks, check if ever completed
-    if not task.get("is_weekly", False):
-        existing = await db.completed_tasks.find_one({
-            "user_id": request.user_id,
-            "task_id": request.task_id,
-            "completed_date": today_str
-        })
-    else:
-        existing = await db.completed_tasks.find_one({
-            "user_id": request.user_id,
-            "task_id": request.task_id
-        })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Bu görev zaten tamamlanmış")
-    
-    # Get user
-    user = await db.users.find_one({"id": request.user_id}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
-    
-    # Mark as completed
+    # Record the completion first - the unique (household_id, user_id, task_id,
+    # completed_date) index turns a duplicate tap into a DuplicateKeyError
     completed = {
         "id": f"{request.user_id}_{request.task_id}_{today_str}",
+        "household_id": household_id,
         "user_id": request.user_id,
         "task_id": request.task_id,
         "completed_date": today_str
     }
-    await db.completed_tasks.insert_one(completed)
-    
-    # Update user stats and points
-    new_points = user["points"] + task["points"]
-    new_strength = user.get("strength", 10) + task.get("strength", 0)
-    new_agility = user.get("agility", 10) + task.get("agility", 0)
-    new_charisma = user.get("charisma", 10) + task.get("charisma", 0)
-    new_endurance = user.get("endurance", 10) + task.get("endurance", 0)
-    
-    update_data = {
-        "points": new_points,
-        "strength": new_strength,
-        "agility": new_agility,
-        "charisma": new_charisma,
-        "endurance": new_endurance
-    }
+    try:
+        if not task.get("is_weekly", False):
+            # Daily tasks can be completed once per day
+            await store.completions.insert(completed)
+        else:
+            # Weekly tasks can be completed once per week - each week has its own task
+            if not await store.completions.insert_once(completed):
+                raise HTTPException(status_code=400, detail="Bu görev zaten tamamlanmış")
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Bu görev zaten tamamlanmış")
     
-    # Check if it's Sunday - level up
-    level_up = False
-    new_level = user["level"]
-    reward = None
+    # Apply points and stats atomically
+    increments = completion_increments(task)
+    level_up = "level" in increments
     
-    if task.get("day_of_week") == "Pazar" and not task.get("is_weekly", False):
-        new_level = user["level"] + 1
-        update_data["level"] = new_level
-        level_up = True
-        
-        # Get reward
-        reward_doc = await db.level_rewards.find_one({"level": new_level}, {"_id": 0})
-        if reward_doc:
-            reward = reward_doc
-    
-    await db.users.update_one(
-        {"id": request.user_id},
-        {"$set": update_data}
-    )
+    user = await store.users.increment(request.user_id, increments)
+    if not user:
+        await store.completions.delete(completed)
+        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    user_cache.invalidate(request.user_id)
+    await bump_versions([user_version_key(request.user_id)])
+    await event_broker.publish({"type": "user", "user_id": request.user_id})
+    await store.rollups.add_many([(household_id, request.user_id, today_str, dict(increments, completed=1))])
+    
+    reward = None
+    if level_up:
+        rewards = await reward_tables.get(household_id).current()
+        if user["level"] in rewards:
+            reward = dict(rewards[user["level"]])
     
     return {
         "success": True,
-        "new_points": new_points,
+        "new_points": user["points"],
         "stats": {
-            "strength": new_strength,
-            "agility": new_agility,
-            "charisma": new_charisma,
-            "endurance": new_endurance
+            "strength": user["strength"],
+            "agility": user["agility"],
+            "charisma": user["charisma"],
+            "endurance": user["endurance"]
         },
         "level_up": level_up,
-        "new_level": new_level,
+        "new_level": user["level"],
         "reward": reward
     }
 
 
-@api_router.get("/tasks/week")
-async def get_week_tasks(user_id: str):
-    """Get all tasks for current week (admin view)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+# Offline clients may queue taps for this long before they sync
+OFFLINE_COMPLETION_DAYS = 1
+# A replay waits this long for the request that claimed its keys, which loses
+# its claims after IDEMPOTENCY_CLAIM_SECONDS if it died on the way
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_POLL_SECONDS = 0.05
+IDEMPOTENCY_CLAIM_SECONDS = float(os.environ.get('IDEMPOTENCY_CLAIM_SECONDS', '60'))
+
+
+def completion_date(completed_at: Optional[datetime], today: datetime) -> str:
+    """The Turkey date of a queued tap, clamped to the last OFFLINE_COMPLETION_DAYS days"""
+    day = today.date()
+    if completed_at is not None:
+        if completed_at.tzinfo is None:
+            completed_at = TURKEY_TZ.localize(completed_at)
+        tapped = completed_at.astimezone(TURKEY_TZ).date()
+        day = min(day, max(tapped, day - timedelta(days=OFFLINE_COMPLETION_DAYS)))
+    return day.strftime("%Y-%m-%d")
+
+
+async def claimed_results(household_id: str, user_id: str, keys: List[str]) -> dict:
+    """Results of keys claimed by other requests, waiting while those still run"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        stored = await store.idempotency.get_many(household_id, user_id, keys)
+        if all(stored.get(key) is not None for key in keys):
+            return stored
+        # A key gone missing was released by a failed request - the client retries it
+        if len(stored) < len(keys) or time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="Bu işlem henüz tamamlanmadı, tekrar deneyin")
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+@api_router.post("/tasks/complete/batch")
+async def complete_tasks_batch(request: CompleteTaskBatchRequest):
+    """Apply a queue of completions from an offline client
+    
+    Each completion is applied at most once per idempotency key: the keys are
+    claimed before anything is recorded, and a key claimed by another request
+    gets that request's result. New completions are recorded in one bulk
+    write and their points and stats in one increment.
+    """
+    if not request.completions:
+        raise HTTPException(status_code=400, detail="Görev listesi boş")
+    household_id = (await require_user(request.user_id))["household_id"]
+    
+    keys = list(dict.fromkeys(item.idempotency_key for item in request.completions))
+    claim = new_id("claim")
+    replayed = await store.idempotency.claim_many(
+        household_id, request.user_id, keys, claim, IDEMPOTENCY_CLAIM_SECONDS
+    )
+    claimed = [key for key in keys if key not in replayed]
     
     today = get_turkey_now()
-    week_number = today.isocalendar()[1]
-    year = today.year
+    tasks = {}
+    results = {}
+    pending = []  # (key, task, completion) in queue order
+    seen = set(replayed)
+    try:
+        for item in request.completions:
+            key = item.idempotency_key
+            if key in seen:
+                continue
+            seen.add(key)
+            if item.task_id not in tasks:
+                tasks[item.task_id] = await find_task(household_id, item.task_id)
+            task = tasks[item.task_id]
+            if not task:
+                results[key] = {"task_id": item.task_id, "success": False, "error": "Görev bulunamadı"}
+                continue
+            completed_date = completion_date(item.completed_at, today)
+            pending.append((key, task, {
+                "id": f"{request.user_id}_{item.task_id}_{completed_date}",
+                "household_id": household_id,
+                "user_id": request.user_id,
+                "task_id": item.task_id,
+                "completed_date": completed_date
+            }))
+        
+        recorded = await store.completions.record_many(
+            [completion for _, _, completion in pending],
+            [task.get("is_weekly", False) for _, task, _ in pending]
+        )
+        
+        increments = {}
+        accepted = []
+        for (key, task, completion), new in zip(pending, recorded):
+            if not new:
+                results[key] = {
+                    "task_id": completion["task_id"], "success": False, "error": "Bu görev zaten tamamlanmış"
+                }
+                continue
+            for field, amount in completion_increments(task).items():
+                increments[field] = increments.get(field, 0) + amount
+            accepted.append((key, task, completion))
+        
+        user = await store.users.increment(request.user_id, increments) if increments else None
+        if increments and not user:
+            for _, _, completion in accepted:
+                await store.completions.delete(completion)
+            raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    except Exception:
+        # Nothing was applied - let a retry claim the keys again
+        await store.idempotency.release_many(household_id, request.user_id, claim, claimed)
+        raise
     
-    tasks = await db.tasks.find({
-        "week_number": week_number,
-        "year": year,
-        "is_active": True
-    }, {"_id": 0}).to_list(100)
+    if increments:
+        user_cache.invalidate(request.user_id)
+        await bump_versions([user_version_key(request.user_id)])
+        await event_broker.publish({"type": "user", "user_id": request.user_id})
+        
+        daily = {}
+        for _, task, completion in accepted:
+            fields = daily.setdefault(completion["completed_date"], {"completed": 0})
+            fields["completed"] += 1
+            for field, amount in completion_increments(task).items():
+                fields[field] = fields.get(field, 0) + amount
+        await store.rollups.add_many([
+            (household_id, request.user_id, day, fields) for day, fields in daily.items()
+        ])
+        
+        # Walk the levels up again in queue order to find each level-up's reward
+        rewards = await reward_tables.get(household_id).current()
+        level = user["level"] - increments.get("level", 0)
+        for key, task, completion in accepted:
+            level_up = "level" in completion_increments(task)
+            level += 1 if level_up else 0
+            results[key] = {
+                "task_id": completion["task_id"],
+                "success": True,
+                "completed_date": completion["completed_date"],
+                "points": task["points"],
+                "level_up": level_up,
+                "new_level": level,
+                "reward": dict(rewards[level]) if level_up and level in rewards else None
+            }
     
-    return {"tasks": tasks}
+    await store.idempotency.complete_many(household_id, request.user_id, claim, results)
+    if replayed:
+        results.update(await claimed_results(household_id, request.user_id, replayed))
+    if not increments:
+        user = await user_cache.get(request.user_id)
+    
+    items = []
+    for item in request.completions:
+        key = item.idempotency_key
+        items.append(dict(results[key], idempotency_key=key, replayed=key in replayed))
+    return {
+        "success": all(item["success"] for item in items),
+        "results": items,
+        "user": user
+    }
 
 
-@api_router.post("/tasks")
-async def create_task(task: TaskCreate, user_id: str):
-    """Create a new task (admin only)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+@api_router.get("/tasks/week")
+async def get_week_tasks(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None,
+    all_weeks: bool = False,
+    admin: dict = Depends(require_admin)
+):
+    """Get all tasks for current week, or every week (admin view)"""
+    household_id = admin["household_id"]
+    filters = {}
+    rule_tasks = []
+    if not all_weeks:
+        year, week_number, _ = get_turkey_now().isocalendar()
+        filters.update({"week_number": week_number, "year": year})
+        rule_tasks = await rule_sets.get(household_id).week(year, week_number)
     
-    today = get_turkey_now()
-    week_number = today.isocalendar()[1]
-    year = today.year
+    if wants_ndjson(request):
+        return ndjson_response(store.tasks.stream(household_id, after, **filters), extra=rule_tasks)
     
-    new_task = {
-        "id": f"task_{today.timestamp()}",
+    tasks, next_cursor = await store.tasks.page(household_id, limit, after, extra=rule_tasks, **filters)
+    return {"tasks": tasks, "next_cursor": next_cursor}
+
+
+async def check_assignee(household_id: str, user_id: Optional[str]):
+    """Tasks and rules can only be assigned to a member of the same household"""
+    if user_id is not None:
+        user = await user_cache.get(user_id)
+        if not user or user["household_id"] != household_id:
+            raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+
+
+def build_task_document(task: TaskCreate, now: datetime, household_id: str) -> dict:
+    """Build a household's task document stamped with the current ISO week"""
+    year, week_number, _ = now.isocalendar()
+    return {
+        "id": new_id("task"),
+        "household_id": household_id,
         "title": task.title,
         "points": task.points,
         "strength": task.strength,
@@ -345,40 +1504,221 @@ async def create_task(task: TaskCreate, user_id: str):
         "week_number": week_number,
         "year": year,
         "is_active": True,
-        "created_at": today.isoformat()
+        "created_at": now.isoformat()
     }
+
+
+@api_router.post("/tasks")
+async def create_task(task: TaskCreate, admin: dict = Depends(require_admin)):
+    """Create a new task (admin only)"""
+    household_id = admin["household_id"]
+    await check_assignee(household_id, task.assigned_to)
+    new_task = build_task_document(task, get_turkey_now(), household_id)
     
     # Make a copy before inserting (MongoDB will add _id to the original)
     task_copy = new_task.copy()
-    await db.tasks.insert_one(new_task)
+    await store.tasks.insert(new_task)
+    await bump_versions([week_version_key(household_id, new_task["year"], new_task["week_number"])])
+    await event_broker.publish({
+        "type": "tasks",
+        "household_id": household_id,
+        "user_id": new_task["assigned_to"]
+    })
     return {"success": True, "task": task_copy}
 
 
+@api_router.post("/tasks/bulk")
+async def create_tasks_bulk(request: TaskBulkCreate, admin: dict = Depends(require_admin)):
+    """Create many tasks with a single insert (admin only)"""
+    payloads = list(request.tasks)
+    if request.template is not None:
+        for day in request.days:
+            payloads.append(request.template.model_copy(
+                update={"day_of_week": day.value, "is_weekly": False}
+            ))
+    
+    if not payloads:
+        raise HTTPException(status_code=400, detail="Görev listesi boş")
+    household_id = admin["household_id"]
+    for assignee in {payload.assigned_to for payload in payloads}:
+        await check_assignee(household_id, assignee)
+    
+    today = get_turkey_now()
+    new_tasks = [build_task_document(payload, today, household_id) for payload in payloads]
+    
+    # Make copies before inserting (MongoDB will add _id to the originals)
+    results = [{"success": True, "task": t.copy()} for t in new_tasks]
+    errors = await store.tasks.insert_many(new_tasks)
+    for index, message in errors.items():
+        results[index] = {"success": False, "task": None, "error": message}
+    
+    await bump_versions([week_version_key(household_id, *today.isocalendar()[:2])])
+    await event_broker.publish({"type": "tasks", "household_id": household_id, "user_id": None})
+    
+    created = sum(1 for r in results if r["success"])
+    return {"success": created == len(results), "created": created, "results": results}
+
+
 @api_router.post("/tasks/{task_id}/delete")
-async def delete_task(task_id: str, user_id: str):
+async def delete_task(task_id: str, admin: dict = Depends(require_admin)):
     """Delete a task (admin only)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+    # A rule-generated day cannot be deleted alone - the whole rule goes through /task-rules
+    if "@" in task_id:
+        raise HTTPException(status_code=400, detail="Tekrarlayan görev kuralı ile silinmeli")
+    
+    household_id = admin["household_id"]
+    task = await store.tasks.deactivate(household_id, task_id)
+    if task:
+        await bump_versions([week_version_key(household_id, task["year"], task["week_number"])])
+        await event_broker.publish({"type": "tasks", "household_id": household_id, "user_id": None})
+    
+    return {"success": True}
+
+
+def parse_iso_week(value: str) -> tuple:
+    """Parse an ISO week such as "2025-W07" into (2025, 7)"""
+    match = re.fullmatch(r"(\d{4})-W(\d{2})", value)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Geçersiz hafta")
+    year, week_number = int(match.group(1)), int(match.group(2))
+    try:
+        date.fromisocalendar(year, week_number, 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz hafta")
+    return year, week_number
+
+
+@api_router.post("/weeks/clone")
+async def clone_week(
+    source: str = Query(..., alias="from"),
+    target: str = Query(..., alias="to"),
+    assigned_to: Optional[str] = None,
+    is_weekly: Optional[bool] = None,
+    admin: dict = Depends(require_admin)
+):
+    """Copy a week's active tasks into another week (admin only)
     
-    await db.tasks.update_one(
-        {"id": task_id},
-        {"$set": {"is_active": False}}
+    Each task is copied at most once per target week, so running it again
+    only fills in what is missing.
+    """
+    source_week, target_week = parse_iso_week(source), parse_iso_week(target)
+    if source_week == target_week:
+        raise HTTPException(status_code=400, detail="Kaynak ve hedef hafta aynı")
+    household_id = admin["household_id"]
+    await check_assignee(household_id, assigned_to)
+    
+    result = await store.tasks.clone_week(
+        household_id, source_week, target_week, get_turkey_now().isoformat(),
+        is_weekly=is_weekly, assigned_to=assigned_to
     )
+    if result["inserted"]:
+        await bump_versions([week_version_key(household_id, *target_week)])
+        await event_broker.publish({"type": "tasks", "household_id": household_id, "user_id": None})
+    
+    return {
+        "success": True,
+        "inserted": result["inserted"],
+        "skipped": result["matched"] - result["inserted"]
+    }
+
+
+# Recurring Task Rules
+def parse_rule_date(value: Optional[str], default: Optional[date]) -> Optional[date]:
+    if value is None:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz tarih")
+
+
+@api_router.get("/task-rules")
+async def get_task_rules(admin: dict = Depends(require_admin)):
+    """Get all active recurring task rules (admin only)"""
+    rules = rule_sets.get(admin["household_id"])
+    await rules.refresh()
+    return {"rules": [dict(rule) for rule in rules.rules]}
+
+
+@api_router.post("/task-rules")
+async def create_task_rule(rule: TaskRuleCreate, admin: dict = Depends(require_admin)):
+    """Create a recurring task rule (admin only)"""
+    today = get_turkey_now()
+    start_date = parse_rule_date(rule.start_date, today.date())
+    end_date = parse_rule_date(rule.end_date, None)
+    if end_date is not None and end_date < start_date:
+        raise HTTPException(status_code=400, detail="Geçersiz tarih")
+    if not rule.is_weekly and not rule.days_of_week:
+        raise HTTPException(status_code=400, detail="En az bir gün seçilmeli")
+    household_id = admin["household_id"]
+    await check_assignee(household_id, rule.assigned_to)
+    
+    new_rule = {
+        "id": new_id("rule"),
+        "household_id": household_id,
+        "title": rule.title,
+        "points": rule.points,
+        "strength": rule.strength,
+        "agility": rule.agility,
+        "charisma": rule.charisma,
+        "endurance": rule.endurance,
+        "is_weekly": rule.is_weekly,
+        "days_of_week": [] if rule.is_weekly else [d.value for d in rule.days_of_week],
+        "assigned_to": rule.assigned_to,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat() if end_date else None,
+        "is_active": True,
+        "created_at": today.isoformat()
+    }
+    
+    # Make a copy before inserting (MongoDB will add _id to the original)
+    rule_copy = new_rule.copy()
+    await store.rules.insert(new_rule)
+    await rule_sets.get(household_id).bump()
+    await event_broker.publish({
+        "type": "tasks",
+        "household_id": household_id,
+        "user_id": new_rule["assigned_to"]
+    })
+    return {"success": True, "rule": rule_copy}
+
+
+@api_router.post("/task-rules/{rule_id}/delete")
+async def delete_task_rule(rule_id: str, admin: dict = Depends(require_admin)):
+    """Deactivate a recurring task rule (admin only)"""
+    household_id = admin["household_id"]
+    await store.rules.deactivate(household_id, rule_id)
+    await rule_sets.get(household_id).bump()
+    await event_broker.publish({"type": "tasks", "household_id": household_id, "user_id": None})
     
     return {"success": True}
 
 
 # Reward Management Endpoints
 @api_router.get("/rewards")
-async def get_rewards(user_id: str):
+async def get_rewards(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = None,
+    admin: dict = Depends(require_admin)
+):
     """Get all rewards (admin only)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+    reward_table = reward_tables.get(admin["household_id"])
+    
+    async def build():
+        rewards = await reward_table.current()
+        # The snapshot is ordered by level, so the level itself is the cursor
+        page = [dict(r) for level, r in rewards.items() if after is None or level > after]
+        next_cursor = page[limit - 1]["level"] if len(page) > limit else None
+        return {"rewards": page[:limit], "next_cursor": next_cursor}
     
-    rewards = await db.level_rewards.find({}, {"_id": 0}).sort("level", 1).to_list(100)
-    return {"rewards": rewards}
+    if wants_ndjson(request):
+        rewards = await reward_table.current()
+        page = [dict(r) for level, r in rewards.items() if after is None or level > after]
+        lines = (json.dumps(r, ensure_ascii=False) + "\n" for r in page)
+        return StreamingResponse(lines, media_type=NDJSON)
+    
+    return await conditional_get(request, [reward_table.name], build, snapshots=[reward_table])
 
 
 class RewardUpdate(BaseModel):
@@ -389,12 +1729,8 @@ class RewardUpdate(BaseModel):
 
 
 @api_router.post("/rewards")
-async def create_or_update_reward(reward: RewardUpdate, user_id: str):
+async def create_or_update_reward(reward: RewardUpdate, admin: dict = Depends(require_admin)):
     """Create or update a reward (admin only)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
-    
     reward_data = {
         "level": reward.level,
         "title": reward.title,
@@ -403,23 +1739,17 @@ async def create_or_update_reward(reward: RewardUpdate, user_id: str):
     }
     
     # Upsert - update if exists, insert if not
-    await db.level_rewards.update_one(
-        {"level": reward.level},
-        {"$set": reward_data},
-        upsert=True
-    )
+    await store.rewards.upsert(admin["household_id"], reward_data)
+    await reward_tables.get(admin["household_id"]).bump()
     
     return {"success": True, "reward": reward_data}
 
 
 @api_router.delete("/rewards/{level}")
-async def delete_reward(level: int, user_id: str):
+async def delete_reward(level: int, admin: dict = Depends(require_admin)):
     """Delete a reward (admin only)"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user or not user.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
-    
-    await db.level_rewards.delete_one({"level": level})
+    await store.rewards.delete(admin["household_id"], level)
+    await reward_tables.get(admin["household_id"]).bump()
     return {"success": True}
 
 
@@ -429,16 +1759,10 @@ class HealthUpdate(BaseModel):
 
 
 @api_router.post("/users/{target_user_id}/health")
-async def update_user_health(target_user_id: str, health_update: HealthUpdate, user_id: str):
+async def update_user_health(target_user_id: str, health_update: HealthUpdate, admin: dict = Depends(require_admin)):
     """Update user health (admin only)"""
-    # Check if requester is admin
-    admin = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not admin or not admin.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
-    
-    # Get target user
-    target_user = await db.users.find_one({"id": target_user_id}, {"_id": 0})
-    if not target_user:
+    target = await user_cache.get(target_user_id)
+    if not target or target["household_id"] != admin["household_id"]:
         raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
     
     # Update health (clamp between 0 and 15)
@@ -447,10 +1771,24 @@ async def update_user_health(target_user_id: str, health_update: HealthUpdate, u
     # If health > 0, reset game_over
     game_over = new_health == 0
     
-    await db.users.update_one(
-        {"id": target_user_id},
-        {"$set": {"health": new_health, "game_over": game_over}}
-    )
+    previous_health = await store.users.set_health(target_user_id, new_health, game_over)
+    user_cache.invalidate(target_user_id)
+    await bump_versions([user_version_key(target_user_id)])
+    await event_broker.publish({
+        "type": "user",
+        "user_id": target_user_id,
+        "health": new_health,
+        "game_over": game_over
+    })
+    if previous_health is None:
+        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
+    if new_health != previous_health:
+        await store.rollups.add_many([(
+            target["household_id"],
+            target_user_id,
+            get_turkey_now().strftime("%Y-%m-%d"),
+            {"health_adjustment": new_health - previous_health}
+        )])
     
     return {
         "success": True,
@@ -460,21 +1798,66 @@ async def update_user_health(target_user_id: str, health_update: HealthUpdate, u
 
 
 @api_router.get("/users/all/list")
-async def get_all_users(user_id: str):
+async def get_all_users(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = None,
+    admin: dict = Depends(require_admin)
+):
     """Get all users (admin only)"""
-    # Check if requester is admin
-    admin = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not admin or not admin.get("is_admin", False):
-        raise HTTPException(status_code=403, detail="Yetkiniz yok")
+    if wants_ndjson(request):
+        return ndjson_response(store.users.stream(admin["household_id"], after))
     
-    users = await db.users.find({}, {"_id": 0}).to_list(10)
-    return {"users": users}
+    users, next_cursor = await store.users.page(admin["household_id"], limit, after)
+    return {"users": users, "next_cursor": next_cursor}
+
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-route latency and status counts, Mongo commands"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@api_router.get("/profiles")
+async def get_profiles(admin: dict = Depends(require_admin)):
+    """List the stored request profiles, newest first (admin only)"""
+    return {"enabled": PROFILING, "profiles": await asyncio.to_thread(read_profiles)}
+
+
+def profile_path(profile_id: str, suffix: str) -> Path:
+    path = PROFILE_DIR / f"{profile_id}{suffix}"
+    if not PROFILE_ID.match(profile_id) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profil bulunamadı")
+    return path
+
+
+@api_router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, admin: dict = Depends(require_admin)):
+    """A profile's summary: Mongo commands and the slowest functions (admin only)"""
+    path = profile_path(profile_id, ".json")
+    return JSONResponse(json.loads(await asyncio.to_thread(path.read_text)))
+
+
+@api_router.get("/profiles/{profile_id}/download")
+async def download_profile(profile_id: str, admin: dict = Depends(require_admin)):
+    """Download a profile in cProfile format (admin only)"""
+    return FileResponse(
+        profile_path(profile_id, ".prof"),
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.prof"
+    )
+
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(admin: dict = Depends(require_admin)):
+    """Get user cache hit/miss counters (admin only)"""
+    return {"users": user_cache.stats()}
 
 
 @api_router.post("/daily-check")
 async def daily_health_check(user_id: str):
-    """Check if user completed tasks yesterday, reduce health if not"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    """Report the health loss applied by today's health decay job"""
+    user = await store.users.get(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
     
@@ -484,99 +1867,474 @@ async def daily_health_check(user_id: str):
     today = get_turkey_now()
     today_str = today.strftime("%Y-%m-%d")
     
-    # Check if already checked today
-    if user.get("last_check_date") == today_str:
+    # The scheduled job has not reached this user yet (e.g. it is still running)
+    if user.get("last_check_date") != today_str:
+        await run_health_decay(today, user_id=user_id)
+    
+    # Report the loss once a day; later reloads just see that it was checked
+    user = await store.users.claim_health_report(user_id, today_str)
+    if not user:
+        user = await store.users.get(user_id)
         return {"checked": True, "health": user["health"]}
+    user_cache.invalidate(user_id)
+    await bump_versions([user_version_key(user_id)])
     
-    # Check yesterday's tasks
-    from datetime import timedelta
-    yesterday = today - timedelta(days=1)
-    yesterday_str = yesterday.strftime("%Y-%m-%d")
-    day_name = get_turkish_day_name(yesterday.weekday())
-    week_number = yesterday.isocalendar()[1]
-    year = yesterday.year
-    
-    # Get yesterday's daily tasks
-    yesterday_tasks = await db.tasks.find({
-        "day_of_week": day_name,
-        "week_number": week_number,
-        "year": year,
-        "is_active": True,
-        "is_weekly": False
-    }, {"_id": 0}).to_list(100)
-    
-    # Get completed tasks from yesterday
-    completed = await db.completed_tasks.find({
-        "user_id": user_id,
-        "completed_date": yesterday_str
-    }, {"_id": 0}).to_list(100)
-    
-    # Check weekly tasks if it's Monday (new week)
-    weekly_health_loss = 0
-    if today.weekday() == 0:  # Monday
-        last_week_number = (today - timedelta(days=7)).isocalendar()[1]
-        last_week_tasks = await db.tasks.find({
-            "week_number": last_week_number,
-            "year": year,
-            "is_active": True,
-            "is_weekly": True
-        }, {"_id": 0}).to_list(100)
-        
-        if last_week_tasks:
-            # Check if any weekly task was completed
-            weekly_completed = await db.completed_tasks.find({
-                "user_id": user_id,
-                "task_id": {"$in": [t["id"] for t in last_week_tasks]}
-            }, {"_id": 0}).to_list(100)
-            
-            # Each uncompleted weekly task costs 1 health
-            weekly_health_loss = len(last_week_tasks) - len(weekly_completed)
+    health_loss = user.get("last_health_loss", 0)
+    return {
+        "health_reduced": health_loss > 0,
+        "new_health": user["health"],
+        "game_over": user.get("game_over", False),
+        "weekly_loss": user.get("last_weekly_loss", 0)
+    }
+
+
+# Health decay job
+WORKER_ID = new_id("worker")
+HEALTH_DECAY_LEASE_SECONDS = 600
+MAX_CATCH_UP_DAYS = 90
+nightly_task = None
+
+
+async def run_health_decay(today: datetime, user_id: Optional[str] = None) -> int:
+    """Settle health for every day each user has not been checked yet
     
-    # If there were tasks but none completed, reduce health
-    new_health = user["health"]
-    health_reduced = False
+    For every unchecked day a user loses 1 health if they had daily tasks and
+    completed nothing, and on each new week 1 per uncompleted weekly task of
+    the previous week - counting only the tasks of the user's own household.
+    The whole gap is read with a fixed number of queries, whatever the number
+    of households, and the day-by-day ledger is computed in memory.
+    """
+    today_date = today.date()
+    today_str = today_date.strftime("%Y-%m-%d")
     
-    daily_health_loss = 0
-    if len(yesterday_tasks) > 0 and len(completed) == 0:
-        daily_health_loss = 1
+    users = await store.users.pending_health_checks(today_str, user_id)
+    if not users:
+        return 0
     
-    total_health_loss = daily_health_loss + weekly_health_loss
+    # Days to settle per user: from the last check day up to yesterday
+    oldest = today_date - timedelta(days=MAX_CATCH_UP_DAYS)
+    pending_days = {}
+    for user in users:
+        start = today_date - timedelta(days=1)
+        if user.get("last_check_date"):
+            start = datetime.strptime(user["last_check_date"], "%Y-%m-%d").date()
+        start = max(start, oldest)
+        pending_days[user["id"]] = [
+            start + timedelta(days=n) for n in range((today_date - start).days)
+        ]
     
-    if total_health_loss > 0:
-        new_health = max(0, user["health"] - total_health_loss)
-        health_reduced = True
-        
-        # Check for game over
-        game_over = new_health == 0
-        
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {
-                "health": new_health,
-                "last_check_date": today_str,
-                "game_over": game_over
-            }}
-        )
-        
-        return {
-            "health_reduced": health_reduced,
-            "new_health": new_health,
-            "game_over": game_over,
-            "weekly_loss": weekly_health_loss
-        }
+    all_days = [d for days in pending_days.values() for d in days]
+    range_start = min(all_days, default=today_date)
+    weeks = sorted({tuple(d.isocalendar()[:2]) for d in all_days})
+    household_ids = sorted({user["household_id"] for user in users})
+    
+    # One range query for every task of the households and weeks involved,
+    # one for their rules...
+    tasks = await store.tasks.in_weeks(household_ids, weeks)
+    for rule in await store.rules.active(household_ids):
+        for year, week in weeks:
+            tasks.extend(expand_rule(rule, year, week))
+    weekly_task_ids = [t["id"] for t in tasks if t.get("is_weekly", False)]
     
-    # Update last check date
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"last_check_date": today_str}}
+    # ...and one for the completions that can settle them
+    completions = await store.completions.for_users(
+        household_ids, list(pending_days), range_start.strftime("%Y-%m-%d"), today_str, weekly_task_ids
     )
     
+    completed_dates = {}
+    completed_task_ids = {}
+    for ct in completions:
+        completed_dates.setdefault(ct["user_id"], set()).add(ct["completed_date"])
+        completed_task_ids.setdefault(ct["user_id"], set()).add(ct["task_id"])
+    
+    daily_schedule = {}
+    weekly_schedule = {}
+    for task in tasks:
+        week_key = (task["household_id"], task["year"], task["week_number"])
+        if task.get("is_weekly", False):
+            weekly_schedule.setdefault(week_key, []).append(task)
+        else:
+            daily_schedule.setdefault(week_key + (task.get("day_of_week"),), []).append(task)
+    
+    checks = []
+    health_days = []  # (user_id, date, {"health_lost": n}) for the daily rollups
+    for user in users:
+        uid = user["id"]
+        household_id = user["household_id"]
+        health = user["health"]
+        health_loss = 0
+        weekly_loss = 0
+        for day in pending_days[uid]:
+            if health == 0:
+                break
+            year, week_number, _ = day.isocalendar()
+            day_loss = 0
+            
+            day_name = get_turkish_day_name(day.weekday())
+            day_tasks = daily_schedule.get((household_id, year, week_number, day_name), [])
+            if any(is_assigned(t, uid) for t in day_tasks) and \
+                    day.strftime("%Y-%m-%d") not in completed_dates.get(uid, ()):
+                day_loss += 1
+            
+            # Sunday closes the week - settle its weekly tasks
+            if day.weekday() == 6:
+                missed = [
+                    t for t in weekly_schedule.get((household_id, year, week_number), [])
+                    if is_assigned(t, uid) and t["id"] not in completed_task_ids.get(uid, ())
+                ]
+                weekly_loss += len(missed)
+                day_loss += len(missed)
+            
+            day_loss = min(day_loss, health)
+            health -= day_loss
+            health_loss += day_loss
+            if day_loss > 0:
+                health_days.append((household_id, uid, day.strftime("%Y-%m-%d"), {"health_lost": day_loss}))
+        
+        checks.append({
+            "id": uid,
+            "last_check_date": user.get("last_check_date"),
+            "health_loss": health_loss,
+            "weekly_loss": weekly_loss
+        })
+    
+    updated = await store.users.apply_health_checks(today_str, checks)
+    # $set rather than $inc: a concurrent run computes the same ledger
+    await store.rollups.set_many(health_days)
+    for user in users:
+        user_cache.invalidate(user["id"])
+    await bump_versions([user_version_key(user["id"]) for user in users])
+    await event_broker.publish_many([{"type": "user", "user_id": user["id"]} for user in users])
+    return updated
+
+
+async def acquire_lease(name: str, seconds: int) -> bool:
+    """Take (or renew) a named lease so only one worker runs a job at a time"""
+    return await store.leases.acquire(name, WORKER_ID, seconds)
+
+
+async def release_lease(name: str):
+    await store.leases.release(name, WORKER_ID)
+
+
+def seconds_until_turkey_midnight() -> float:
+    """Seconds until the next 00:00 in Turkey (plus a second of slack)"""
+    now = get_turkey_now()
+    tomorrow = (now + timedelta(days=1)).date()
+    midnight = TURKEY_TZ.localize(datetime(tomorrow.year, tomorrow.month, tomorrow.day))
+    return (midnight - now).total_seconds() + 1
+
+
+async def nightly_scheduler():
+    """Run the nightly jobs at startup (to catch up) and at every Turkey midnight"""
+    while True:
+        for name, job, lease_seconds in (
+            ("health_decay", run_health_decay, HEALTH_DECAY_LEASE_SECONDS),
+            ("archival", run_archival, ARCHIVAL_LEASE_SECONDS)
+        ):
+            try:
+                if await acquire_lease(name, lease_seconds):
+                    try:
+                        result = await job(get_turkey_now())
+                        logger.info(f"Nightly job {name} done: {result}")
+                    finally:
+                        await release_lease(name)
+            except Exception:
+                logger.exception(f"Nightly job {name} failed")
+        await asyncio.sleep(seconds_until_turkey_midnight())
+
+
+# Archival job - past weeks move from the hot collections to tasks_archive and
+# completions_archive, rolled up into weekly_summaries on the way
+ARCHIVE_AFTER_WEEKS = int(os.environ.get('ARCHIVE_AFTER_WEEKS', '16'))
+ARCHIVAL_LEASE_SECONDS = 600
+SUMMARY_FIELDS = ("points", "strength", "agility", "charisma", "endurance", "level")
+
+
+def summarize_weeks(completions: List[dict]) -> List[dict]:
+    """Roll archived completions up into per-user per-ISO-week summaries"""
+    summaries = {}
+    for completion in completions:
+        year, week_number, _ = date.fromisoformat(completion["completed_date"]).isocalendar()
+        household_id = completion.get("household_id", DEFAULT_HOUSEHOLD)
+        summary = summaries.setdefault((household_id, completion["user_id"], year, week_number), dict(
+            {"household_id": household_id, "user_id": completion["user_id"], "year": year,
+             "week_number": week_number, "completed": 0, "daily_completed": 0, "weekly_completed": 0},
+            **{field: 0 for field in SUMMARY_FIELDS}
+        ))
+        summary["completed"] += 1
+        summary["weekly_completed" if completion.get("is_weekly", False) else "daily_completed"] += 1
+        for field, amount in completion_increments(completion).items():
+            summary[field] += amount
+    return list(summaries.values())
+
+
+def completion_tasks(completions: List[dict]) -> set:
+    """The (household_id, task_id) pairs the completions refer to"""
+    return {(c.get("household_id", DEFAULT_HOUSEHOLD), c["task_id"]) for c in completions}
+
+
+async def find_archived_task_details(tasks: set) -> dict:
+    """Points and stats of the given (household_id, task_id) tasks, from the hot
+    tasks, rules or the archive - by task id
+    """
+    stored = sorted({task_id for _, task_id in tasks if "@" not in task_id})
+    hot = {task["id"]: task for task in await store.tasks.find_many(stored)} if stored else {}
+    details = {}
+    for household_id, task_id in tasks:
+        if "@" in task_id:
+            task = await rule_sets.get(household_id).find(task_id)
+        else:
+            task = hot.get(task_id)
+            if task is not None and task.get("household_id", DEFAULT_HOUSEHOLD) != household_id:
+                task = None
+        if task is not None:
+            details[task_id] = task
+    missing = sorted({task_id for _, task_id in tasks if task_id not in details})
+    if missing:
+        details.update({task["id"]: task for task in await store.archive.find_tasks(missing)})
     return {
-        "health_reduced": False,
-        "new_health": new_health,
+        task_id: {
+            "title": task.get("title"),
+            "is_weekly": task.get("is_weekly", False),
+            "day_of_week": task.get("day_of_week"),
+            **{field: task.get(field, 0) for field in SUMMARY_FIELDS if field != "level"}
+        }
+        for task_id, task in details.items()
+    }
+
+
+async def run_archival(today: datetime) -> dict:
+    """Archive completions and tasks older than ARCHIVE_AFTER_WEEKS ISO weeks
+    
+    Completions go one week at a time: copied with their task's points and
+    stats, summarized from the archive copy, then deleted - so a run that was
+    interrupted anywhere can simply be repeated.
+    """
+    # Health decay still reads the last MAX_CATCH_UP_DAYS of tasks and completions
+    weeks = max(ARCHIVE_AFTER_WEEKS, MAX_CATCH_UP_DAYS // 7 + 2)
+    cutoff = today.date() - timedelta(weeks=weeks)
+    cutoff -= timedelta(days=cutoff.weekday())
+    cutoff_str = cutoff.strftime("%Y-%m-%d")
+    archived = {"completions": 0, "summaries": 0, "tasks": 0}
+    
+    oldest = await store.completions.oldest_date()
+    while oldest is not None and oldest < cutoff_str:
+        week_start = date.fromisoformat(oldest)
+        week_start -= timedelta(days=week_start.weekday())
+        date_from = week_start.strftime("%Y-%m-%d")
+        date_to = (week_start + timedelta(days=7)).strftime("%Y-%m-%d")
+        
+        completions = await store.completions.between(date_from, date_to)
+        details = await find_archived_task_details(completion_tasks(completions))
+        await store.archive.save_completions([
+            dict(details.get(c["task_id"], {"points": 0}), **c) for c in completions
+        ])
+        summaries = summarize_weeks(await store.archive.completions_between(date_from, date_to))
+        await store.archive.save_summaries(summaries)
+        await store.completions.delete_between(date_from, date_to)
+        
+        archived["completions"] += len(completions)
+        archived["summaries"] += len(summaries)
+        oldest = await store.completions.oldest_date()
+    
+    # Old weeks' tasks, and soft-deleted tasks as soon as their week is over
+    year, week_number, _ = today.isocalendar()
+    tasks = await store.tasks.archivable(tuple(cutoff.isocalendar()[:2]), (year, week_number))
+    await store.archive.save_tasks(tasks)
+    await store.tasks.delete_many([task["id"] for task in tasks])
+    archived["tasks"] = len(tasks)
+    return archived
+
+
+# Schema migrations - ordered, idempotent steps recorded in the `migrations`
+# collection's schema_version document. A cold start with nothing pending is a
+# single read; otherwise one worker applies the steps under a lease while the
+# others wait for it
+DEFAULT_USERS = [
+    {
+        "id": "user_bellatrix",
+        "household_id": DEFAULT_HOUSEHOLD,
+        "name": "Bellatrix",
+        "health": 13,
+        "level": 2,
+        "points": 0,
+        "strength": 10,
+        "agility": 10,
+        "charisma": 10,
+        "endurance": 10,
+        "is_admin": False,
+        "game_over": False,
+        "last_check_date": None
+    },
+    {
+        "id": "user_agamemnon",
+        "household_id": DEFAULT_HOUSEHOLD,
+        "name": "Agamemnon",
+        "health": 14,
+        "level": 2,
+        "points": 0,
+        "strength": 10,
+        "agility": 10,
+        "charisma": 10,
+        "endurance": 10,
+        "is_admin": True,
         "game_over": False,
-        "weekly_loss": 0
+        "last_check_date": None
     }
+]
+
+
+def default_rewards() -> List[dict]:
+    rewards = []
+    for i in range(1, 51):
+        if i % 5 == 0:
+            rewards.append({
+                "level": i,
+                "title": "Büyük Ödül",
+                "description": f"Seviye {i} Büyük Başarı! 🏆",
+                "is_big": True
+            })
+        else:
+            rewards.append({
+                "level": i,
+                "title": "Seviye Atlama Ödülü",
+                "description": f"Seviye {i}'e ulaştın! 🎉",
+                "is_big": False
+            })
+    return rewards
+
+
+async def migrate_indexes():
+    await store.ensure_indexes()
+
+
+async def migrate_seed_users():
+    if await store.users.count() == 0:
+        await store.users.insert_many(DEFAULT_USERS)
+        logger.info("Initial users created with stats")
+
+
+async def migrate_seed_rewards():
+    if await store.rewards.count() == 0:
+        await store.rewards.insert_many(DEFAULT_HOUSEHOLD, default_rewards())
+        logger.info("Level rewards created")
+
+
+async def migrate_backfill_stats():
+    await store.users.backfill_stats()
+
+
+async def migrate_task_ids():
+    """Replace legacy timestamp task ids, which could collide, with opaque ones
+    
+    The new id is derived from the old one, so a rerun after a crash renames
+    the leftovers to the same ids the completions already point at.
+    """
+    tasks = await store.tasks.legacy_ids()
+    renames = {task["id"]: "task_" + hashlib.sha1(task["id"].encode()).hexdigest()[:32] for task in tasks}
+    # Completions first: a crash leaves legacy tasks whose completions may already be renamed
+    await store.completions.rename_tasks(renames)
+    for old_task_id, new_task_id in renames.items():
+        await store.tasks.rename(old_task_id, new_task_id)
+    await bump_versions(sorted({
+        week_version_key(t.get("household_id", DEFAULT_HOUSEHOLD), t["year"], t["week_number"]) for t in tasks
+    }))
+    if tasks:
+        logger.info(f"Renamed {len(tasks)} legacy task ids")
+
+
+async def migrate_backfill_rollups():
+    """Build the completion side of the daily rollups from the hot completions
+    
+    Days before today only, so live $incs are never overwritten. Older days
+    are already archived and only have weekly summaries.
+    """
+    today_str = get_turkey_now().strftime("%Y-%m-%d")
+    oldest = await store.completions.oldest_date()
+    week_start = date.fromisoformat(oldest) if oldest else None
+    while week_start is not None and week_start.strftime("%Y-%m-%d") < today_str:
+        date_from = week_start.strftime("%Y-%m-%d")
+        date_to = min((week_start + timedelta(days=7)).strftime("%Y-%m-%d"), today_str)
+        completions = await store.completions.between(date_from, date_to)
+        details = await find_archived_task_details(completion_tasks(completions))
+        
+        daily = {}
+        for completion in completions:
+            household_id = completion.get("household_id", DEFAULT_HOUSEHOLD)
+            fields = daily.setdefault((household_id, completion["user_id"], completion["completed_date"]), dict(
+                {"completed": 0}, **{field: 0 for field in SUMMARY_FIELDS}
+            ))
+            fields["completed"] += 1
+            task = details.get(completion["task_id"], {"points": 0})
+            for field, amount in completion_increments(task).items():
+                fields[field] += amount
+        await store.rollups.set_many([key + (fields,) for key, fields in daily.items()])
+        week_start += timedelta(days=7)
+
+
+async def migrate_households():
+    """Move existing data into the default household and switch to household-leading indexes"""
+    await store.backfill_household(DEFAULT_HOUSEHOLD)
+    await store.drop_indexes(RETIRED_INDEXES)
+    await store.ensure_indexes()
+
+
+async def migrate_replace_indexes():
+    """Create the declared indexes before dropping the retired ones they replace"""
+    await store.ensure_indexes()
+    await store.drop_indexes(RETIRED_INDEXES)
+
+
+async def migrate_user_households():
+    """Move rollups, summaries and idempotency keys into their user's household"""
+    await store.backfill_user_household()
+    await migrate_replace_indexes()
+
+
+MIGRATIONS = [
+    (1, "create_indexes", migrate_indexes),
+    (2, "seed_users", migrate_seed_users),
+    (3, "seed_rewards", migrate_seed_rewards),
+    (4, "backfill_stats", migrate_backfill_stats),
+    (5, "normalize_task_ids", migrate_task_ids),
+    (6, "idempotency_key_indexes", migrate_indexes),
+    (7, "archive_indexes", migrate_indexes),
+    (8, "daily_rollup_indexes", migrate_indexes),
+    (9, "backfill_daily_rollups", migrate_backfill_rollups),
+    (10, "household_tenancy", migrate_households),
+    (11, "task_sort_indexes", migrate_replace_indexes),
+    (12, "user_household_indexes", migrate_user_households),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LEASE_SECONDS = 600
+
+
+async def run_migrations() -> int:
+    """Apply pending migrations; return how many this worker applied"""
+    if await store.migrations.version() >= SCHEMA_VERSION:
+        return 0
+    
+    # Another worker may be migrating - wait for its lease or its result
+    while not await store.leases.acquire("migrations", WORKER_ID, MIGRATION_LEASE_SECONDS):
+        await asyncio.sleep(1)
+        if await store.migrations.version() >= SCHEMA_VERSION:
+            return 0
+    
+    applied = 0
+    try:
+        version = await store.migrations.version()
+        for number, name, step in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"Applying migration {number} {name}")
+            await store.leases.acquire("migrations", WORKER_ID, MIGRATION_LEASE_SECONDS)
+            await step()
+            await store.migrations.record(number, name)
+            applied += 1
+    finally:
+        await store.leases.release("migrations", WORKER_ID)
+    return applied
 
 
 def get_turkish_day_name(weekday: int) -> str:
@@ -596,13 +2354,23 @@ def get_turkish_day_name(weekday: int) -> str:
 # Include the router in the main app
 app.include_router(api_router)
 
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor(request: Request, exc: InvalidCursor):
+    return JSONResponse({"detail": "Geçersiz sayfa imleci"}, status_code=400)
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "X-Profile-Id"],
 )
+if PROFILING:
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -614,79 +2382,38 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_db():
-    """Initialize database with default data"""
-    # Check if users exist
-    user_count = await db.users.count_documents({})
-    
-    if user_count == 0:
-        # Create initial users with stats
-        users = [
-            {
-                "id": "user_bellatrix",
-                "name": "Bellatrix",
-                "health": 13,
-                "level": 2,
-                "points": 0,
-                "strength": 10,
-                "agility": 10,
-                "charisma": 10,
-                "endurance": 10,
-                "is_admin": False,
-                "game_over": False,
-                "last_check_date": None
-            },
-            {
-                "id": "user_agamemnon",
-                "name": "Agamemnon",
-                "health": 14,
-                "level": 2,
-                "points": 0,
-                "strength": 10,
-                "agility": 10,
-                "charisma": 10,
-                "endurance": 10,
-                "is_admin": True,
-                "game_over": False,
-                "last_check_date": None
-            }
-        ]
-        await db.users.insert_many(users)
-        logger.info("Initial users created with stats")
-        
-        # Create level rewards
-        rewards = []
-        for i in range(1, 51):
-            if i % 5 == 0:
-                rewards.append({
-                    "level": i,
-                    "title": "Büyük Ödül",
-                    "description": f"Seviye {i} Büyük Başarı! 🏆",
-                    "is_big": True
-                })
-            else:
-                rewards.append({
-                    "level": i,
-                    "title": "Seviye Atlama Ödülü",
-                    "description": f"Seviye {i}'e ulaştın! 🎉",
-                    "is_big": False
-                })
-        
-        await db.level_rewards.insert_many(rewards)
-        logger.info("Level rewards created")
-    else:
-        # Update existing users with stats if they don't have them
-        await db.users.update_many(
-            {"strength": {"$exists": False}},
-            {"$set": {
-                "strength": 10,
-                "agility": 10,
-                "charisma": 10,
-                "endurance": 10
-            }}
-        )
-        logger.info("Updated existing users with stats")
+    """Bring the schema up to date and start the background tasks
+    
+    The reward and rule snapshots load per household on first use.
+    """
+    await run_migrations()
+    
+    global nightly_task, event_listener_task
+    if os.environ.get('HEALTH_DECAY_SCHEDULER', '1') == '1':
+        nightly_task = asyncio.create_task(nightly_scheduler())
+    event_listener_task = asyncio.create_task(event_broker.listen())
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in (nightly_task, event_listener_task):
+        if task is not None:
+            task.cancel()
+    if client is not None:
+        client.close()
+
+
+if __name__ == "__main__":
+    # python server.py check-indexes | migrate
+    if sys.argv[1:] == ["migrate"]:
+        applied = asyncio.run(run_migrations())
+        print(f"Applied {applied} migrations, schema version {SCHEMA_VERSION}")
+        sys.exit(0)
+    if sys.argv[1:] != ["check-indexes"]:
+        print("usage: python server.py check-indexes | migrate")
+        sys.exit(2)
+    index_report = asyncio.run(store.check_indexes())
+    for kind, entries in index_report.items():
+        for entry in entries:
+            print(f"{kind}: {entry}")
+    sys.exit(1 if index_report["missing"] or index_report["drift"] else 0)
@@ -0,0 +1,1686 @@
+"""Storage - repositories over users, tasks, completions and rewards (plus the
+small bookkeeping collections)
+
+MongoStore is the production backend; MemoryStore keeps everything in dicts
+and sets and needs no database, for tests and benchmarks. Handlers in
+server.py only talk to its module-level `store`.
+"""
+import base64
+import json
+import logging
+import re
+import time
+from datetime import date, datetime, timezone, timedelta
+from typing import Callable, List, Optional
+
+from pymongo import ASCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+# Index definitions - one entry per query shape used by the handlers.
+# They are created by a migration: a new index needs a new migration step.
+# Users, tasks, rules, completions and rewards belong to a household, and
+# their compound indexes lead with household_id so a household's queries
+# only ever touch its own slice of the index
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("household_id", ASCENDING), ("name", ASCENDING)], name="household_name_unique", unique=True
+        ),
+        IndexModel([("household_id", ASCENDING), ("id", ASCENDING)], name="household_users"),
+    ],
+    "tasks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # The equality fields of the week pages, then TASK_SORT, so no page sorts
+        # in memory: today and weekly pages use the first, whole-week pages the second
+        IndexModel(
+            [
+                ("household_id", ASCENDING),
+                ("year", ASCENDING),
+                ("week_number", ASCENDING),
+                ("is_weekly", ASCENDING),
+                ("day_of_week", ASCENDING),
+                ("is_active", ASCENDING),
+                ("created_at", ASCENDING),
+                ("id", ASCENDING),
+            ],
+            name="household_week_schedule_created",
+        ),
+        IndexModel(
+            [
+                ("household_id", ASCENDING),
+                ("year", ASCENDING),
+                ("week_number", ASCENDING),
+                ("is_active", ASCENDING),
+                ("created_at", ASCENDING),
+                ("id", ASCENDING),
+            ],
+            name="household_week_created",
+        ),
+        IndexModel(
+            [("household_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="household_created",
+        ),
+    ],
+    "task_rules": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("household_id", ASCENDING), ("is_active", ASCENDING)], name="household_active"),
+    ],
+    "completed_tasks": [
+        IndexModel(
+            [
+                ("household_id", ASCENDING),
+                ("user_id", ASCENDING),
+                ("task_id", ASCENDING),
+                ("completed_date", ASCENDING),
+            ],
+            name="household_user_task_date_unique",
+            unique=True,
+        ),
+        IndexModel([("completed_date", ASCENDING)], name="completed_date"),
+    ],
+    "level_rewards": [
+        IndexModel(
+            [("household_id", ASCENDING), ("level", ASCENDING)], name="household_level_unique", unique=True
+        ),
+    ],
+    "events": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+    "tasks_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "completions_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("completed_date", ASCENDING)], name="completed_date"),
+    ],
+    "weekly_summaries": [
+        IndexModel(
+            [
+                ("household_id", ASCENDING),
+                ("user_id", ASCENDING),
+                ("year", ASCENDING),
+                ("week_number", ASCENDING),
+            ],
+            name="household_user_week_unique",
+            unique=True,
+        ),
+    ],
+    "daily_rollups": [
+        IndexModel(
+            [("household_id", ASCENDING), ("user_id", ASCENDING), ("date", ASCENDING)],
+            name="household_user_date_unique",
+            unique=True,
+        ),
+    ],
+    "idempotency_keys": [
+        IndexModel(
+            [("household_id", ASCENDING), ("user_id", ASCENDING), ("key", ASCENDING)],
+            name="household_user_key_unique",
+            unique=True,
+        ),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+
+# Indexes replaced by the ones above, dropped by the migrations that replace them
+RETIRED_INDEXES = [
+    "users.name_unique",
+    "tasks.week_schedule",
+    "completed_tasks.user_task_date_unique",
+    "level_rewards.level_unique",
+    "tasks.household_week_schedule",
+    "weekly_summaries.user_week_unique",
+    "daily_rollups.user_date_unique",
+    "idempotency_keys.user_key_unique",
+]
+TENANT_COLLECTIONS = (
+    "users", "tasks", "task_rules", "completed_tasks", "level_rewards",
+    "tasks_archive", "completions_archive"
+)
+# Per-user collections, which take their household from the user
+USER_TENANT_COLLECTIONS = ("weekly_summaries", "daily_rollups", "idempotency_keys")
+
+
+def _index_signature(spec: dict) -> tuple:
+    """Reduce an index spec to the parts that matter for drift detection"""
+    return (tuple((k, int(v)) for k, v in spec["key"].items()), bool(spec.get("unique", False)))
+
+
+LEGACY_TASK_ID = re.compile(r"^task_\d+\.\d+$")
+# Completions rewritten per bulk write when legacy task ids are renamed
+RENAME_BATCH_SIZE = 1000
+# Data from before households existed belongs to this one
+DEFAULT_HOUSEHOLD = "default"
+
+
+def assigned_to_user_filter(user_id: str) -> dict:
+    return {"$or": [
+        {"assigned_to": user_id},
+        {"assigned_to": None},
+        {"assigned_to": {"$exists": False}}
+    ]}
+
+
+def weeks_before(year: int, week_number: int) -> dict:
+    """Filter for documents of ISO weeks strictly before the given one"""
+    return {"$or": [
+        {"year": {"$lt": year}},
+        {"year": year, "week_number": {"$lt": week_number}}
+    ]}
+
+
+def clone_suffix(year: int, week_number: int) -> str:
+    """Suffix of a cloned task id: one clone per original task and target week"""
+    return f"{year}W{week_number:02d}"
+
+
+def once_filter(completion: dict) -> dict:
+    """Match any completion of the same user and task, whatever its date"""
+    return {
+        "household_id": completion["household_id"],
+        "user_id": completion["user_id"],
+        "task_id": completion["task_id"]
+    }
+
+
+async def insert_new(collection, docs: List[dict]):
+    """insert_many that skips documents whose unique key is already taken"""
+    if not docs:
+        return
+    try:
+        await collection.insert_many([dict(doc) for doc in docs], ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+# Pagination - keyset cursors over a fixed sort order
+TASK_SORT = ("created_at", "id")
+USER_SORT = ("id",)
+
+
+def encode_cursor(doc: dict, keys: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([doc.get(k) for k in keys]).encode()).decode()
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not produced by encode_cursor for these keys"""
+
+
+def decode_cursor(cursor: str, keys: tuple) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def cursor_filter(cursor: str, keys: tuple) -> dict:
+    """Build the filter selecting documents strictly after the cursor position"""
+    values = decode_cursor(cursor, keys)
+    clauses = []
+    for n, key in enumerate(keys):
+        clause = dict(zip(keys[:n], values[:n]))
+        clause[key] = {"$gt": values[n]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def find_page(
+    collection,
+    query: dict,
+    keys: tuple,
+    limit: int,
+    after: Optional[str],
+    extra: List[dict] = ()
+):
+    """Return one page of documents and the cursor for the next one (or None)
+    
+    `extra` documents (e.g. tasks expanded from rules) are merged into the
+    same sort order as if they were stored in the collection.
+    """
+    if after:
+        query = {"$and": [query, cursor_filter(after, keys)]}
+    docs = await collection.find(query, {"_id": 0}).sort(
+        [(k, ASCENDING) for k in keys]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    if extra:
+        def position(doc):
+            return tuple(doc.get(k) for k in keys)
+        if after:
+            start = tuple(decode_cursor(after, keys))
+            extra = [doc for doc in extra if position(doc) > start]
+        docs = sorted(docs + list(extra), key=position)[:limit + 1]
+    
+    next_cursor = encode_cursor(docs[limit - 1], keys) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def memory_page(
+    docs,
+    keys: tuple,
+    limit: int,
+    after: Optional[str],
+    extra: List[dict] = ()
+):
+    """find_page over documents already in memory"""
+    def position(doc):
+        return tuple(doc.get(k) for k in keys)
+    
+    docs = list(docs) + list(extra)
+    if after:
+        start = tuple(decode_cursor(after, keys))
+        docs = [doc for doc in docs if position(doc) > start]
+    docs = [dict(doc) for doc in sorted(docs, key=position)[:limit + 1]]
+    
+    next_cursor = encode_cursor(docs[limit - 1], keys) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def find_stream(collection, query: dict, keys: tuple, after: Optional[str]):
+    """Cursor over every matching document after `after`, in sort order"""
+    if after:
+        query = {"$and": [query, cursor_filter(after, keys)]}
+    return collection.find(query, {"_id": 0}).sort(
+        [(k, ASCENDING) for k in keys]
+    ).batch_size(500)
+
+
+def is_assigned(task: dict, user_id: str) -> bool:
+    """True if the task is assigned to the user or to everyone"""
+    return task.get("assigned_to") in (None, user_id)
+
+
+class MongoUsers:
+    def __init__(self, database):
+        self.collection = database.users
+    
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": user_id}, {"_id": 0})
+    
+    async def get_by_name(self, household_id: str, name: str) -> Optional[dict]:
+        return await self.collection.find_one({"household_id": household_id, "name": name}, {"_id": 0})
+    
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+    
+    async def insert_many(self, users: List[dict]):
+        await self.collection.insert_many([dict(user) for user in users])
+    
+    async def backfill_stats(self):
+        """Give users created before stats existed the starting values"""
+        await self.collection.update_many(
+            {"strength": {"$exists": False}},
+            {"$set": {
+                "strength": 10,
+                "agility": 10,
+                "charisma": 10,
+                "endurance": 10
+            }}
+        )
+    
+    async def page(self, household_id: str, limit: int, after: Optional[str]):
+        return await find_page(self.collection, {"household_id": household_id}, USER_SORT, limit, after)
+    
+    def stream(self, household_id: str, after: Optional[str]):
+        return find_stream(self.collection, {"household_id": household_id}, USER_SORT, after)
+    
+    async def increment(self, user_id: str, increments: dict) -> Optional[dict]:
+        """Atomically add to numeric fields and return the updated user"""
+        return await self.collection.find_one_and_update(
+            {"id": user_id},
+            {"$inc": increments},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def set_health(self, user_id: str, health: int, game_over: bool) -> Optional[int]:
+        """Set health and game over; return the previous health, or None if there is no such user"""
+        before = await self.collection.find_one_and_update(
+            {"id": user_id},
+            {"$set": {"health": health, "game_over": game_over}},
+            projection={"_id": 0, "health": 1}
+        )
+        return before.get("health", 0) if before is not None else None
+    
+    async def claim_health_report(self, user_id: str, today_str: str) -> Optional[dict]:
+        """Mark today's health check as shown to the user; None if it already was"""
+        return await self.collection.find_one_and_update(
+            {"id": user_id, "health_reported_date": {"$ne": today_str}},
+            {"$set": {"health_reported_date": today_str}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def pending_health_checks(self, today_str: str, user_id: Optional[str] = None) -> List[dict]:
+        """Users still in the game whose health has not been checked today"""
+        query = {"game_over": {"$ne": True}, "last_check_date": {"$ne": today_str}}
+        if user_id is not None:
+            query["id"] = user_id
+        return await self.collection.find(
+            query, {"_id": 0, "id": 1, "household_id": 1, "health": 1, "last_check_date": 1}
+        ).to_list(None)
+    
+    async def apply_health_checks(self, today_str: str, checks: List[dict]) -> int:
+        """Apply health losses in one bulk write
+        
+        Each check re-matches the last_check_date it was computed from, so a
+        concurrent run can never apply the same loss twice.
+        """
+        operations = []
+        for check in checks:
+            guard = {"id": check["id"], "game_over": {"$ne": True}, "last_check_date": check["last_check_date"]}
+            if check["health_loss"] > 0:
+                operations.append(UpdateOne(guard, [
+                    {"$set": {
+                        "health": {"$max": [0, {"$subtract": ["$health", check["health_loss"]]}]},
+                        "last_check_date": today_str,
+                        "last_health_loss": check["health_loss"],
+                        "last_weekly_loss": check["weekly_loss"]
+                    }},
+                    {"$set": {"game_over": {"$eq": ["$health", 0]}}}
+                ]))
+            else:
+                operations.append(UpdateOne(guard, {"$set": {
+                    "last_check_date": today_str,
+                    "last_health_loss": 0,
+                    "last_weekly_loss": 0
+                }}))
+        if not operations:
+            return 0
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.modified_count
+
+
+class MongoTasks:
+    def __init__(self, database):
+        self.collection = database.tasks
+    
+    def _query(self, household_id: str, year=None, week_number=None, is_weekly=None,
+               day_of_week=None, user_id=None) -> dict:
+        query = {"household_id": household_id, "is_active": True}
+        if year is not None:
+            query.update({"year": year, "week_number": week_number})
+        if is_weekly is not None:
+            query["is_weekly"] = is_weekly
+        if is_weekly:
+            # Weekly tasks are stored without a day - saying so keeps the sort on the index
+            query["day_of_week"] = None
+        if day_of_week is not None:
+            query["day_of_week"] = day_of_week
+        if user_id is not None:
+            query.update(assigned_to_user_filter(user_id))
+        return query
+    
+    async def get(self, task_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": task_id}, {"_id": 0})
+    
+    async def find_many(self, task_ids: List[str]) -> List[dict]:
+        return await self.collection.find({"id": {"$in": task_ids}}, {"_id": 0}).to_list(None)
+    
+    async def page(self, household_id: str, limit: int, after: Optional[str],
+                   extra: List[dict] = (), **filters):
+        """One page of a household's active tasks matching year/week_number, is_weekly, day_of_week, user_id"""
+        return await find_page(
+            self.collection, self._query(household_id, **filters), TASK_SORT, limit, after, extra
+        )
+    
+    def stream(self, household_id: str, after: Optional[str], **filters):
+        return find_stream(self.collection, self._query(household_id, **filters), TASK_SORT, after)
+    
+    async def insert(self, task: dict):
+        await self.collection.insert_one(dict(task))
+    
+    async def insert_many(self, tasks: List[dict]) -> dict:
+        """Insert tasks unordered; return {index: error message} for the ones that failed"""
+        try:
+            await self.collection.insert_many([dict(task) for task in tasks], ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error.get("errmsg", "") for error in e.details.get("writeErrors", [])}
+        return {}
+    
+    async def deactivate(self, household_id: str, task_id: str) -> Optional[dict]:
+        """Soft-delete a household's task; return its year/week_number, or None if it has no such task"""
+        return await self.collection.find_one_and_update(
+            {"household_id": household_id, "id": task_id},
+            {"$set": {"is_active": False}},
+            projection={"_id": 0, "year": 1, "week_number": 1}
+        )
+    
+    async def in_weeks(self, household_ids: List[str], weeks: List[tuple]) -> List[dict]:
+        """Every active task of the given households and (year, week_number) weeks, in one query"""
+        if not household_ids or not weeks:
+            return []
+        return await self.collection.find({
+            "household_id": {"$in": household_ids},
+            "is_active": True,
+            "$or": [{"year": year, "week_number": week} for year, week in weeks]
+        }, {"_id": 0, "id": 1, "household_id": 1, "is_weekly": 1, "day_of_week": 1,
+            "assigned_to": 1, "week_number": 1, "year": 1}).to_list(None)
+    
+    async def clone_week(self, household_id: str, source: tuple, target: tuple, created_at: str,
+                         is_weekly: Optional[bool] = None, assigned_to: Optional[str] = None) -> dict:
+        """Copy a household's active tasks of the source week into the target week
+        
+        Runs as one $merge into this collection, so no task leaves the
+        server. Return {"matched", "inserted"}, where inserted counts only
+        this clone's ids - other writes to the target week never skew it.
+        """
+        query = self._query(household_id, *source, is_weekly=is_weekly)
+        if assigned_to is not None:
+            query["assigned_to"] = assigned_to
+        sources = await self.collection.find(query, {"_id": 0, "id": 1, "cloned_from": 1}).to_list(None)
+        clones = {"id": {"$in": [
+            f"{task.get('cloned_from') or task['id']}_{clone_suffix(*target)}" for task in sources
+        ]}}
+        before = await self.collection.count_documents(clones)
+        
+        origin = {"$ifNull": ["$cloned_from", "$id"]}
+        await self.collection.aggregate([
+            {"$match": query},
+            {"$set": {
+                "id": {"$concat": [origin, "_", clone_suffix(*target)]},
+                "cloned_from": origin,
+                "year": target[0],
+                "week_number": target[1],
+                "created_at": {"$literal": created_at}
+            }},
+            {"$project": {"_id": 0}},
+            {"$merge": {
+                "into": self.collection.name,
+                "on": "id",
+                "whenMatched": "keepExisting",
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(None)
+        
+        after = await self.collection.count_documents(clones)
+        return {"matched": len(sources), "inserted": after - before}
+    
+    async def legacy_ids(self) -> List[dict]:
+        """Tasks still carrying a timestamp id ("task_<seconds>.<micros>")"""
+        return await self.collection.find(
+            {"id": {"$regex": LEGACY_TASK_ID.pattern}},
+            {"_id": 0, "id": 1, "household_id": 1, "year": 1, "week_number": 1}
+        ).to_list(None)
+    
+    async def rename(self, old_id: str, new_id: str):
+        await self.collection.update_one({"id": old_id}, {"$set": {"id": new_id}})
+    
+    async def archivable(self, before: tuple, inactive_before: tuple) -> List[dict]:
+        """Tasks of weeks before `before`, and soft-deleted ones before `inactive_before`"""
+        return await self.collection.find({"$or": [
+            weeks_before(*before),
+            {"is_active": False, "$and": [weeks_before(*inactive_before)]}
+        ]}, {"_id": 0}).to_list(None)
+    
+    async def delete_many(self, task_ids: List[str]):
+        if task_ids:
+            await self.collection.delete_many({"id": {"$in": task_ids}})
+
+
+class MongoCompletions:
+    def __init__(self, database):
+        self.collection = database.completed_tasks
+    
+    async def insert(self, completion: dict):
+        """Record a completion; DuplicateKeyError if (user, task, date) exists"""
+        await self.collection.insert_one(dict(completion))
+    
+    async def insert_many(self, completions: List[dict]) -> int:
+        """Insert completions unordered, skipping duplicates; return how many were new"""
+        try:
+            result = await self.collection.insert_many([dict(c) for c in completions], ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            return e.details.get("nInserted", 0)
+    
+    async def record_many(self, completions: List[dict], once: List[bool]) -> List[bool]:
+        """Record completions in one unordered bulk write; return which ones were new
+        
+        `once[i]` applies the weekly rule (at most one completion per task ever)
+        instead of the daily one (one per task and date).
+        """
+        operations = [
+            UpdateOne(
+                once_filter(completion),
+                {"$setOnInsert": completion},
+                upsert=True
+            ) if weekly else InsertOne(dict(completion))
+            for completion, weekly in zip(completions, once)
+        ]
+        if not operations:
+            return []
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            failed = set()
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            upserted = {entry["index"] for entry in e.details.get("upserted", [])}
+        return [
+            (n in upserted) if weekly else (n not in failed)
+            for n, weekly in enumerate(once)
+        ]
+    
+    async def insert_once(self, completion: dict) -> bool:
+        """Record a completion unless the user ever completed the task"""
+        result = await self.collection.update_one(
+            once_filter(completion),
+            {"$setOnInsert": completion},
+            upsert=True
+        )
+        return result.upserted_id is not None
+    
+    async def delete(self, completion: dict):
+        # By the unique key: there is no index on the derived id
+        await self.collection.delete_one({
+            "household_id": completion["household_id"],
+            "user_id": completion["user_id"],
+            "task_id": completion["task_id"],
+            "completed_date": completion["completed_date"]
+        })
+    
+    async def task_ids(self, household_id: str, user_id: str, completed_date: Optional[str] = None,
+                       task_ids: Optional[List[str]] = None) -> set:
+        """Ids of the tasks a user completed (on a date and/or among given tasks)"""
+        query = {"household_id": household_id, "user_id": user_id}
+        if completed_date is not None:
+            query["completed_date"] = completed_date
+        if task_ids is not None:
+            query["task_id"] = {"$in": task_ids}
+        return set(await self.collection.distinct("task_id", query))
+    
+    async def for_users(self, household_ids: List[str], user_ids: List[str], date_from: str,
+                        date_to: str, task_ids: List[str]) -> List[dict]:
+        """Completions of the users in [date_from, date_to) or of any of the given tasks"""
+        return await self.collection.find({
+            "household_id": {"$in": household_ids},
+            "user_id": {"$in": user_ids},
+            "$or": [
+                {"completed_date": {"$gte": date_from, "$lt": date_to}},
+                {"task_id": {"$in": task_ids}}
+            ]
+        }, {"_id": 0, "user_id": 1, "task_id": 1, "completed_date": 1}).to_list(None)
+    
+    async def oldest_date(self) -> Optional[str]:
+        docs = await self.collection.find({}, {"_id": 0, "completed_date": 1}).sort(
+            "completed_date", ASCENDING
+        ).limit(1).to_list(1)
+        return docs[0]["completed_date"] if docs else None
+    
+    async def between(self, date_from: str, date_to: str) -> List[dict]:
+        """Every completion in [date_from, date_to)"""
+        return await self.collection.find(
+            {"completed_date": {"$gte": date_from, "$lt": date_to}}, {"_id": 0}
+        ).to_list(None)
+    
+    async def delete_between(self, date_from: str, date_to: str):
+        await self.collection.delete_many({"completed_date": {"$gte": date_from, "$lt": date_to}})
+    
+    async def rename_tasks(self, renames: dict):
+        """Point completions of renamed tasks (old id -> new id) at their new ids
+        
+        task_id leads no index, so the completions are found in a single pass
+        and rewritten by _id in bulk.
+        """
+        if not renames:
+            return
+        operations = []
+        async for completion in self.collection.find(
+            {"task_id": {"$in": list(renames)}}, {"_id": 1, "user_id": 1, "task_id": 1, "completed_date": 1}
+        ).batch_size(RENAME_BATCH_SIZE):
+            new_id = renames[completion["task_id"]]
+            operations.append(UpdateOne({"_id": completion["_id"]}, {"$set": {
+                "task_id": new_id,
+                "id": f"{completion['user_id']}_{new_id}_{completion['completed_date']}"
+            }}))
+            if len(operations) == RENAME_BATCH_SIZE:
+                await self.collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+
+class MongoRewards:
+    def __init__(self, database):
+        self.collection = database.level_rewards
+    
+    async def all(self, household_id: str) -> List[dict]:
+        return await self.collection.find(
+            {"household_id": household_id}, {"_id": 0, "household_id": 0}
+        ).sort("level", 1).to_list(None)
+    
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+    
+    async def insert_many(self, household_id: str, rewards: List[dict]):
+        await self.collection.insert_many([dict(reward, household_id=household_id) for reward in rewards])
+    
+    async def seed(self, household_id: str, rewards: List[dict]):
+        """Insert the rewards whose level is still free, so concurrent seeding is harmless"""
+        await insert_new(self.collection, [dict(reward, household_id=household_id) for reward in rewards])
+    
+    async def upsert(self, household_id: str, reward: dict):
+        await self.collection.update_one(
+            {"household_id": household_id, "level": reward["level"]},
+            {"$set": dict(reward, household_id=household_id)},
+            upsert=True
+        )
+    
+    async def delete(self, household_id: str, level: int):
+        await self.collection.delete_one({"household_id": household_id, "level": level})
+
+
+class MongoRules:
+    def __init__(self, database):
+        self.collection = database.task_rules
+    
+    async def active(self, household_ids: List[str]) -> List[dict]:
+        """Active rules of the given households"""
+        return await self.collection.find(
+            {"household_id": {"$in": household_ids}, "is_active": True}, {"_id": 0}
+        ).to_list(None)
+    
+    async def insert(self, rule: dict):
+        await self.collection.insert_one(dict(rule))
+    
+    async def deactivate(self, household_id: str, rule_id: str):
+        await self.collection.update_one(
+            {"household_id": household_id, "id": rule_id}, {"$set": {"is_active": False}}
+        )
+
+
+class MongoVersions:
+    def __init__(self, database):
+        self.collection = database.versions
+    
+    async def get(self, keys: List[str]) -> dict:
+        docs = await self.collection.find({"_id": {"$in": keys}}).to_list(None)
+        return {doc["_id"]: doc.get("version", 0) for doc in docs}
+    
+    async def bump(self, keys: List[str]):
+        if not keys:
+            return
+        await self.collection.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in keys
+        ], ordered=False)
+
+
+class MongoLeases:
+    def __init__(self, database):
+        self.collection = database.leases
+    
+    async def acquire(self, name: str, owner: str, seconds: int) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return False
+    
+    async def release(self, name: str, owner: str):
+        await self.collection.update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"expires_at": datetime.now(timezone.utc)}}
+        )
+
+
+class MongoEvents:
+    # Events inserted here reach every worker through watch()
+    change_streams = True
+    
+    def __init__(self, database):
+        self.collection = database.events
+    
+    async def insert_many(self, events: List[dict]):
+        now = datetime.now(timezone.utc)
+        await self.collection.insert_many([dict(event, created_at=now) for event in events])
+    
+    async def watch(self):
+        """Yield None once the change stream is open, then every inserted event"""
+        async with self.collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            yield None
+            async for change in stream:
+                event = change["fullDocument"]
+                event.pop("_id", None)
+                event.pop("created_at", None)
+                yield event
+
+
+class MongoArchive:
+    def __init__(self, database):
+        self.tasks = database.tasks_archive
+        self.completions = database.completions_archive
+        self.summaries = database.weekly_summaries
+    
+    async def save_tasks(self, tasks: List[dict]):
+        await insert_new(self.tasks, tasks)
+    
+    async def find_tasks(self, task_ids: List[str]) -> List[dict]:
+        return await self.tasks.find({"id": {"$in": task_ids}}, {"_id": 0}).to_list(None)
+    
+    async def save_completions(self, completions: List[dict]):
+        await insert_new(self.completions, completions)
+    
+    async def completions_between(self, date_from: str, date_to: str) -> List[dict]:
+        return await self.completions.find(
+            {"completed_date": {"$gte": date_from, "$lt": date_to}}, {"_id": 0}
+        ).to_list(None)
+    
+    async def save_summaries(self, summaries: List[dict]):
+        """Replace the summaries of the same user and week"""
+        if not summaries:
+            return
+        await self.summaries.bulk_write([
+            UpdateOne(
+                {
+                    "household_id": s["household_id"], "user_id": s["user_id"],
+                    "year": s["year"], "week_number": s["week_number"]
+                },
+                {"$set": s},
+                upsert=True
+            ) for s in summaries
+        ], ordered=False)
+    
+    async def user_summaries(self, household_id: str, user_id: str) -> List[dict]:
+        return await self.summaries.find({"household_id": household_id, "user_id": user_id}, {"_id": 0}).sort(
+            [("year", ASCENDING), ("week_number", ASCENDING)]
+        ).to_list(None)
+
+
+class MongoRollups:
+    def __init__(self, database):
+        self.collection = database.daily_rollups
+    
+    async def _write(self, operator: str, entries: List[tuple]):
+        if not entries:
+            return
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"household_id": household_id, "user_id": user_id, "date": day}, {operator: fields}, upsert=True
+            )
+            for household_id, user_id, day, fields in entries
+        ], ordered=False)
+    
+    async def add_many(self, entries: List[tuple]):
+        """$inc the (household_id, user_id, date, fields) entries into their daily rollups"""
+        await self._write("$inc", entries)
+    
+    async def set_many(self, entries: List[tuple]):
+        """$set the (household_id, user_id, date, fields) entries - for values recomputed as a whole"""
+        await self._write("$set", entries)
+    
+    async def between(self, household_id: str, user_id: str, date_from: str, date_to: str) -> List[dict]:
+        """A user's rollups for the days in [date_from, date_to]"""
+        return await self.collection.find(
+            {"household_id": household_id, "user_id": user_id, "date": {"$gte": date_from, "$lte": date_to}},
+            {"_id": 0}
+        ).sort("date", ASCENDING).to_list(None)
+
+
+class MongoIdempotency:
+    def __init__(self, database):
+        self.collection = database.idempotency_keys
+    
+    async def _insert_claims(self, household_id: str, user_id: str, keys: List[str], claim: str) -> List[str]:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_many([
+                {
+                    "household_id": household_id, "user_id": user_id, "key": key,
+                    "claim": claim, "result": None, "created_at": now
+                }
+                for key in keys
+            ], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            return [keys[error["index"]] for error in errors]
+        return []
+    
+    async def claim_many(self, household_id: str, user_id: str, keys: List[str], claim: str,
+                         stale_after: float) -> List[str]:
+        """Claim keys for one request; return the keys another request holds
+        
+        A claim still pending after stale_after seconds belongs to a request
+        that died, and is taken over.
+        """
+        if not keys:
+            return []
+        taken = await self._insert_claims(household_id, user_id, keys, claim)
+        if taken:
+            deleted = await self.collection.delete_many({
+                "household_id": household_id, "user_id": user_id, "key": {"$in": taken}, "result": None,
+                "created_at": {"$lt": datetime.now(timezone.utc) - timedelta(seconds=stale_after)}
+            })
+            if deleted.deleted_count:
+                taken = await self._insert_claims(household_id, user_id, taken, claim)
+        return taken
+    
+    async def get_many(self, household_id: str, user_id: str, keys: List[str]) -> dict:
+        """{key: result} for claimed keys - None while the claiming request is still running"""
+        docs = await self.collection.find(
+            {"household_id": household_id, "user_id": user_id, "key": {"$in": keys}},
+            {"_id": 0, "key": 1, "result": 1}
+        ).to_list(None)
+        return {doc["key"]: doc["result"] for doc in docs}
+    
+    async def complete_many(self, household_id: str, user_id: str, claim: str, results: dict):
+        """Store the results of keys this claim holds"""
+        if results:
+            await self.collection.bulk_write([
+                UpdateOne(
+                    {"household_id": household_id, "user_id": user_id, "key": key, "claim": claim},
+                    {"$set": {"result": result}}
+                )
+                for key, result in results.items()
+            ], ordered=False)
+    
+    async def release_many(self, household_id: str, user_id: str, claim: str, keys: List[str]):
+        """Drop this claim's pending keys, so a retry can claim them again"""
+        if keys:
+            await self.collection.delete_many({
+                "household_id": household_id, "user_id": user_id, "key": {"$in": keys},
+                "claim": claim, "result": None
+            })
+
+
+class MongoMigrations:
+    def __init__(self, database):
+        self.collection = database.migrations
+    
+    async def version(self) -> int:
+        doc = await self.collection.find_one({"_id": "schema_version"}, {"version": 1})
+        return doc["version"] if doc else 0
+    
+    async def record(self, version: int, name: str):
+        await self.collection.update_one(
+            {"_id": "schema_version"},
+            {
+                "$max": {"version": version},
+                "$push": {"applied": {"version": version, "name": name, "at": datetime.now(timezone.utc)}}
+            },
+            upsert=True
+        )
+
+
+def dashboard_pipeline(household_id: str, user_id: str, year: int, week_number: int,
+                       day_name: str, today_str: str, rule_task_ids: List[str]) -> List[dict]:
+    """Aggregation over `users` behind MongoStore.dashboard"""
+    return [
+        {"$match": {"id": user_id, "household_id": household_id}},
+        {"$project": {"_id": 0}},
+        # Completions of rule-generated tasks, which do not live in `tasks`
+        {"$lookup": {
+            "from": "completed_tasks",
+            "pipeline": [
+                {"$match": {
+                    "household_id": household_id,
+                    "user_id": user_id,
+                    "task_id": {"$in": rule_task_ids}
+                }},
+                {"$project": {"_id": 0, "task_id": 1, "completed_date": 1}}
+            ],
+            "as": "rule_completions"
+        }},
+        {"$lookup": {
+            "from": "tasks",
+            "pipeline": [
+                {"$match": {
+                    "household_id": household_id,
+                    "year": year,
+                    "week_number": week_number,
+                    "is_active": True,
+                    "$and": [
+                        {"$or": [
+                            {"is_weekly": True},
+                            {"is_weekly": False, "day_of_week": day_name}
+                        ]},
+                        assigned_to_user_filter(user_id)
+                    ]
+                }},
+                # Daily tasks count as done when completed today, weekly tasks when ever completed
+                {"$lookup": {
+                    "from": "completed_tasks",
+                    "let": {"task_id": "$id", "is_weekly": "$is_weekly"},
+                    "pipeline": [
+                        {"$match": {
+                            "household_id": household_id,
+                            "user_id": user_id,
+                            "$expr": {"$and": [
+                                {"$eq": ["$task_id", "$$task_id"]},
+                                {"$or": [
+                                    "$$is_weekly",
+                                    {"$eq": ["$completed_date", today_str]}
+                                ]}
+                            ]}
+                        }},
+                        {"$limit": 1}
+                    ],
+                    "as": "completions"
+                }},
+                {"$addFields": {"is_completed": {"$gt": [{"$size": "$completions"}, 0]}}},
+                {"$project": {"_id": 0, "completions": 0}},
+                {"$facet": {
+                    "daily": [{"$match": {"is_weekly": False}}],
+                    "weekly": [{"$match": {"is_weekly": True}}]
+                }}
+            ],
+            "as": "schedule"
+        }}
+    ]
+
+
+class MongoStore:
+    def __init__(self, database):
+        self.db = database
+        self.users = MongoUsers(database)
+        self.tasks = MongoTasks(database)
+        self.completions = MongoCompletions(database)
+        self.rewards = MongoRewards(database)
+        self.rules = MongoRules(database)
+        self.versions = MongoVersions(database)
+        self.leases = MongoLeases(database)
+        self.events = MongoEvents(database)
+        self.migrations = MongoMigrations(database)
+        self.idempotency = MongoIdempotency(database)
+        self.archive = MongoArchive(database)
+        self.rollups = MongoRollups(database)
+    
+    async def check_indexes(self) -> dict:
+        """Compare the declared indexes with the ones present in the database"""
+        report = {"missing": [], "drift": [], "extra": []}
+        for collection, models in INDEXES.items():
+            existing = await self.db[collection].index_information()
+            declared = {m.document["name"]: m.document for m in models}
+            
+            for name, spec in declared.items():
+                if name not in existing:
+                    report["missing"].append(f"{collection}.{name}")
+                    continue
+                current = dict(existing[name])
+                current["key"] = dict(current["key"])
+                if _index_signature(current) != _index_signature(spec):
+                    report["drift"].append(f"{collection}.{name}")
+            
+            for name in existing:
+                if name != "_id_" and name not in declared:
+                    report["extra"].append(f"{collection}.{name}")
+        return report
+    
+    async def ensure_indexes(self) -> dict:
+        """Create missing indexes idempotently and log any drift"""
+        report = await self.check_indexes()
+        for entry in report["missing"]:
+            collection, name = entry.split(".", 1)
+            model = next(m for m in INDEXES[collection] if m.document["name"] == name)
+            try:
+                await self.db[collection].create_indexes([model])
+                logger.info(f"Created index {entry}")
+            except OperationFailure as e:
+                # e.g. duplicate data blocking a unique index - keep serving
+                logger.error(f"Could not create index {entry}: {e}")
+        for entry in report["drift"]:
+            logger.warning(f"Index {entry} differs from its declaration, leaving it untouched")
+        for entry in report["extra"]:
+            logger.info(f"Undeclared index {entry}")
+        return report
+    
+    async def drop_indexes(self, entries: List[str]):
+        """Drop "collection.name" indexes that exist"""
+        for entry in entries:
+            collection, name = entry.split(".", 1)
+            if name in await self.db[collection].index_information():
+                await self.db[collection].drop_index(name)
+                logger.info(f"Dropped index {entry}")
+    
+    async def backfill_household(self, household_id: str):
+        """Put documents from before households existed into the given one"""
+        for collection in TENANT_COLLECTIONS:
+            await self.db[collection].update_many(
+                {"household_id": {"$exists": False}}, {"$set": {"household_id": household_id}}
+            )
+    
+    async def backfill_user_household(self):
+        """Put per-user documents without a household into their user's one"""
+        for collection in USER_TENANT_COLLECTIONS:
+            user_ids = await self.db[collection].distinct("user_id", {"household_id": {"$exists": False}})
+            if not user_ids:
+                continue
+            members = {}
+            users = self.db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "household_id": 1})
+            async for user in users:
+                members.setdefault(user.get("household_id", DEFAULT_HOUSEHOLD), []).append(user["id"])
+            for household_id, member_ids in members.items():
+                await self.db[collection].update_many(
+                    {"user_id": {"$in": member_ids}, "household_id": {"$exists": False}},
+                    {"$set": {"household_id": household_id}}
+                )
+    
+    async def dashboard(self, household_id: str, user_id: str, year: int, week_number: int,
+                        day_name: str, today_str: str, rule_task_ids: List[str]) -> Optional[dict]:
+        """The user, this week's daily (today) and weekly tasks with completion
+        flags, and the completions of the given rule tasks - in one aggregation
+        """
+        pipeline = dashboard_pipeline(
+            household_id, user_id, year, week_number, day_name, today_str, rule_task_ids
+        )
+        result = await self.db.users.aggregate(pipeline).to_list(1)
+        if not result:
+            return None
+        
+        user = result[0]
+        schedule = user.pop("schedule")[0]
+        return {
+            "user": user,
+            "daily": schedule["daily"],
+            "weekly": schedule["weekly"],
+            "rule_completions": user.pop("rule_completions")
+        }
+
+
+class MemoryUsers:
+    def __init__(self):
+        self.by_id = {}
+        self.id_by_name = {}  # (household_id, name) -> user_id
+        self.ids_by_household = {}
+    
+    async def get(self, user_id: str) -> Optional[dict]:
+        user = self.by_id.get(user_id)
+        return dict(user) if user is not None else None
+    
+    async def get_by_name(self, household_id: str, name: str) -> Optional[dict]:
+        return await self.get(self.id_by_name.get((household_id, name)))
+    
+    async def count(self) -> int:
+        return len(self.by_id)
+    
+    async def insert_many(self, users: List[dict]):
+        for user in users:
+            if user["id"] in self.by_id or (user["household_id"], user["name"]) in self.id_by_name:
+                raise DuplicateKeyError("duplicate user")
+        for user in users:
+            self.by_id[user["id"]] = dict(user)
+            self.id_by_name[(user["household_id"], user["name"])] = user["id"]
+            self.ids_by_household.setdefault(user["household_id"], set()).add(user["id"])
+    
+    async def backfill_stats(self):
+        for user in self.by_id.values():
+            if "strength" not in user:
+                user.update({"strength": 10, "agility": 10, "charisma": 10, "endurance": 10})
+    
+    def _members(self, household_id: str) -> List[dict]:
+        return [self.by_id[i] for i in self.ids_by_household.get(household_id, ())]
+    
+    async def page(self, household_id: str, limit: int, after: Optional[str]):
+        return memory_page(self._members(household_id), USER_SORT, limit, after)
+    
+    async def stream(self, household_id: str, after: Optional[str]):
+        members = self._members(household_id)
+        docs, _ = memory_page(members, USER_SORT, len(members) or 1, after)
+        for doc in docs:
+            yield doc
+    
+    async def increment(self, user_id: str, increments: dict) -> Optional[dict]:
+        user = self.by_id.get(user_id)
+        if user is None:
+            return None
+        for key, amount in increments.items():
+            user[key] = user.get(key, 0) + amount
+        return dict(user)
+    
+    async def set_health(self, user_id: str, health: int, game_over: bool) -> Optional[int]:
+        user = self.by_id.get(user_id)
+        if user is None:
+            return None
+        previous = user.get("health", 0)
+        user.update({"health": health, "game_over": game_over})
+        return previous
+    
+    async def claim_health_report(self, user_id: str, today_str: str) -> Optional[dict]:
+        user = self.by_id.get(user_id)
+        if user is None or user.get("health_reported_date") == today_str:
+            return None
+        user["health_reported_date"] = today_str
+        return dict(user)
+    
+    async def pending_health_checks(self, today_str: str, user_id: Optional[str] = None) -> List[dict]:
+        users = self.by_id.values() if user_id is None else filter(None, [self.by_id.get(user_id)])
+        return [
+            {"id": u["id"], "household_id": u["household_id"], "health": u["health"],
+             "last_check_date": u.get("last_check_date")}
+            for u in users
+            if not u.get("game_over", False) and u.get("last_check_date") != today_str
+        ]
+    
+    async def apply_health_checks(self, today_str: str, checks: List[dict]) -> int:
+        modified = 0
+        for check in checks:
+            user = self.by_id.get(check["id"])
+            if user is None or user.get("game_over", False) or \
+                    user.get("last_check_date") != check["last_check_date"]:
+                continue
+            if check["health_loss"] > 0:
+                user["health"] = max(0, user["health"] - check["health_loss"])
+                user["game_over"] = user["health"] == 0
+            user.update({
+                "last_check_date": today_str,
+                "last_health_loss": check["health_loss"],
+                "last_weekly_loss": check["weekly_loss"] if check["health_loss"] > 0 else 0
+            })
+            modified += 1
+        return modified
+
+
+class MemoryTasks:
+    def __init__(self):
+        self.by_id = {}
+        self.ids_by_week = {}  # (household_id, year, week_number) -> {task_id}
+        self.ids_by_household = {}
+    
+    def _matching(self, household_id: str, year=None, week_number=None, is_weekly=None,
+                  day_of_week=None, user_id=None):
+        if year is not None:
+            ids = self.ids_by_week.get((household_id, year, week_number), ())
+        else:
+            ids = self.ids_by_household.get(household_id, ())
+        candidates = (self.by_id[i] for i in ids)
+        return [
+            dict(task) for task in candidates
+            if task.get("is_active", True)
+            and (is_weekly is None or task.get("is_weekly", False) == is_weekly)
+            and (day_of_week is None or task.get("day_of_week") == day_of_week)
+            and (user_id is None or is_assigned(task, user_id))
+        ]
+    
+    async def get(self, task_id: str) -> Optional[dict]:
+        task = self.by_id.get(task_id)
+        return dict(task) if task is not None else None
+    
+    async def find_many(self, task_ids: List[str]) -> List[dict]:
+        return [dict(self.by_id[i]) for i in task_ids if i in self.by_id]
+    
+    async def page(self, household_id: str, limit: int, after: Optional[str],
+                   extra: List[dict] = (), **filters):
+        return memory_page(self._matching(household_id, **filters), TASK_SORT, limit, after, extra)
+    
+    async def stream(self, household_id: str, after: Optional[str], **filters):
+        docs = self._matching(household_id, **filters)
+        docs, _ = memory_page(docs, TASK_SORT, len(docs) or 1, after)
+        for doc in docs:
+            yield doc
+    
+    async def insert(self, task: dict):
+        if task["id"] in self.by_id:
+            raise DuplicateKeyError("duplicate task id")
+        self.by_id[task["id"]] = dict(task)
+        self._index(task).add(task["id"])
+        self.ids_by_household.setdefault(task["household_id"], set()).add(task["id"])
+    
+    def _index(self, task: dict) -> set:
+        return self.ids_by_week.setdefault((task["household_id"], task["year"], task["week_number"]), set())
+    
+    async def insert_many(self, tasks: List[dict]) -> dict:
+        errors = {}
+        for index, task in enumerate(tasks):
+            try:
+                await self.insert(task)
+            except DuplicateKeyError as e:
+                errors[index] = str(e)
+        return errors
+    
+    async def deactivate(self, household_id: str, task_id: str) -> Optional[dict]:
+        task = self.by_id.get(task_id)
+        if task is None or task["household_id"] != household_id:
+            return None
+        task["is_active"] = False
+        return {"year": task["year"], "week_number": task["week_number"]}
+    
+    async def in_weeks(self, household_ids: List[str], weeks: List[tuple]) -> List[dict]:
+        return [
+            task for household_id in household_ids for year, week in weeks
+            for task in self._matching(household_id, year=year, week_number=week)
+        ]
+    
+    async def clone_week(self, household_id: str, source: tuple, target: tuple, created_at: str,
+                         is_weekly: Optional[bool] = None, assigned_to: Optional[str] = None) -> dict:
+        tasks = [
+            task for task in self._matching(household_id, *source, is_weekly=is_weekly)
+            if assigned_to is None or task.get("assigned_to") == assigned_to
+        ]
+        inserted = 0
+        for task in tasks:
+            origin = task.get("cloned_from", task["id"])
+            clone_id = f"{origin}_{clone_suffix(*target)}"
+            if clone_id not in self.by_id:
+                await self.insert(dict(
+                    task, id=clone_id, cloned_from=origin, year=target[0], week_number=target[1],
+                    created_at=created_at
+                ))
+                inserted += 1
+        return {"matched": len(tasks), "inserted": inserted}
+    
+    async def legacy_ids(self) -> List[dict]:
+        return [
+            {key: task[key] for key in ("id", "household_id", "year", "week_number")}
+            for task in self.by_id.values() if LEGACY_TASK_ID.match(task["id"])
+        ]
+    
+    async def rename(self, old_id: str, new_id: str):
+        task = self.by_id.pop(old_id, None)
+        if task is not None:
+            task["id"] = new_id
+            self.by_id[new_id] = task
+            for ids in (self._index(task), self.ids_by_household[task["household_id"]]):
+                ids.discard(old_id)
+                ids.add(new_id)
+    
+    async def archivable(self, before: tuple, inactive_before: tuple) -> List[dict]:
+        return [
+            dict(task) for task in self.by_id.values()
+            if (task["year"], task["week_number"]) < before
+            or (not task.get("is_active", True) and (task["year"], task["week_number"]) < inactive_before)
+        ]
+    
+    async def delete_many(self, task_ids: List[str]):
+        for task_id in task_ids:
+            task = self.by_id.pop(task_id, None)
+            if task is not None:
+                self._index(task).discard(task_id)
+                self.ids_by_household[task["household_id"]].discard(task_id)
+
+
+class MemoryCompletions:
+    # A user belongs to one household, so keys by user are already per household
+    def __init__(self):
+        self.by_key = {}  # (user_id, task_id, completed_date) -> completion
+        self.dates_by_user_task = {}  # (user_id, task_id) -> {completed_date}
+        self.tasks_by_user_date = {}  # (user_id, completed_date) -> {task_id}
+        self.keys_by_user = {}
+    
+    async def insert(self, completion: dict):
+        key = (completion["user_id"], completion["task_id"], completion["completed_date"])
+        if key in self.by_key:
+            raise DuplicateKeyError("duplicate completion")
+        user_id, task_id, day = key
+        self.by_key[key] = dict(completion)
+        self.dates_by_user_task.setdefault((user_id, task_id), set()).add(day)
+        self.tasks_by_user_date.setdefault((user_id, day), set()).add(task_id)
+        self.keys_by_user.setdefault(user_id, set()).add(key)
+    
+    async def insert_many(self, completions: List[dict]) -> int:
+        inserted = 0
+        for completion in completions:
+            try:
+                await self.insert(completion)
+                inserted += 1
+            except DuplicateKeyError:
+                pass
+        return inserted
+    
+    async def record_many(self, completions: List[dict], once: List[bool]) -> List[bool]:
+        recorded = []
+        for completion, weekly in zip(completions, once):
+            if weekly:
+                recorded.append(await self.insert_once(completion))
+                continue
+            try:
+                await self.insert(completion)
+                recorded.append(True)
+            except DuplicateKeyError:
+                recorded.append(False)
+        return recorded
+    
+    async def insert_once(self, completion: dict) -> bool:
+        if self.dates_by_user_task.get((completion["user_id"], completion["task_id"])):
+            return False
+        await self.insert(completion)
+        return True
+    
+    async def delete(self, completion: dict):
+        key = (completion["user_id"], completion["task_id"], completion["completed_date"])
+        if self.by_key.pop(key, None) is not None:
+            user_id, task_id, day = key
+            self.dates_by_user_task[(user_id, task_id)].discard(day)
+            self.tasks_by_user_date[(user_id, day)].discard(task_id)
+            self.keys_by_user[user_id].discard(key)
+    
+    async def task_ids(self, household_id: str, user_id: str, completed_date: Optional[str] = None,
+                       task_ids: Optional[List[str]] = None) -> set:
+        if task_ids is not None:
+            return {
+                task_id for task_id in task_ids
+                if (completed_date is None and self.dates_by_user_task.get((user_id, task_id)))
+                or completed_date in self.dates_by_user_task.get((user_id, task_id), ())
+            }
+        if completed_date is not None:
+            return set(self.tasks_by_user_date.get((user_id, completed_date), ()))
+        return {task_id for _, task_id, _ in self.keys_by_user.get(user_id, ())}
+    
+    async def for_users(self, household_ids: List[str], user_ids: List[str], date_from: str,
+                        date_to: str, task_ids: List[str]) -> List[dict]:
+        wanted = set(task_ids)
+        return [
+            {"user_id": user_id, "task_id": task_id, "completed_date": day}
+            for user_id in user_ids
+            for _, task_id, day in self.keys_by_user.get(user_id, ())
+            if date_from <= day < date_to or task_id in wanted
+        ]
+    
+    async def oldest_date(self) -> Optional[str]:
+        return min((day for _, _, day in self.by_key), default=None)
+    
+    async def between(self, date_from: str, date_to: str) -> List[dict]:
+        return [dict(c) for key, c in self.by_key.items() if date_from <= key[2] < date_to]
+    
+    async def delete_between(self, date_from: str, date_to: str):
+        for completion in await self.between(date_from, date_to):
+            await self.delete(completion)
+    
+    async def rename_tasks(self, renames: dict):
+        renamed = [completion for key, completion in self.by_key.items() if key[1] in renames]
+        for completion in renamed:
+            new_id = renames[completion["task_id"]]
+            await self.delete(completion)
+            await self.insert(dict(
+                completion,
+                task_id=new_id,
+                id=f"{completion['user_id']}_{new_id}_{completion['completed_date']}"
+            ))
+
+
+class MemoryRewards:
+    def __init__(self):
+        self.by_household = {}  # household_id -> {level: reward}
+    
+    async def all(self, household_id: str) -> List[dict]:
+        by_level = self.by_household.get(household_id, {})
+        return [dict(by_level[level]) for level in sorted(by_level)]
+    
+    async def count(self) -> int:
+        return sum(len(by_level) for by_level in self.by_household.values())
+    
+    async def insert_many(self, household_id: str, rewards: List[dict]):
+        for reward in rewards:
+            await self.upsert(household_id, reward)
+    
+    async def seed(self, household_id: str, rewards: List[dict]):
+        by_level = self.by_household.setdefault(household_id, {})
+        for reward in rewards:
+            by_level.setdefault(reward["level"], dict(reward))
+    
+    async def upsert(self, household_id: str, reward: dict):
+        self.by_household.setdefault(household_id, {})[reward["level"]] = dict(reward)
+    
+    async def delete(self, household_id: str, level: int):
+        self.by_household.get(household_id, {}).pop(level, None)
+
+
+class MemoryRules:
+    def __init__(self):
+        self.by_household = {}  # household_id -> {rule_id: rule}
+    
+    async def active(self, household_ids: List[str]) -> List[dict]:
+        return [
+            dict(rule) for household_id in household_ids
+            for rule in self.by_household.get(household_id, {}).values()
+            if rule.get("is_active", True)
+        ]
+    
+    async def insert(self, rule: dict):
+        self.by_household.setdefault(rule["household_id"], {})[rule["id"]] = dict(rule)
+    
+    async def deactivate(self, household_id: str, rule_id: str):
+        rule = self.by_household.get(household_id, {}).get(rule_id)
+        if rule is not None:
+            rule["is_active"] = False
+
+
+class MemoryVersions:
+    def __init__(self):
+        self.by_key = {}
+    
+    async def get(self, keys: List[str]) -> dict:
+        return {key: self.by_key[key] for key in keys if key in self.by_key}
+    
+    async def bump(self, keys: List[str]):
+        for key in keys:
+            self.by_key[key] = self.by_key.get(key, 0) + 1
+
+
+class MemoryLeases:
+    def __init__(self):
+        self.by_name = {}
+    
+    async def acquire(self, name: str, owner: str, seconds: int) -> bool:
+        now = time.monotonic()
+        holder = self.by_name.get(name)
+        if holder is not None and holder[0] != owner and holder[1] > now:
+            return False
+        self.by_name[name] = (owner, now + seconds)
+        return True
+    
+    async def release(self, name: str, owner: str):
+        if self.by_name.get(name, (None,))[0] == owner:
+            del self.by_name[name]
+
+
+class MemoryEvents:
+    # One process only: the broker delivers events itself and never inserts or watches here
+    change_streams = False
+
+
+class MemoryArchive:
+    def __init__(self):
+        self.tasks = {}
+        self.completions = {}
+        self.summaries = {}  # (household_id, user_id, year, week_number) -> summary
+    
+    async def save_tasks(self, tasks: List[dict]):
+        for task in tasks:
+            self.tasks.setdefault(task["id"], dict(task))
+    
+    async def find_tasks(self, task_ids: List[str]) -> List[dict]:
+        return [dict(self.tasks[i]) for i in task_ids if i in self.tasks]
+    
+    async def save_completions(self, completions: List[dict]):
+        for completion in completions:
+            self.completions.setdefault(completion["id"], dict(completion))
+    
+    async def completions_between(self, date_from: str, date_to: str) -> List[dict]:
+        return [dict(c) for c in self.completions.values() if date_from <= c["completed_date"] < date_to]
+    
+    async def save_summaries(self, summaries: List[dict]):
+        for summary in summaries:
+            key = (summary["household_id"], summary["user_id"], summary["year"], summary["week_number"])
+            self.summaries[key] = dict(summary)
+    
+    async def user_summaries(self, household_id: str, user_id: str) -> List[dict]:
+        return [
+            dict(self.summaries[key]) for key in sorted(self.summaries) if key[:2] == (household_id, user_id)
+        ]
+
+
+class MemoryRollups:
+    def __init__(self):
+        self.by_key = {}  # (household_id, user_id, date) -> rollup
+    
+    def _rollup(self, household_id: str, user_id: str, day: str) -> dict:
+        return self.by_key.setdefault(
+            (household_id, user_id, day), {"household_id": household_id, "user_id": user_id, "date": day}
+        )
+    
+    async def add_many(self, entries: List[tuple]):
+        for household_id, user_id, day, fields in entries:
+            rollup = self._rollup(household_id, user_id, day)
+            for field, amount in fields.items():
+                rollup[field] = rollup.get(field, 0) + amount
+    
+    async def set_many(self, entries: List[tuple]):
+        for household_id, user_id, day, fields in entries:
+            self._rollup(household_id, user_id, day).update(fields)
+    
+    async def between(self, household_id: str, user_id: str, date_from: str, date_to: str) -> List[dict]:
+        start = date.fromisoformat(date_from)
+        days = [start + timedelta(days=n) for n in range((date.fromisoformat(date_to) - start).days + 1)]
+        return [
+            dict(self.by_key[key]) for key in ((household_id, user_id, d.strftime("%Y-%m-%d")) for d in days)
+            if key in self.by_key
+        ]
+
+
+class MemoryIdempotency:
+    def __init__(self):
+        self.by_key = {}  # (household_id, user_id, key) -> {"claim", "result", "created_at"}
+    
+    async def claim_many(self, household_id: str, user_id: str, keys: List[str], claim: str,
+                         stale_after: float) -> List[str]:
+        now = datetime.now(timezone.utc)
+        taken = []
+        for key in keys:
+            doc = self.by_key.get((household_id, user_id, key))
+            if doc is not None and (
+                doc["result"] is not None or now - doc["created_at"] < timedelta(seconds=stale_after)
+            ):
+                taken.append(key)
+                continue
+            self.by_key[(household_id, user_id, key)] = {"claim": claim, "result": None, "created_at": now}
+        return taken
+    
+    async def get_many(self, household_id: str, user_id: str, keys: List[str]) -> dict:
+        return {
+            key: self.by_key[(household_id, user_id, key)]["result"]
+            for key in keys if (household_id, user_id, key) in self.by_key
+        }
+    
+    async def complete_many(self, household_id: str, user_id: str, claim: str, results: dict):
+        for key, result in results.items():
+            doc = self.by_key.get((household_id, user_id, key))
+            if doc is not None and doc["claim"] == claim:
+                doc["result"] = result
+    
+    async def release_many(self, household_id: str, user_id: str, claim: str, keys: List[str]):
+        for key in keys:
+            doc = self.by_key.get((household_id, user_id, key))
+            if doc is not None and doc["claim"] == claim and doc["result"] is None:
+                del self.by_key[(household_id, user_id, key)]
+
+
+class MemoryMigrations:
+    def __init__(self):
+        self.current = 0
+        self.applied = []
+    
+    async def version(self) -> int:
+        return self.current
+    
+    async def record(self, version: int, name: str):
+        self.current = max(self.current, version)
+        self.applied.append({"version": version, "name": name, "at": datetime.now(timezone.utc)})
+
+
+class MemoryStore:
+    def __init__(self):
+        self.users = MemoryUsers()
+        self.tasks = MemoryTasks()
+        self.completions = MemoryCompletions()
+        self.rewards = MemoryRewards()
+        self.rules = MemoryRules()
+        self.versions = MemoryVersions()
+        self.leases = MemoryLeases()
+        self.events = MemoryEvents()
+        self.migrations = MemoryMigrations()
+        self.idempotency = MemoryIdempotency()
+        self.archive = MemoryArchive()
+        self.rollups = MemoryRollups()
+    
+    async def check_indexes(self) -> dict:
+        return {"missing": [], "drift": [], "extra": []}
+    
+    async def ensure_indexes(self) -> dict:
+        return await self.check_indexes()
+    
+    async def drop_indexes(self, entries: List[str]):
+        pass
+    
+    async def backfill_household(self, household_id: str):
+        # Nothing outlives the process, so everything was written with a household
+        pass
+    
+    async def backfill_user_household(self):
+        pass
+    
+    async def dashboard(self, household_id: str, user_id: str, year: int, week_number: int,
+                        day_name: str, today_str: str, rule_task_ids: List[str]) -> Optional[dict]:
+        user = await self.users.get(user_id)
+        if user is None or user["household_id"] != household_id:
+            return None
+        
+        tasks = self.tasks._matching(household_id, year=year, week_number=week_number, user_id=user_id)
+        done_today = await self.completions.task_ids(household_id, user_id, completed_date=today_str)
+        done_ever = await self.completions.task_ids(
+            household_id, user_id, task_ids=[task["id"] for task in tasks if task.get("is_weekly", False)]
+        )
+        daily, weekly = [], []
+        for task in tasks:
+            if task.get("is_weekly", False):
+                task["is_completed"] = task["id"] in done_ever
+                weekly.append(task)
+            elif task.get("day_of_week") == day_name:
+                task["is_completed"] = task["id"] in done_today
+                daily.append(task)
+        
+        rule_completions = [
+            {"task_id": task_id, "completed_date": day}
+            for task_id in rule_task_ids
+            for day in self.completions.dates_by_user_task.get((user_id, task_id), ())
+        ]
+        return {"user": user, "daily": daily, "weekly": weekly, "rule_completions": rule_completions}
+
+
+class CountingStore:
+    """Wrap a store and report every repository call as `record("repository.method")`"""
+    
+    def __init__(self, inner, record: Callable[[str], None]):
+        self._inner = inner
+        self._record = record
+        for name, value in vars(inner).items():
+            setattr(self, name, CountingRepository(name, value, record))
+    
+    def __getattr__(self, name):
+        return counted(name, getattr(self._inner, name), self._record)
+
+
+class CountingRepository:
+    def __init__(self, name: str, inner, record: Callable[[str], None]):
+        self._name = name
+        self._inner = inner
+        self._record = record
+    
+    def __getattr__(self, name):
+        return counted(f"{self._name}.{name}", getattr(self._inner, name), self._record)
+
+
+def counted(name: str, attribute, record: Callable[[str], None]):
+    if not callable(attribute):
+        return attribute
+    
+    def call(*a, **kw):
+        record(name)
+        return attribute(*a, **kw)
+    return call
@@ -67,11 +67,11 @@ function App() {
     }
   };
 
-  const handleTaskComplete = async (reward) => {
+  const handleTaskComplete = (reward) => {
+    // The dashboard reloads the user together with the task lists
     if (reward) {
       setReward(reward);
     }
-    await refreshUser();
   };
 
   if (!user) {
@@ -97,7 +97,7 @@ function App() {
       <Dashboard 
         user={user} 
         onTaskComplete={handleTaskComplete}
-        onRefreshUser={refreshUser}
+        onUserLoaded={setUser}
       />
       
       {user.is_admin && (
@@ -100,21 +100,14 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
         assigned_to: newTask.assigned_to === 'both' ? null : newTask.assigned_to
       };
 
-      // If "add to all days" is checked, create 7 tasks (one for each day)
+      // If "add to all days" is checked, create a rule that repeats every day, every week
       if (newTask.add_to_all_days && !newTask.is_weekly) {
-        let successCount = 0;
-        for (const day of DAYS) {
-          try {
-            await axios.post(`${API}/tasks?user_id=${user.id}`, {
-              ...taskData,
-              day_of_week: day
-            });
-            successCount++;
-          } catch (error) {
-            console.error(`Error adding task for ${day}:`, error);
-          }
-        }
-        toast.success(`${successCount} görev eklendi (tüm günler için)!`);
+        const { add_to_all_days, day_of_week, ...rule } = taskData;
+        await axios.post(`${API}/task-rules?user_id=${user.id}`, {
+          ...rule,
+          days_of_week: DAYS
+        });
+        toast.success('Görev her gün için eklendi!');
       } else {
         // Single task
         await axios.post(`${API}/tasks?user_id=${user.id}`, taskData);
@@ -143,9 +136,17 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
     }
   };
 
-  const handleDelete = async (taskId) => {
+  const handleDelete = async (task) => {
+    // A repeating task is deleted through its rule, which removes every day it generates
+    if (task.rule_id && !window.confirm('Bu görev tekrarlanıyor. Tüm tekrarları silinsin mi?')) {
+      return;
+    }
     try {
-      await axios.post(`${API}/tasks/${taskId}/delete?user_id=${user.id}`);
+      if (task.rule_id) {
+        await axios.post(`${API}/task-rules/${task.rule_id}/delete?user_id=${user.id}`);
+      } else {
+        await axios.post(`${API}/tasks/${task.id}/delete?user_id=${user.id}`);
+      }
       toast.success('Görev silindi');
       await loadTasks();
     } catch (error) {
@@ -369,7 +370,7 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
                         </span>
                       </label>
                       <p className="text-xs text-gray-500 mt-1 ml-7">
-                        Bu görev haftanın 7 gününe de ayrı ayrı eklenecek
+                        Bu görev her hafta, haftanın 7 gününde tekrarlanacak
                       </p>
                     </div>
                   </>
@@ -454,7 +455,7 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
                         </span>
                       </div>
                       <button
-                        onClick={() => handleDelete(task.id)}
+                        onClick={() => handleDelete(task)}
                         className="text-red-400 hover:text-red-300 p-2 hover:bg-red-900/20 rounded transition-all"
                         data-testid={`delete-task-${task.id}`}
                       >
@@ -513,7 +514,7 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
                                         </span>
                                       </div>
                                       <button
-                                        onClick={() => handleDelete(task.id)}
+                                        onClick={() => handleDelete(task)}
                                         className="text-red-400 hover:text-red-300 p-2 hover:bg-red-900/20 rounded transition-all"
                                         data-testid={`delete-task-${task.id}`}
                                       >
@@ -548,7 +549,7 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
                                         </span>
                                       </div>
                                       <button
-                                        onClick={() => handleDelete(task.id)}
+                                        onClick={() => handleDelete(task)}
                                         className="text-red-400 hover:text-red-300 p-2 hover:bg-red-900/20 rounded transition-all"
                                         data-testid={`delete-task-${task.id}`}
                                       >
@@ -583,7 +584,7 @@ const AdminPanel = ({ user, onClose, onTaskCreated }) => {
                                         </span>
                                       </div>
                                       <button
-                                        onClick={() => handleDelete(task.id)}
+                                        onClick={() => handleDelete(task)}
                                         className="text-red-400 hover:text-red-300 p-2 hover:bg-red-900/20 rounded transition-all"
                                         data-testid={`delete-task-${task.id}`}
                                       >
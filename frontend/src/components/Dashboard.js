@@ -5,7 +5,7 @@ import { toast } from 'sonner';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
-const Dashboard = ({ user, onTaskComplete, onRefreshUser }) => {
+const Dashboard = ({ user, onTaskComplete, onUserLoaded }) => {
   const [dailyTasks, setDailyTasks] = useState([]);
   const [weeklyTasks, setWeeklyTasks] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -17,22 +17,29 @@ const Dashboard = ({ user, onTaskComplete, onRefreshUser }) => {
     loadTasks();
   }, [user.id]);
 
+  // Reload when the server pushes a change (admin edits, other devices, health checks)
+  useEffect(() => {
+    const events = new EventSource(`${API}/events?user_id=${user.id}`);
+    const reload = () => loadTasks();
+    ['user', 'tasks', 'resync'].forEach(type => events.addEventListener(type, reload));
+    return () => events.close();
+  }, [user.id]);
+
   const loadTasks = async () => {
     try {
-      // Load daily tasks
-      const dailyResponse = await axios.get(`${API}/tasks/today?user_id=${user.id}`);
-      setDailyTasks(dailyResponse.data.tasks);
-      setCurrentDay(dailyResponse.data.day);
-      
-      // Load weekly tasks
-      const weeklyResponse = await axios.get(`${API}/tasks/weekly?user_id=${user.id}`);
-      setWeeklyTasks(weeklyResponse.data.tasks);
+      // Load user, daily and weekly tasks in a single request
+      const response = await axios.get(`${API}/dashboard?user_id=${user.id}`);
+      const { user: userData, day, daily_tasks, weekly_tasks } = response.data;
+      setDailyTasks(daily_tasks);
+      setCurrentDay(day);
+      setWeeklyTasks(weekly_tasks);
+      onUserLoaded(userData);
       
       // Check if all daily tasks are completed
-      const allDailyCompleted = dailyResponse.data.tasks.every(t => t.is_completed);
-      const hasIncompleteWeekly = weeklyResponse.data.tasks.some(t => !t.is_completed);
+      const allDailyCompleted = daily_tasks.every(t => t.is_completed);
+      const hasIncompleteWeekly = weekly_tasks.some(t => !t.is_completed);
       
-      if (allDailyCompleted && hasIncompleteWeekly && dailyResponse.data.tasks.length > 0) {
+      if (allDailyCompleted && hasIncompleteWeekly && daily_tasks.length > 0) {
         setShowWeeklyReminder(true);
       }
     } catch (error) {
@@ -57,10 +64,7 @@ const Dashboard = ({ user, onTaskComplete, onRefreshUser }) => {
 
   const handleRefresh = async () => {
     setLoading(true);
-    await Promise.all([
-      loadTasks(),
-      onRefreshUser()
-    ]);
+    await loadTasks();
     toast.success('Yenilendi!');
   };
 
@@ -0,0 +1,50 @@
+"""The API on a fresh in-memory store per test - no database, no lifespan tasks"""
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["HEALTH_DECAY_SCHEDULER"] = "0"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+ADMIN = "user_agamemnon"
+USER = "user_bellatrix"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def store():
+    """A migrated MemoryStore holding the default household (Agamemnon is its admin)"""
+    fresh = server.MemoryStore()
+    server.set_store(fresh)
+    await server.run_migrations()
+    return fresh
+
+
+@pytest.fixture
+async def client(store):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def today_name() -> str:
+    return server.get_turkish_day_name(server.get_turkey_now().weekday())
+
+
+async def create_task(client, **fields) -> dict:
+    """Create a task for this week as the admin; a daily task for today unless told otherwise"""
+    payload = {"title": "Bulaşık", "points": 10, "day_of_week": today_name()}
+    payload.update(fields)
+    response = await client.post(f"/api/tasks?user_id={ADMIN}", json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()["task"]
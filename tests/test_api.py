@@ -0,0 +1,306 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import server
+
+from .conftest import ADMIN, USER, create_task, today_name
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_login(client):
+    response = await client.post("/api/login", json={"name": "Bellatrix"})
+    assert response.status_code == 200
+    assert response.json()["user"]["id"] == USER
+    assert response.json()["game_over"] is False
+    
+    response = await client.post("/api/login", json={"name": "Bellatrix", "household_id": "other"})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Kullanıcı bulunamadı"
+
+
+async def test_dashboard(client):
+    daily = await create_task(client, title="Bulaşık")
+    weekly = await create_task(client, title="Çamaşır", is_weekly=True)
+    await create_task(client, title="Başkasının", assigned_to=ADMIN)
+    
+    response = await client.get(f"/api/dashboard?user_id={USER}")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user"]["id"] == USER
+    assert body["day"] == today_name()
+    assert [t["id"] for t in body["daily_tasks"]] == [daily["id"]]
+    assert [t["id"] for t in body["weekly_tasks"]] == [weekly["id"]]
+    assert not body["daily_tasks"][0]["is_completed"]
+
+
+async def test_complete_task(client):
+    task = await create_task(client, points=15, strength=2)
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": task["id"]})
+    assert response.status_code == 200
+    assert response.json()["new_points"] == 15
+    assert response.json()["stats"]["strength"] == 12
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": task["id"]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Bu görev zaten tamamlanmış"
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": "task_missing"})
+    assert response.status_code == 404
+    
+    today = (await client.get(f"/api/tasks/today?user_id={USER}")).json()
+    assert [t["is_completed"] for t in today["tasks"]] == [True]
+
+
+async def test_parallel_completions_keep_exact_totals(client, store):
+    tasks = [await create_task(client, points=1, strength=1) for _ in range(100)]
+    before = await store.users.get(USER)
+    
+    # Every task tapped twice at once: one tap wins, the other is a duplicate
+    responses = await asyncio.gather(*(
+        client.post("/api/tasks/complete", json={"user_id": USER, "task_id": task["id"]})
+        for task in tasks + tasks
+    ))
+    codes = [r.status_code for r in responses]
+    assert codes.count(200) == 100 and codes.count(400) == 100
+    
+    user = await store.users.get(USER)
+    assert user["points"] == before["points"] + 100
+    assert user["strength"] == before["strength"] + 100
+    today = server.get_turkey_now().strftime("%Y-%m-%d")
+    assert len(await store.completions.task_ids(server.DEFAULT_HOUSEHOLD, USER, today)) == 100
+    rollup, = await store.rollups.between(server.DEFAULT_HOUSEHOLD, USER, today, today)
+    assert rollup["completed"] == 100 and rollup["points"] == 100
+
+
+async def test_completion_for_a_vanished_user_changes_nothing(client, store, monkeypatch):
+    task = await create_task(client)
+    queue = server.event_broker.subscribe(USER, server.DEFAULT_HOUSEHOLD)
+    versions = dict(store.versions.by_key)
+    
+    # The user is deleted between the lookup and the increment
+    async def vanished(user_id, increments):
+        return None
+    monkeypatch.setattr(store.users, "increment", vanished)
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": task["id"]})
+    assert response.status_code == 404
+    assert store.versions.by_key == versions
+    assert queue.empty()
+    assert not await store.completions.task_ids(server.DEFAULT_HOUSEHOLD, USER)
+    server.event_broker.unsubscribe(USER, server.DEFAULT_HOUSEHOLD, queue)
+
+async def test_complete_task_in_another_household(client, store):
+    await store.users.insert_many([dict(server.DEFAULT_USERS[0], id="user_other", household_id="other")])
+    task = await create_task(client)
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": "user_other", "task_id": task["id"]})
+    assert response.status_code == 404
+
+
+async def test_bulk_create(client):
+    response = await client.post(f"/api/tasks/bulk?user_id={ADMIN}", json={
+        "tasks": [{"title": "Çöp", "points": 5, "is_weekly": True}],
+        "template": {"title": "Yatak", "points": 3},
+        "days": ["Pazartesi", "Çarşamba", "Cuma"]
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"] and body["created"] == 4
+    assert sorted(r["task"]["day_of_week"] or "" for r in body["results"]) == ["", "Cuma", "Pazartesi", "Çarşamba"]
+    
+    week = (await client.get(f"/api/tasks/week?user_id={ADMIN}")).json()
+    assert len(week["tasks"]) == 4
+    
+    response = await client.post(f"/api/tasks/bulk?user_id={ADMIN}", json={"tasks": []})
+    assert response.status_code == 400
+    response = await client.post(f"/api/tasks/bulk?user_id={USER}", json={"tasks": [{"title": "x", "points": 1}]})
+    assert response.status_code == 403
+
+
+async def test_week_pages(client):
+    created = [(await create_task(client, title=f"Görev {n}"))["id"] for n in range(3)]
+    
+    first = (await client.get(f"/api/tasks/week?user_id={ADMIN}&limit=2")).json()
+    second = (await client.get(
+        f"/api/tasks/week?user_id={ADMIN}&limit=2&after={first['next_cursor']}"
+    )).json()
+    assert [t["id"] for t in first["tasks"] + second["tasks"]] == created
+    assert second["next_cursor"] is None
+    
+    response = await client.get(f"/api/tasks/week?user_id={ADMIN}&after=bozuk")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Geçersiz sayfa imleci"
+
+async def test_task_rules(client):
+    response = await client.post(f"/api/task-rules?user_id={ADMIN}", json={
+        "title": "Bitki sulama", "points": 4, "days_of_week": [today_name()]
+    })
+    assert response.status_code == 200
+    rule = response.json()["rule"]
+    
+    rules = (await client.get(f"/api/task-rules?user_id={ADMIN}")).json()["rules"]
+    assert [r["id"] for r in rules] == [rule["id"]]
+    
+    today = (await client.get(f"/api/tasks/today?user_id={USER}")).json()["tasks"]
+    assert len(today) == 1 and today[0]["rule_id"] == rule["id"]
+    
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": today[0]["id"]})
+    assert response.status_code == 200
+    assert response.json()["new_points"] == 4
+    
+    # One generated day cannot be deleted on its own, and a week that does not exist is no task
+    response = await client.post(f"/api/tasks/{today[0]['id']}/delete?user_id={ADMIN}")
+    assert response.status_code == 400
+    response = await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": f"{rule['id']}@2026-W99-1"})
+    assert response.status_code == 404
+    
+    response = await client.post(f"/api/task-rules/{rule['id']}/delete?user_id={ADMIN}")
+    assert response.status_code == 200
+    assert (await client.get(f"/api/tasks/today?user_id={USER}")).json()["tasks"] == []
+
+
+async def test_etag_revalidation(client):
+    task = await create_task(client)
+    
+    first = await client.get(f"/api/tasks/today?user_id={USER}")
+    etag = first.headers["etag"]
+    response = await client.get(f"/api/tasks/today?user_id={USER}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    
+    await client.post("/api/tasks/complete", json={"user_id": USER, "task_id": task["id"]})
+    response = await client.get(f"/api/tasks/today?user_id={USER}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["tasks"][0]["is_completed"]
+    
+    user = await client.get(f"/api/users/{USER}")
+    response = await client.get(f"/api/users/{USER}", headers={"If-None-Match": user.headers["etag"]})
+    assert response.status_code == 304
+
+
+async def test_batch_completion_is_idempotent(client):
+    first = await create_task(client, points=10)
+    second = await create_task(client, points=20, is_weekly=True)
+    batch = {"user_id": USER, "completions": [
+        {"task_id": first["id"], "idempotency_key": "k1"},
+        {"task_id": second["id"], "idempotency_key": "k2"},
+        {"task_id": "task_missing", "idempotency_key": "k3"}
+    ]}
+    
+    response = await client.post("/api/tasks/complete/batch", json=batch)
+    assert response.status_code == 200
+    body = response.json()
+    assert [r["success"] for r in body["results"]] == [True, True, False]
+    assert body["user"]["points"] == 30
+    
+    replay = (await client.post("/api/tasks/complete/batch", json=batch)).json()
+    assert [r["replayed"] for r in replay["results"]] == [True, True, True]
+    assert [r["success"] for r in replay["results"]] == [True, True, False]
+    assert (await client.get(f"/api/users/{USER}")).json()["points"] == 30
+    
+    again = (await client.post("/api/tasks/complete/batch", json={"user_id": USER, "completions": [
+        {"task_id": first["id"], "idempotency_key": "k4"}
+    ]})).json()
+    assert again["results"][0]["error"] == "Bu görev zaten tamamlanmış"
+
+
+async def test_concurrent_replays_apply_a_batch_once(client, store, monkeypatch):
+    task = await create_task(client, points=10)
+    batch = {"user_id": USER, "completions": [{"task_id": task["id"], "idempotency_key": "k1"}]}
+    record_many = store.completions.record_many
+    
+    async def slow_record_many(*args):
+        await asyncio.sleep(0.1)
+        return await record_many(*args)
+    monkeypatch.setattr(store.completions, "record_many", slow_record_many)
+    
+    first, second = await asyncio.gather(
+        client.post("/api/tasks/complete/batch", json=batch),
+        client.post("/api/tasks/complete/batch", json=batch)
+    )
+    assert first.status_code == second.status_code == 200
+    assert first.json()["results"][0]["replayed"] is False
+    assert second.json()["results"][0]["replayed"] is True
+    assert second.json()["results"][0]["success"] is True
+    assert second.json()["results"][0]["completed_date"] == first.json()["results"][0]["completed_date"]
+    assert (await store.users.get(USER))["points"] == 10
+
+
+async def test_failed_batch_releases_its_keys(client, store, monkeypatch):
+    task = await create_task(client, points=10)
+    batch = {"user_id": USER, "completions": [{"task_id": task["id"], "idempotency_key": "k1"}]}
+    increment = store.users.increment
+    
+    async def vanished(user_id, increments):
+        await asyncio.sleep(0.1)
+    monkeypatch.setattr(store.users, "increment", vanished)
+    
+    first, second = await asyncio.gather(
+        client.post("/api/tasks/complete/batch", json=batch),
+        client.post("/api/tasks/complete/batch", json=batch)
+    )
+    assert first.status_code == 404
+    assert second.status_code == 409
+    
+    monkeypatch.setattr(store.users, "increment", increment)
+    retry = await client.post("/api/tasks/complete/batch", json=batch)
+    assert retry.json()["results"][0]["success"] is True
+    assert retry.json()["results"][0]["replayed"] is False
+
+async def test_daily_check(client, store):
+    response = await client.post(f"/api/daily-check?user_id={USER}")
+    assert response.status_code == 200
+    assert response.json()["new_health"] == 13
+    assert not response.json()["health_reduced"]
+    
+    response = await client.post(f"/api/daily-check?user_id={USER}")
+    assert response.json() == {"checked": True, "health": 13}
+    
+    response = await client.post("/api/daily-check?user_id=user_missing")
+    assert response.status_code == 404
+
+
+async def test_daily_check_reports_a_loss_once(client, store):
+    today = server.get_turkey_now()
+    yesterday = today - timedelta(days=1)
+    task = server.TaskCreate(title="Bulaşık", points=10, day_of_week=server.get_turkish_day_name(yesterday.weekday()))
+    await store.tasks.insert(server.build_task_document(task, yesterday, server.DEFAULT_HOUSEHOLD))
+    store.users.by_id[USER]["last_check_date"] = yesterday.strftime("%Y-%m-%d")
+    
+    response = await client.post(f"/api/daily-check?user_id={USER}")
+    assert response.json()["health_reduced"] and response.json()["new_health"] == 12
+    
+    # A reload the same day must not warn again
+    response = await client.post(f"/api/daily-check?user_id={USER}")
+    assert response.json() == {"checked": True, "health": 12}
+    assert (await client.get(f"/api/users/{USER}")).json()["health"] == 12
+
+
+async def test_user_body_follows_its_version(client, store):
+    first = await client.get(f"/api/users/{USER}")
+    
+    # Another worker awards points: its version bump reaches us, our user cache is still warm
+    await store.users.increment(USER, {"points": 5})
+    await server.bump_versions([server.user_version_key(USER)])
+    
+    response = await client.get(f"/api/users/{USER}", headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 200
+    assert response.json()["points"] == first.json()["points"] + 5
+
+
+async def test_new_household_gets_default_rewards(client, store):
+    await store.users.insert_many([dict(server.DEFAULT_USERS[1], id="user_other", household_id="other")])
+    
+    rewards = (await client.get("/api/rewards?user_id=user_other")).json()["rewards"]
+    assert [r["level"] for r in rewards] == [r["level"] for r in server.default_rewards()]
+    
+    # Deleting every reward is an edit, not an empty table to seed again
+    for reward in rewards:
+        await client.delete(f"/api/rewards/{reward['level']}?user_id=user_other")
+    server.reward_tables.clear()
+    assert (await client.get("/api/rewards?user_id=user_other")).json()["rewards"] == []
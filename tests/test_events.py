@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+import server
+
+from .conftest import USER
+
+pytestmark = pytest.mark.anyio
+
+
+class EventStream:
+    """GET /api/events straight through the ASGI app
+    
+    httpx's ASGITransport returns only once the body is complete, which an
+    event stream never is - so chunks are read as the app sends them.
+    """
+    
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.chunks = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        self.status = None
+    
+    async def __aenter__(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/api/events", "raw_path": b"/api/events", "root_path": "",
+            "query_string": f"user_id={self.user_id}".encode(), "headers": [(b"host", b"test")],
+            "client": ("127.0.0.1", 50000), "server": ("test", 80)
+        }
+        self.app = asyncio.create_task(server.app(scope, self.receive, self.send))
+        assert await self.read() == "retry: 3000\n\n"
+        return self
+    
+    async def __aexit__(self, *exc):
+        self.disconnected.set()
+        await asyncio.wait_for(self.app, 1)
+    
+    async def receive(self):
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+    
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message.get("body"):
+            await self.chunks.put(message["body"].decode())
+    
+    async def read(self) -> str:
+        return await asyncio.wait_for(self.chunks.get(), 1)
+
+
+async def test_thousand_subscribers():
+    broker = server.EventBroker(queue_size=10)
+    queues = {f"user_{n}": broker.subscribe(f"user_{n}", f"household_{n % 10}") for n in range(1000)}
+    assert broker.subscriber_count() == 1000
+    
+    await broker.publish({"type": "tasks", "household_id": "household_3", "user_id": None})
+    await broker.publish({"type": "user", "household_id": "household_4", "user_id": "user_4"})
+    
+    received = {user_id: queue.qsize() for user_id, queue in queues.items()}
+    assert sum(received.values()) == 101
+    assert all(received[f"user_{n}"] == 1 for n in range(3, 1000, 10))
+    assert received["user_4"] == 1
+    
+    for user_id, queue in queues.items():
+        broker.unsubscribe(user_id, f"household_{int(user_id[5:]) % 10}", queue)
+    assert broker.subscriber_count() == 0 and not broker._members
+
+
+class FlakyEvents:
+    """A change stream that drops once, comes back with one event, then turns out unsupported"""
+    change_streams = True
+    
+    def __init__(self):
+        self.opened = 0
+    
+    async def watch(self):
+        self.opened += 1
+        if self.opened == 1:
+            raise ConnectionFailure("connection reset")
+        if self.opened == 2:
+            yield None
+            yield {"type": "user", "household_id": "h", "user_id": "u"}
+            raise ConnectionFailure("connection reset")
+        raise OperationFailure("not a replica set", code=server.CHANGE_STREAMS_UNSUPPORTED)
+
+
+async def test_listen_reopens_a_dropped_change_stream(store, monkeypatch):
+    events = FlakyEvents()
+    monkeypatch.setattr(store, "events", events)
+    monkeypatch.setattr(server, "EVENT_RETRY_MIN_SECONDS", 0)
+    broker = server.EventBroker(queue_size=10)
+    queue = broker.subscribe("u", "h")
+    
+    await broker.listen()
+    
+    assert events.opened == 3
+    assert not broker.fanout
+    assert queue.get_nowait() == {"type": "resync", "user_id": "u"}
+    assert queue.get_nowait()["type"] == "user"
+    assert queue.empty()
+
+
+async def test_stream_sends_heartbeats_between_events(store, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_HEARTBEAT_SECONDS", 0.01)
+    async with EventStream(USER) as stream:
+        assert stream.status == 200
+        assert await stream.read() == ": heartbeat\n\n"
+        
+        await server.event_broker.publish({"type": "user", "household_id": "default", "user_id": USER})
+        chunk = await stream.read()
+        while chunk == ": heartbeat\n\n":
+            chunk = await stream.read()
+        assert chunk.startswith("event: user\ndata: ")
+
+
+async def test_disconnect_removes_the_subscriber(store):
+    assert server.event_broker.subscriber_count() == 0
+    async with EventStream(USER):
+        assert server.event_broker.subscriber_count() == 1
+    assert server.event_broker.subscriber_count() == 0
+    assert not server.event_broker._members
+
+
+async def test_slow_stream_gets_a_resync_instead_of_a_backlog(store, monkeypatch):
+    broker = server.EventBroker(queue_size=2)
+    monkeypatch.setattr(server, "event_broker", broker)
+    async with EventStream(USER) as stream:
+        # No await in between - the stream cannot drain its queue
+        for n in range(5):
+            broker.dispatch({"type": "user", "household_id": "default", "user_id": USER, "n": n})
+        
+        assert await stream.read() == f'event: resync\ndata: {{"type": "resync", "user_id": "{USER}"}}\n\n'
+        assert stream.chunks.empty()
+    assert broker.subscriber_count() == 0
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+import pytest
+
+import server
+from storage import CountingStore
+
+from .conftest import USER
+
+pytestmark = pytest.mark.anyio
+
+
+async def missed_days_calls(store, days: int) -> list:
+    """Calls made by one daily check after `days` days with a task and no completion"""
+    today = server.get_turkey_now()
+    for n in range(1, days + 1):
+        day = today - timedelta(days=n)
+        task = server.TaskCreate(title="Bulaşık", points=10, day_of_week=server.get_turkish_day_name(day.weekday()))
+        await store.tasks.insert(server.build_task_document(task, day, server.DEFAULT_HOUSEHOLD))
+    store.users.by_id[USER]["last_check_date"] = (today - timedelta(days=days)).strftime("%Y-%m-%d")
+    
+    calls = []
+    server.set_store(CountingStore(store, calls.append))
+    response = await server.daily_health_check(USER)
+    assert response["health_reduced"]
+    return calls
+
+
+async def test_missed_days_take_a_fixed_number_of_calls(store):
+    one_day = await missed_days_calls(store, 1)
+    assert store.users.by_id[USER]["health"] == 12
+    
+    fresh = server.MemoryStore()
+    server.set_store(fresh)
+    await server.run_migrations()
+    thirty_days = await missed_days_calls(fresh, 30)
+    assert fresh.users.by_id[USER]["health"] == 0
+    assert fresh.users.by_id[USER]["game_over"]
+    
+    assert thirty_days == one_day
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+import pytest
+
+import server
+from storage import CountingStore
+
+from .conftest import USER
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_legacy_task_ids_are_renamed_with_their_completions(store):
+    legacy = [f"task_1700000000.{n:06d}" for n in range(3)]
+    task = server.TaskCreate(title="Bulaşık", points=10, day_of_week="Pazartesi")
+    for task_id in legacy:
+        await store.tasks.insert(dict(
+            server.build_task_document(task, server.get_turkey_now(), server.DEFAULT_HOUSEHOLD), id=task_id
+        ))
+        await store.completions.insert({
+            "id": f"{USER}_{task_id}_2026-01-05", "household_id": server.DEFAULT_HOUSEHOLD,
+            "user_id": USER, "task_id": task_id, "completed_date": "2026-01-05"
+        })
+    
+    await server.migrate_task_ids()
+    
+    assert await store.tasks.legacy_ids() == []
+    task_ids = await store.completions.task_ids(server.DEFAULT_HOUSEHOLD, USER)
+    assert len(task_ids) == 3 and not task_ids & set(legacy)
+    for task_id in task_ids:
+        assert await store.tasks.get(task_id)
+    for completion in store.completions.by_key.values():
+        assert completion["id"] == f"{USER}_{completion['task_id']}_2026-01-05"
+
+
+async def test_rollup_backfill_looks_tasks_up_in_one_query(store):
+    yesterday = server.get_turkey_now() - timedelta(days=1)
+    day = yesterday.strftime("%Y-%m-%d")
+    task = server.TaskCreate(title="Bulaşık", points=10, day_of_week="Pazartesi")
+    tasks = [server.build_task_document(task, yesterday, server.DEFAULT_HOUSEHOLD) for _ in range(20)]
+    for doc in tasks[:15]:
+        await store.tasks.insert(doc)
+    await store.archive.save_tasks(tasks[15:])
+    for doc in tasks:
+        await store.completions.insert({
+            "id": f"{USER}_{doc['id']}_{day}", "household_id": server.DEFAULT_HOUSEHOLD,
+            "user_id": USER, "task_id": doc["id"], "completed_date": day
+        })
+    
+    calls = []
+    server.set_store(CountingStore(store, calls.append))
+    await server.migrate_backfill_rollups()
+    
+    assert calls.count("tasks.find_many") == 1 and calls.count("archive.find_tasks") == 1
+    assert "tasks.get" not in calls
+    [rollup] = await store.rollups.between(server.DEFAULT_HOUSEHOLD, USER, day, day)
+    assert rollup["completed"] == 20 and rollup["points"] == 200
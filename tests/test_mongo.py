@@ -0,0 +1,66 @@
+"""Storage paths only a real MongoDB can run ($merge, explain) - skipped without MONGO_URL"""
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import query_audit
+import server
+
+pytestmark = [
+    pytest.mark.anyio,
+    pytest.mark.skipif(not os.environ.get("MONGO_URL"), reason="needs MONGO_URL"),
+]
+
+
+@pytest.fixture
+async def mongo_store():
+    """A MongoStore on a throwaway database, dropped afterwards"""
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    database = client[f"test_{uuid.uuid4().hex[:8]}"]
+    store = server.MongoStore(database)
+    await store.ensure_indexes()
+    yield store
+    await client.drop_database(database.name)
+    client.close()
+
+
+async def test_clone_week_counts_only_its_own_clones(mongo_store):
+    now = server.get_turkey_now()
+    source = tuple(now.isocalendar()[:2])
+    for title in ("Bulaşık", "Çamaşır"):
+        task = server.TaskCreate(title=title, points=5, day_of_week="Pazartesi")
+        await mongo_store.tasks.insert(server.build_task_document(task, now, server.DEFAULT_HOUSEHOLD))
+    target = (2030, 5)
+    # Tasks written to the target week by anyone else are not clones of this call
+    unrelated = server.build_task_document(server.TaskCreate(title="Çöp", points=1), now, server.DEFAULT_HOUSEHOLD)
+    await mongo_store.tasks.insert(dict(unrelated, year=target[0], week_number=target[1]))
+    
+    first = await mongo_store.tasks.clone_week(server.DEFAULT_HOUSEHOLD, source, target, now.isoformat())
+    assert first == {"matched": 2, "inserted": 2}
+    again = await mongo_store.tasks.clone_week(server.DEFAULT_HOUSEHOLD, source, target, now.isoformat())
+    assert again == {"matched": 2, "inserted": 0}
+
+
+async def test_query_plans_stay_within_budget():
+    args = query_audit.parse_args(["--households", "5"])
+    results = await query_audit.run(os.environ["MONGO_URL"], f"test_{uuid.uuid4().hex[:8]}", args)
+    assert [r["name"] for r in results if r["failures"]] == []
+
+
+async def test_per_user_documents_join_their_users_household(mongo_store):
+    database = mongo_store.db
+    await database.users.insert_many([{"id": "user_a", "household_id": "h1"}, {"id": "user_b", "household_id": "h2"}])
+    for user_id in ("user_a", "user_b"):
+        await database.daily_rollups.insert_one({"user_id": user_id, "date": "2026-01-05", "points": 10})
+        await database.weekly_summaries.insert_one({"user_id": user_id, "year": 2026, "week_number": 2})
+        await database.idempotency_keys.insert_one({"user_id": user_id, "key": "k1", "result": {"success": True}})
+    
+    await mongo_store.backfill_user_household()
+    
+    for household_id, user_id in (("h1", "user_a"), ("h2", "user_b")):
+        assert len(await mongo_store.rollups.between(household_id, user_id, "2026-01-01", "2026-01-31")) == 1
+        assert len(await mongo_store.archive.user_summaries(household_id, user_id)) == 1
+        assert await mongo_store.idempotency.get_many(household_id, user_id, ["k1"]) == {"k1": {"success": True}}
+    assert await mongo_store.rollups.between("h1", "user_b", "2026-01-01", "2026-01-31") == []
@@ -0,0 +1,19 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def http_scope(path: str, accept: str = "application/json") -> dict:
+    return {"type": "http", "path": path, "headers": [(b"accept", accept.encode())]}
+
+
+async def test_streaming_requests_are_never_sampled(monkeypatch):
+    monkeypatch.setattr(server, "PROFILE_SAMPLE_RATE", 1.0)
+    middleware = server.ProfilingMiddleware(server.app)
+    
+    assert await middleware._wanted(http_scope("/api/dashboard")) == "sample"
+    assert await middleware._wanted(http_scope("/api/events")) is None
+    assert await middleware._wanted(http_scope("/api/events", "text/event-stream")) is None
+    assert await middleware._wanted(http_scope("/api/tasks", server.NDJSON)) is None